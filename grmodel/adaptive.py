@@ -0,0 +1,96 @@
+"""
+Convergence-driven sampling. Chains are run in blocks until R-hat and the effective sample size
+of the key parameters meet their targets, so easy fits stop early and hard ones get more draws.
+"""
+import logging
+import numpy as np
+import pymc3 as pm
+from pymc3.backends.base import MultiTrace
+from pymc3.backends.ndarray import NDArray
+
+keyParams = ["div", "deathRate", "apopfrac", "EmaxGrowth", "IC50"]
+
+
+def mergeTraces(traces):
+    """ Concatenate the draws and sampler stats of each chain over several traces of the same model. """
+    merged = []
+
+    for chain in traces[0].chains:
+        parts = [trace._straces[chain] for trace in traces]  # pylint: disable=protected-access
+
+        strace = NDArray(model=parts[0].model, vars=parts[0].vars)
+        strace.chain = chain
+        strace.samples = {v: np.concatenate([p.samples[v] for p in parts]) for v in parts[0].varnames}
+        strace.draws = strace.draw_idx = sum(len(p) for p in parts)
+
+        strace.sampler_vars = parts[0].sampler_vars
+        if parts[0]._stats is not None:  # pylint: disable=protected-access
+            strace._stats = [  # pylint: disable=protected-access
+                {key: np.concatenate([p._stats[ii][key] for p in parts]) for key in stats}  # pylint: disable=protected-access
+                for ii, stats in enumerate(parts[0]._stats)  # pylint: disable=protected-access
+            ]
+
+        merged.append(strace)
+
+    return MultiTrace(merged)
+
+
+def convergence(trace, varnames, model):
+    """ Worst R-hat and smallest bulk ESS over every element of varnames. """
+    with model:
+        rhat = pm.rhat(trace, var_names=varnames)
+        ess = pm.ess(trace, var_names=varnames)
+
+    return max(float(np.max(rhat[name].values)) for name in varnames), min(float(np.min(ess[name].values)) for name in varnames)
+
+
+def lastPoints(trace, model):
+    """ Final draw of each chain, restricted to the free variables, to start the next block from. """
+    free = {rv.name for rv in model.free_RVs}
+    return [{name: value for name, value in trace.point(-1, chain=chain).items() if name in free} for chain in trace.chains]
+
+
+def tunedStep(trace, model, target_accept):
+    """
+    NUTS step that starts where the adaptation of trace ended: a diagonal mass matrix from the variance of the draws
+    on the unconstrained scale, and the mean over chains of the final adapted step size.
+    """
+    draws = np.concatenate([np.reshape(trace.get_values(v.name), (len(trace) * trace.nchains, -1)) for v in model.vars], axis=1)
+    stepSize = np.mean([stats[-1] for stats in trace.get_sampler_stats("step_size_bar", combine=False)])
+
+    # NUTS divides step_scale by the fourth root of the dimension
+    return pm.NUTS(vars=model.vars, model=model, scaling=np.var(draws, axis=0), is_cov=True, step_scale=stepSize * draws.shape[1] ** 0.25, target_accept=target_accept)
+
+
+def adaptiveSample(model, varnames=None, rhatTarget=1.01, essTarget=400, block=500, maxDraws=5000, tune=1000, retune=0, chains=2, init="advi+adapt_diag", **kwargs):
+    """
+    Sample in blocks of block draws per chain until every element of varnames has R-hat below rhatTarget
+    and ESS above essTarget, or maxDraws per chain have been taken. varnames defaults to the keyParams in the model.
+
+    NUTS is initialized once and tuned over the tune steps of the first block. Each later block continues every chain
+    from its last draw, with the mass matrix estimated from the draws so far and the step size the first block ended
+    with, as the adapted state of multiprocess chains is not passed back. These blocks run retune further tuning steps
+    of the step size, none by default. Returns one MultiTrace with the draws of all blocks.
+    """
+    targetAccept = kwargs.pop("target_accept", 0.8)
+    with model:
+        start, step = pm.init_nuts(init=init, chains=chains, model=model, progressbar=False, target_accept=targetAccept)
+
+    if varnames is None:
+        varnames = [name for name in keyParams if name in model.named_vars]
+
+    traces = []
+    ntune = tune
+    while True:
+        traces.append(pm.sample(draws=block, tune=ntune, chains=chains, step=step, start=start, model=model, compute_convergence_checks=False, **kwargs))
+        trace = mergeTraces(traces)
+
+        rhat, ess = convergence(trace, varnames, model)
+        logging.info("Adaptive sampling at %d draws per chain: R-hat %.3f, ESS %.0f", len(trace), rhat, ess)
+
+        if (rhat < rhatTarget and ess > essTarget) or len(trace) + block > maxDraws:
+            return trace
+
+        start = lastPoints(traces[-1], model)
+        step = tunedStep(trace, model, targetAccept)
+        ntune = retune
@@ -0,0 +1,85 @@
+"""
+Benchmarks comparing the sampling efficiency of model variants.
+"""
+import time
+import numpy as np
+import pandas as pd
+import pymc3 as pm
+from .pymcGrowth import GrowthModel, build_model
+from .numbaGrowth import build_model as numbaModel, NumbaGrowthPosterior
+
+
+def samplerEfficiency(trace, runtime, varnames):
+    """ Summarize the NUTS effort and effective sample rate of a trace. """
+    ess = pm.ess(trace, var_names=varnames)
+    minESS = min(float(np.min(ess[name].values)) for name in varnames)
+
+    return {
+        "steps_per_draw": np.mean(trace.get_sampler_stats("tree_size")),
+        "divergences": int(np.sum(trace.get_sampler_stats("diverging"))),
+        "min_ess": minESS,
+        "ess_per_s": minESS / runtime,
+        "runtime": runtime,
+    }
+
+
+def growthParameterization(loadFile="101117_H1299", init="advi+adapt_diag", tune=1000, reducedTune=500):
+    """
+    Compare the original and rescaled growth model with the same init and tuning steps.
+    A last row runs the rescaled model with only reducedTune tuning steps.
+    """
+    classM = GrowthModel(loadFile)
+    results = []
+
+    for rescaled, ntune in ((False, tune), (True, tune), (True, reducedTune)):
+        start = time.time()
+        classM.performFit(rescaled=rescaled, init=init, tune=ntune)
+        runtime = time.time() - start
+
+        stats = samplerEfficiency(classM.samples, runtime, ["div", "deathRate", "apopfrac"])
+        stats.update({"rescaled": rescaled, "init": init, "tune": ntune})
+        results.append(stats)
+
+    return pd.DataFrame(results)
+
+
+def gradientLatency(loadFile="101117_H1299", repeats=1000):
+    """ Time per log density and gradient evaluation of the growth model with the Theano and Numba backends. """
+    classM = GrowthModel(loadFile)
+    results = []
+
+    def timeCalls(name, func, x):
+        func(x)
+        start = time.time()
+        for _ in range(repeats):
+            func(x)
+        results.append({"backend": name, "us_per_gradient": 1e6 * (time.time() - start) / repeats})
+
+    # Both as compiled by pymc3, including the Theano call overhead
+    for name, model in (("theano", build_model(classM.conv0, classM.doses, classM.timeV, classM.expTable)), ("numba", numbaModel(classM.conv0, classM.timeV, classM.expTable))):
+        func = model.logp_dlogp_function()
+        func.set_extra_values({})
+        timeCalls(name, func, func.dict_to_array(model.test_point))
+
+    # The Numba kernel alone
+    posterior = NumbaGrowthPosterior(classM.conv0, classM.timeV, classM.expTable)
+    timeCalls("numba kernel", posterior.valueAndGrad, posterior.start())
+
+    return pd.DataFrame(results)
+
+
+def growthBackends(loadFile="101117_H1299", tune=1000):
+    """ Compare end-to-end fits of the growth model with the Theano and Numba backends. """
+    classM = GrowthModel(loadFile)
+    results = []
+
+    for backend in ("theano", "numba"):
+        start = time.time()
+        classM.performFit(backend=backend, tune=tune)
+        runtime = time.time() - start
+
+        stats = samplerEfficiency(classM.samples, runtime, ["div", "deathRate", "apopfrac"])
+        stats.update({"backend": backend, "tune": tune})
+        results.append(stats)
+
+    return pd.DataFrame(results)
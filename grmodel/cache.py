@@ -0,0 +1,79 @@
+"""
+Bounded in-memory caching of parsed experiments and posterior results.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import RLock
+
+
+class LRUCache:
+    """ Mapping that holds at most maxsize items, evicting the least recently used. """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = RLock()
+        self.pending = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def __len__(self):
+        with self.lock:
+            return len(self.data)
+
+    def get(self, key, compute=None):
+        """
+        Return the item for key. On a miss, compute() is called and its result stored, if given.
+        compute runs outside the lock so other lookups are not held up, and concurrent misses on the
+        same key wait for the first one's result rather than computing it again.
+        """
+        with self.lock:
+            if key in self.data:
+                self.hits += 1
+                self.data.move_to_end(key)
+                return self.data[key]
+
+            self.misses += 1
+            if compute is None:
+                raise KeyError(key)
+
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as err:
+            with self.lock:
+                del self.pending[key]
+            future.set_exception(err)
+            raise
+
+        with self.lock:
+            self.put(key, value)
+            del self.pending[key]
+
+        future.set_result(value)
+        return value
+
+    def put(self, key, value):
+        """ Store an item, evicting the oldest ones beyond maxsize. """
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        """ Remove all items. """
+        with self.lock:
+            self.data.clear()
@@ -0,0 +1,113 @@
+"""
+Simulation-based comparison of imaging schedules and dose grids.
+Synthetic plates are generated with the vectorized growth model, every plate is fit with a Laplace approximation of
+numpyGrowth.GrowthPosterior, and the posterior widths of div, deathRate and apopfrac are reported for each design.
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from .pymcGrowth import numpyCore, convSignal
+from .numpyGrowth import GrowthPosterior
+from .laplace import findModes, laplaceCov
+from .summaries import drawSummary
+
+# Drug response used to simulate plates, on the scale of the H1299 experiments
+defaultTruth = {"IC50": 10.0, "hill": 1.5, "EmaxGrowth": 0.8, "EmaxDeath": 0.02, "divCon": 0.03, "deathCon": 0.001, "apopfrac": 0.6, "d": 0.01, "conv0": 10.0}
+
+rateNames = ("div", "deathRate", "apopfrac")
+
+
+def schedule(interval, duration=72.0):
+    """ Imaging times every interval hours from the start to duration. """
+    return np.arange(0.0, duration + interval / 2.0, interval)
+
+
+def hillRates(doses, truth):
+    """ div, deathRate and apopfrac at every dose, from one Hill curve as in doseResponsePriors. """
+    doses = np.asarray(doses, dtype=np.float64)
+    occupancy = doses ** truth["hill"] / (doses ** truth["hill"] + truth["IC50"] ** truth["hill"])
+
+    div = truth["divCon"] * (1.0 - truth["EmaxGrowth"] * occupancy)
+    deathRate = truth["deathCon"] + truth["EmaxDeath"] * occupancy
+
+    return div, deathRate, np.full(doses.shape, truth["apopfrac"])
+
+
+def simulatePlate(timeV, doses, truth, noise, random):
+    """
+    Confluence, apoptosis and DNA signals of one plate, as (dose, time) arrays, with the conversions at their prior
+    centers and Gaussian noise of sd noise times the mean of each channel.
+    """
+    div, deathRate, apopfrac = hillRates(doses, truth)
+    conv0 = truth["conv0"]
+
+    conversions = ((conv0, conv0 * np.exp(-2.06), conv0 * np.exp(-1.85)), (0.1, 0.1))
+    signals = convSignal(*numpyCore(timeV, div, deathRate, apopfrac, truth["d"]), conversions)
+
+    return {key: value + random.normal(scale=noise * np.mean(np.abs(value)), size=value.shape) for key, value in zip(("confl", "apop", "dna"), signals)}
+
+
+def fitPlate(timeV, expTable, draws=1000, starts=40, seed=None):
+    """
+    Laplace approximation of the growth model posterior of one plate, from multi-start L-BFGS.
+    Returns draws of div, deathRate and apopfrac, each (draws, condition).
+    Raises RuntimeError if the optimization finds no finite optimum from any start.
+    """
+    random = np.random.RandomState(seed)
+
+    # As GrowthModel, center the confluence conversion on the initial confluence
+    post = GrowthPosterior(np.mean(expTable["confl"][:, 0]), timeV, expTable)
+
+    modes = findModes(post.logp, post.priorDraws(starts, random))[0]
+    if len(modes) == 0:
+        raise RuntimeError("No finite optimum of the growth posterior from {} starts.".format(starts))
+
+    z = random.multivariate_normal(modes[0], laplaceCov(post.logp, modes[0]), size=draws)
+    params = post.unpack(z)
+
+    return {name: params[name] for name in rateNames}
+
+
+def designJob(job):
+    """ Simulate and fit one plate of a design, returning a table row per rate and dose, or no rows if the fit failed. """
+    name, grid, timeV, doses, truth, noise, level, seed = job
+    random = np.random.RandomState(seed)
+
+    try:
+        samples = fitPlate(timeV, simulatePlate(timeV, doses, truth, noise, random), seed=seed)
+    except RuntimeError as err:
+        logging.warning("Skipping replicate %d of schedule %s and grid %s: %s", seed, name, grid, err)
+        return pd.DataFrame()
+
+    rows = []
+    for param, true in zip(rateNames, hillRates(doses, truth)):
+        median, lower, upper = drawSummary(samples[param], (level,))
+        rows.append(pd.DataFrame({
+            "schedule": name, "grid": grid, "seed": seed, "timepoints": timeV.size, "parameter": param,
+            "dose": doses, "truth": true, "median": median, "width": upper[0] - lower[0],
+        }))
+
+    return pd.concat(rows, ignore_index=True)
+
+
+def compareDesigns(schedules, doseGrids, truth=None, replicates=4, noise=0.05, level=0.9, max_workers=None, seed=0):
+    """
+    Simulate and fit replicates plates for every combination of an imaging schedule and a dose grid, in a process pool.
+    schedules and doseGrids are dicts of time vectors (e.g. from schedule) and of dose vectors by name.
+    Returns a table of the posterior median and central level interval width of every rate, dose and plate.
+    """
+    truth = dict(defaultTruth, **(truth or dict()))
+    jobs = []
+    for name, timeV in schedules.items():
+        for grid, doses in doseGrids.items():
+            jobs += [(name, grid, np.asarray(timeV, dtype=np.float64), np.asarray(doses, dtype=np.float64), truth, noise, level, seed + ii) for ii in range(replicates)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return pd.concat(executor.map(designJob, jobs), ignore_index=True)
+
+
+def designSummary(df):
+    """ Mean interval width and absolute error of each rate for every design, from compareDesigns. """
+    df = df.assign(error=np.abs(df["median"] - df["truth"]))
+    return df.groupby(["schedule", "grid", "timepoints", "parameter"])[["width", "error"]].mean().reset_index()
@@ -0,0 +1,262 @@
+"""
+Dispatch of fit jobs to interchangeable executors, with every result written to a shared posterior store.
+
+A job is a (kind, loadFile, kwargs) tuple, with kind "growth", "interaction" or "legacy"; interaction
+jobs need drug1 and drug2, or a list of drugs, in kwargs, and legacy jobs name an experiment of the
+legacy archive, see legacyData.legacyJobs. The backends are:
+    LocalExecutor: a process pool on this machine
+    QueueExecutor: an SQLite job queue that workers on any node sharing the file system poll
+    DaskExecutor: a dask.distributed cluster, if dask is installed
+All of them can be tried on one machine, e.g. with QueueExecutor.startWorkers.
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Process
+from threading import Thread, Event
+from .results import FitResult, fitGrowth, fitInteraction, fitLegacy
+
+
+def jobKey(job):
+    """ Name of a job, which is also the name of its result in the store. """
+    kind, loadFile, kwargs = job
+    return "-".join([kind, loadFile] + [str(kwargs[k]) for k in sorted(kwargs)]).replace("/", "_")
+
+
+def runJob(job):
+    """ Fit a single job and return its FitResult. """
+    kind, loadFile, kwargs = job
+
+    if kind == "growth":
+        return fitGrowth(loadFile, **kwargs)
+    if kind == "interaction":
+        return fitInteraction(loadFile, **kwargs)
+    if kind == "legacy":
+        return fitLegacy(loadFile, **kwargs)
+
+    raise ValueError("Unknown job kind " + str(kind))
+
+
+class PosteriorStore:
+    """ Directory of FitResult files, named by job key, that every worker writes to. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        """ File of the result for key. """
+        return os.path.join(self.directory, key + ".npz")
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def save(self, key, result):
+        """ Write a result, renaming into place so readers never see a partial file. """
+        tmpfile = self.path(key) + "." + str(os.getpid()) + ".tmp.npz"
+        result.save(tmpfile)
+        os.replace(tmpfile, self.path(key))
+
+    def load(self, key):
+        """ Read the result for key. """
+        return FitResult.load(self.path(key))
+
+
+def storeJob(job, directory):
+    """ Run a job and save its result, returning only the key so nothing large is sent back. """
+    key = jobKey(job)
+    PosteriorStore(directory).save(key, runJob(job))
+    return key
+
+
+class LocalExecutor:
+    """ Runs jobs in a local process pool. """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+
+    def map(self, jobs, store):
+        """ Run every job not already in store, returning the keys of all jobs. """
+        todo = [job for job in jobs if jobKey(job) not in store]
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(storeJob, todo, [store.directory] * len(todo)))
+
+        return [jobKey(job) for job in jobs]
+
+
+class QueueExecutor:
+    """
+    Job queue kept in an SQLite file. map adds the jobs and waits for them, while workers started on
+    any node with access to the file (and the store) claim queued jobs one at a time.
+    Workers refresh the updated time of their job while it runs, and a running job not updated for timeout
+    seconds is taken to have lost its worker and is queued again. A job is tried at most retries + 1 times.
+    """
+
+    def __init__(self, dbfile, poll=5.0, timeout=600.0, retries=2):
+        self.dbfile = dbfile
+        self.poll = poll
+        self.timeout = timeout
+        self.retries = retries
+
+        with closing(self.connect()) as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, job TEXT, status TEXT, worker TEXT, error TEXT, updated REAL, attempts INTEGER DEFAULT 0)"
+            )
+
+            # Queues made before attempts were counted
+            if "attempts" not in [row[1] for row in con.execute("PRAGMA table_info(jobs)")]:
+                con.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+
+    def connect(self):
+        """ New connection, waiting on locks held by other workers. """
+        return sqlite3.connect(self.dbfile, timeout=60.0, isolation_level=None)
+
+    def submit(self, jobs):
+        """ Queue jobs, leaving any already queued or finished alone, and giving failed ones their attempts again. """
+        rows = [(jobKey(job), json.dumps(job), time.time()) for job in jobs]
+
+        with closing(self.connect()) as con:
+            con.executemany("INSERT OR IGNORE INTO jobs VALUES (?, ?, 'queued', NULL, NULL, ?, 0)", rows)
+            con.executemany("UPDATE jobs SET status = 'queued', error = NULL, attempts = 0 WHERE key = ? AND status = 'failed'", [row[:1] for row in rows])
+
+    def status(self, keys=None):
+        """ Status of each job, as a dict by key. """
+        with closing(self.connect()) as con:
+            rows = con.execute("SELECT key, status FROM jobs").fetchall()
+
+        return {key: status for key, status in rows if keys is None or key in keys}
+
+    def errors(self, keys=None):
+        """ Last error of each failed job, as a dict by key. """
+        with closing(self.connect()) as con:
+            rows = con.execute("SELECT key, error FROM jobs WHERE status = 'failed'").fetchall()
+
+        return {key: error for key, error in rows if keys is None or key in keys}
+
+    def requeue(self, con):
+        """ Within a transaction on con, queue again the running jobs whose worker stopped updating them, or fail them if out of attempts. """
+        con.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts > ? THEN 'failed' ELSE 'queued' END, worker = NULL, error = 'worker stopped responding' "
+            "WHERE status = 'running' AND updated < ?",
+            (self.retries, time.time() - self.timeout),
+        )
+
+    def claim(self, worker):
+        """ Atomically mark the oldest queued job as running for worker, returning it or None. """
+        with closing(self.connect()) as con:
+            con.execute("BEGIN IMMEDIATE")
+            self.requeue(con)
+            row = con.execute("SELECT key, job FROM jobs WHERE status = 'queued' ORDER BY updated LIMIT 1").fetchone()
+            if row is not None:
+                con.execute("UPDATE jobs SET status = 'running', worker = ?, updated = ?, attempts = attempts + 1 WHERE key = ?", (worker, time.time(), row[0]))
+            con.execute("COMMIT")
+
+        return None if row is None else (row[0], tuple(json.loads(row[1])))
+
+    def heartbeat(self, key, worker, stop):
+        """ Refresh the updated time of the job worker is running until stop is set, so it is not requeued. """
+        while not stop.wait(self.timeout / 4.0):
+            with closing(self.connect()) as con:
+                con.execute("UPDATE jobs SET updated = ? WHERE key = ? AND worker = ? AND status = 'running'", (time.time(), key, worker))
+
+    def finish(self, key, worker, error=None):
+        """ Record that worker's job is done, or failed with error, in which case it is queued again while it has attempts left. """
+        with closing(self.connect()) as con:
+            if error is None:
+                con.execute("UPDATE jobs SET status = 'done', error = NULL, updated = ? WHERE key = ? AND worker = ?", (time.time(), key, worker))
+            else:
+                con.execute(
+                    "UPDATE jobs SET status = CASE WHEN attempts > ? THEN 'failed' ELSE 'queued' END, error = ?, updated = ? WHERE key = ? AND worker = ?",
+                    (self.retries, error, time.time(), key, worker),
+                )
+
+    def work(self, directory, stopWhenEmpty=True):
+        """ Worker loop: claim and run jobs, saving results to the store in directory. """
+        store = PosteriorStore(directory)
+        worker = socket.gethostname() + ":" + str(os.getpid())
+
+        while True:
+            claimed = self.claim(worker)
+
+            if claimed is None:
+                if stopWhenEmpty:
+                    return
+                time.sleep(self.poll)
+                continue
+
+            key, job = claimed
+            stop = Event()
+            beat = Thread(target=self.heartbeat, args=(key, worker, stop), daemon=True)
+            beat.start()
+
+            try:
+                store.save(key, runJob(job))
+                self.finish(key, worker)
+            except Exception as err:  # pylint: disable=broad-except
+                logging.exception("Job %s failed", key)
+                self.finish(key, worker, repr(err))
+            finally:
+                stop.set()
+                beat.join()
+
+    def startWorkers(self, directory, n=2):
+        """ Start n local worker processes, which exit once the queue is empty. """
+        workers = [Process(target=self.work, args=(directory,)) for _ in range(n)]
+        for process in workers:
+            process.start()
+        return workers
+
+    def map(self, jobs, store):
+        """
+        Queue the jobs not already in store and wait until all have finished, returning the keys of all jobs.
+        Raises as soon as any job has failed on every attempt.
+        """
+        keys = [jobKey(job) for job in jobs]
+        self.submit([job for job in jobs if jobKey(job) not in store])
+
+        while True:
+            with closing(self.connect()) as con:
+                con.execute("BEGIN IMMEDIATE")
+                self.requeue(con)
+                con.execute("COMMIT")
+
+            failed = {key: error for key, error in self.errors(keys).items() if key not in store}
+            if failed:
+                raise RuntimeError("Jobs failed: " + "; ".join(key + ": " + str(error) for key, error in failed.items()))
+
+            status = self.status(keys)
+            if not [key for key in keys if key not in store and status.get(key) in ("queued", "running")]:
+                return keys
+
+            time.sleep(self.poll)
+
+
+class DaskExecutor:
+    """ Runs jobs on a dask.distributed cluster, by default a new local one. Needs dask to be installed. """
+
+    def __init__(self, address=None):
+        from dask.distributed import Client  # pylint: disable=import-outside-toplevel
+
+        self.client = Client(address)
+
+    def map(self, jobs, store):
+        """ Run every job not already in store, returning the keys of all jobs. """
+        todo = [job for job in jobs if jobKey(job) not in store]
+        futures = self.client.map(storeJob, todo, [store.directory] * len(todo), pure=False)
+        self.client.gather(futures)
+
+        return [jobKey(job) for job in jobs]
+
+
+def fitAll(jobs, directory, executor=None):
+    """ Fit every job with executor (a LocalExecutor by default), returning the FitResults in job order. """
+    store = PosteriorStore(directory)
+    executor = LocalExecutor() if executor is None else executor
+
+    return [store.load(key) for key in executor.map(jobs, store)]
@@ -0,0 +1,65 @@
+"""
+Process-wide memoization of parsed experiments, so figure code that only needs the data reads each file once.
+The returned objects are shared between callers and must be treated as read-only; fit a fresh object instead.
+"""
+import os
+import pickle
+from glob import glob
+from os.path import join, dirname, abspath, getmtime
+from .cache import LRUCache
+from .pymcGrowth import GrowthModel
+from .pymcInteraction import drugInteractionModel
+
+dataDir = join(dirname(abspath(__file__)), "data")
+parsedCache = LRUCache(16)
+persistDir = None
+
+
+def persistTo(directory):
+    """ Also pickle parsed experiments under directory, so later processes can skip parsing. None turns this off. """
+    global persistDir  # pylint: disable=global-statement
+    persistDir = directory
+
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+
+
+def sourceVersion(loadFile):
+    """ Latest modification time of the data files of an experiment, so edited data is parsed again. """
+    files = [ff for folder in ("singles", "combinations", "") for ff in glob(join(dataDir, folder, loadFile + "_*"))]
+    return max((getmtime(ff) for ff in files), default=0.0)
+
+
+def cached(key, build):
+    """ Look up key in memory, then on disk if persisting, and only call build() on a miss in both. """
+
+    def load():
+        if persistDir is None:
+            return build()
+
+        filename = join(persistDir, "-".join(str(k) for k in key).replace("/", "_") + ".pkl")
+        try:
+            with open(filename, "rb") as handle:
+                version, value = pickle.load(handle)
+            if version == sourceVersion(key[1]):
+                return value
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            pass
+
+        value = build()
+        with open(filename, "wb") as handle:
+            pickle.dump((sourceVersion(key[1]), value), handle)
+
+        return value
+
+    return parsedCache.get(key, load)
+
+
+def growthData(loadFile, firstCols=2, comb=None, interval=True, overlap=False):
+    """ Parsed, unfitted GrowthModel of loadFile. """
+    return cached(("growth", loadFile, firstCols, comb, interval, overlap), lambda: GrowthModel(loadFile, firstCols=firstCols, comb=comb, interval=interval, overlap=overlap))
+
+
+def comboData(loadFile, drug1, drug2, wells=False):
+    """ Parsed, unfitted drugInteractionModel of loadFile. """
+    return cached(("interaction", loadFile, drug1, drug2, wells), lambda: drugInteractionModel(loadFile, drug1=drug1, drug2=drug2, fit=False, wells=wells))
@@ -8,9 +8,9 @@ This module generates Figure1 which motivates looking at cell death by showing t
 
 import numpy as np
 import pandas as pd
-import numpy_indexed as npi
 from matplotlib.ticker import FormatStrFormatter
 from ..pymcDoseResponse import doseResponseModel
+from ..summaries import drawSummary, groupSummary
 from .FigureCommon import getSetup, subplotLabel
 
 
@@ -76,29 +76,24 @@ def plot_mean_and_CI(ax, _x, _y, confidence=True):
     Returns: None
 
     """
-    # Group _y by _x and find the mean, standard deviation of _y at each _x
-    x_unique, y_mean = npi.group_by(_x).mean(_y)
-    sample_size = npi.count(_x)[1]
-    y_sem = npi.group_by(_x).std(_y)[1] / np.sqrt(sample_size)
+    # Group _y by _x and find the mean, standard error of _y at each _x
+    summary = groupSummary(_x, _y, ddof=0)
+    y_sem = summary["sem"] if confidence else None
 
-    if not confidence:
-        y_sem = None
+    ax.errorbar(x=summary["keys"][0], y=summary["mean"], yerr=y_sem, fmt=".", color="black")
 
-    ax.errorbar(x=x_unique, y=y_mean, yerr=y_sem, fmt=".", color="black")
 
-
-def plot_data_and_quantile(data, yvar, q, ax):
-    """This helper function plots the median and q quantile for yvar in df2 grouped by xvar.
+def plot_data_and_quantile(conc, draws, q, ax):
+    """This helper function plots the median and q central intervals of the draws at each concentration.
 
     Args:
-        _x (numpy array): Drug concentrations which group different observations _y.
-        _y (numpy array): The data that we would like to find the mean and confidence interval of.
+        conc (numpy array): Drug concentrations.
+        draws (numpy array): Posterior draws, shaped (draws, concentrations).
 
     Returns: None
 
     """
-    conc = np.array(list(data.groups.keys()))
-    y_median = data.agg({yvar: "median"})
+    y_median, y_low, y_high = drawSummary(draws, q)
 
     # Plot the data _y vs. _x
     ax.plot(conc, y_median, color="b", linewidth=1, alpha=0.9)
@@ -106,10 +101,7 @@ def plot_data_and_quantile(data, yvar, q, ax):
     alphas = np.arange(0.2, 1.0, 0.8 / len(q))
 
     for i, qi in enumerate(q):
-        y_low = np.array(data.quantile((1 - qi) / 2)[yvar])
-        y_high = np.array(data.quantile(1 - (1 - qi) / 2)[yvar])
-
-        ax.fill_between(conc, y_high, y_low, color="b", alpha=alphas[i], label=str(int(qi * 100)) + "% CI")
+        ax.fill_between(conc, y_high[i], y_low[i], color="b", alpha=alphas[i], label=str(int(qi * 100)) + "% CI")
 
 
 def plot_exact_data(M, ax2, ax3):
@@ -125,77 +117,54 @@ def plot_exact_data(M, ax2, ax3):
     plot_mean_and_CI(ax3, X, lObs, confidence=False)
 
 
-def df_crossjoin(df1, df2):
-    """
-    Make a cross join (cartesian product) between two dataframes by using a constant temporary key.
-    Also sets a MultiIndex which is the cartesian product of the indices of the input dataframes.
-    See: https://github.com/pydata/pandas/issues/5401
-    :param df1 dataframe 1
-    :param df1 dataframe 2
-    :param kwargs keyword arguments that will be passed to pd.merge()
-    :return cross join of df1 and df2
-    """
-    df1["_tmpkey"] = 1
-    df2["_tmpkey"] = 1
-
-    res = pd.merge(df1, df2, on="_tmpkey").drop("_tmpkey", axis=1)
-    res.index = pd.MultiIndex.from_product((df1.index, df2.index))
-
-    return res
-
-
 def plot_sampling_data(df, ax3, ax4, ax5, ax6):
     """ Check that MCMC actually fit the data provided """
     # Define drug concentrations x to test MCMC sampling data fit
-    df1 = df_crossjoin(df, pd.DataFrame({"concentration": np.arange(-1.0, 3.0, 0.01)}))
+    conc = np.arange(-1.0, 3.0, 0.01)
+
+    # Every parameter as a column of draws, to broadcast against the concentrations
+    IC50s, hill, Emin_growth, Emax_death, Emax_growth = (df[[name]].values for name in ["IC50s", "hill", "Emin_growth", "Emax_death", "Emax_growth"])
 
     # Drug term since we're using constant IC50 and hill slope
-    df1["drugTerm"] = 1.0 / (1.0 + np.power(10.0, (df1["IC50s"] - df1["concentration"]) * df1["hill"]))
+    drugTerm = 1.0 / (1.0 + np.power(10.0, (IC50s - conc) * hill))
 
     # Minimum drug term
-    df1["controlDrugTerm"] = 1.0 / (1.0 + np.power(10.0, (df1["IC50s"] - np.min(df1["concentration"])) * df1["hill"]))
+    controlDrugTerm = 1.0 / (1.0 + np.power(10.0, (IC50s - np.min(conc)) * hill))
 
     # growthV = Emin_growth + (Emax_growth - Emin_growth) * drugTerm
-    df1["growthV"] = df1["Emax_growth"] + ((df1["Emin_growth"] - df1["Emax_growth"]) * df1["drugTerm"])
+    growthV = Emax_growth + (Emin_growth - Emax_growth) * drugTerm
 
     # Control growth rate
-    gControl = df1["Emax_growth"] + ((df1["Emin_growth"] - df1["Emax_growth"]) * df1["controlDrugTerm"])
-
-    # Range of growth effect
-    df1["growthRange"] = df1["Emax_growth"] - df1["Emin_growth"]
+    gControl = Emax_growth + (Emin_growth - Emax_growth) * controlDrugTerm
 
     # _Assuming deathrate in the absence of drug is zero
-    df1["deathV"] = df1["Emax_death"] * df1["drugTerm"]
+    deathV = Emax_death * drugTerm
 
     # Calculate the growth rate
-    GR = df1["growthV"] - df1["deathV"]
+    GR = growthV - deathV
 
     # Calculate the number of live cells, normalized to T=0
-    df1["lExp"] = np.exp(GR * 72.0 - gControl * 72.0)
-
-    df2 = df1.groupby(["concentration"])
+    lExp = np.exp(GR * 72.0 - gControl * 72.0)
 
     # Plot the median, 90%, 75% and 50% quantiles of lExp, growthV, and deathV:
     quantiles = [0.90, 0.75, 0.50]
 
     # lExp (Figure 1c)
-    plot_data_and_quantile(df2, "lExp", quantiles, ax3)
+    plot_data_and_quantile(conc, lExp, quantiles, ax3)
     ax3.set_xlabel(r"$\mathregular{Log_{10}}$[DOX(nM)]")
     ax3.set_ylabel("Fit CellTiter quantitation")
     ax3.set_ylim(bottom=0.0)
     ax3.legend(loc=6)
 
     # growthV (Figure 1d)
-    df1["growthV"] *= 24.0
-    plot_data_and_quantile(df2, "growthV", quantiles, ax4)
+    plot_data_and_quantile(conc, growthV * 24.0, quantiles, ax4)
     ax4.set_xlabel(r"$\mathregular{Log_{10}}$[DOX(nM)]")
     ax4.set_ylabel("Predicted growth rate (1/day)")
     ax4.set_ylim(bottom=0.0, top=0.8)
     ax4.legend(loc=6)
 
     # deathV (Figure 1e)
-    df1["deathV"] *= 24.0
-    plot_data_and_quantile(df2, "deathV", quantiles, ax5)
+    plot_data_and_quantile(conc, deathV * 24.0, quantiles, ax5)
     ax5.set_xlabel(r"$\mathregular{Log_{10}}$[DOX(nM)]")
     ax5.set_ylabel("Predicted death rate (1/day)")
     ax5.set_ylim(bottom=0.0, top=0.8)
@@ -12,8 +12,9 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-from ..pymcGrowth import GrowthModel
+from ..experiments import growthData
 from ..utils import violinplot
+from ..summaries import groupSummary
 from .FigureCommon import getSetup, subplotLabel
 
 
@@ -50,7 +51,7 @@ def simulationPlots(axes, ff="101117_H1299", swapDrugs=False):
     """ Make plots of experimental data. """
 
     # Load model and dataset
-    classM = GrowthModel(ff)
+    classM = growthData(ff)
 
     df = pd.DataFrame(classM.expTable)
 
@@ -89,38 +90,29 @@ def simulationPlots(axes, ff="101117_H1299", swapDrugs=False):
         # array of all doses for the drug
         doses = np.unique(dfcur["dose"])
 
-        # take average of quant for all data points
-        this_dfcur_avg = dfcur.groupby(["time", "dose", "drug"]).agg({quant: "mean"}).unstack(0)
+        # mean and interval of quant at every dose and time, from one pass over the data
+        quantile = 0.95
+        summary = groupSummary([dfcur["dose"].values, dfcur["time"].values], dfcur[quant].values, q=((1 - quantile) / 2, 1 - (1 - quantile) / 2))
+        y_mean = summary["mean"].reshape((doses.size, times.size))
+        y_low, y_high = summary["quantiles"].reshape((2, doses.size, times.size))
 
-        # subtratc ctrl for apop and dna
-        if quant == "apop":  # apop (Annexin v)
-            ctrl = np.array(this_dfcur_avg.apop.iloc[0])
-            this_dfcur_avg.apop = this_dfcur_avg.apop - ctrl
-        elif quant == "dna":  # dna (YOYO-3)
-            ctrl = np.array(this_dfcur_avg.dna.iloc[0])
-            this_dfcur_avg.dna = this_dfcur_avg.dna - ctrl
+        # subtract ctrl for apop (Annexin v) and dna (YOYO-3)
+        if quant != "confl":
+            ctrl = y_mean[0]
+            y_mean, y_low, y_high = y_mean - ctrl, y_low - ctrl, y_high - ctrl
 
         # plot simulations
-        quantile = 0.95
         palette = plt.get_cmap("tab10")  # color palette
 
         for k, dose in enumerate(doses):
             # plot simulations for each drug dose
-            qt = this_dfcur_avg[quant].iloc[k]
-
             if quant == "confl":
-                ax.plot(times, qt, color=palette(k), linewidth=1, alpha=0.9, label=str(round(float(dose), 1)))
+                ax.plot(times, y_mean[k], color=palette(k), linewidth=1, alpha=0.9, label=str(round(float(dose), 1)))
             else:
-                ax.plot(times, qt, color=palette(k), linewidth=1, alpha=0.9)
+                ax.plot(times, y_mean[k], color=palette(k), linewidth=1, alpha=0.9)
 
             # plot confidence intervals for simulations for each drug dose
-            dfci = dfcur[dfcur.dose == dose].groupby("time")
-            y_low = dfci[quant].quantile((1 - quantile) / 2).values
-            y_high = dfci[quant].quantile(1 - (1 - quantile) / 2).values
-            if quant != "confl":
-                y_low = [a_i - b_i for a_i, b_i in zip(y_low, ctrl)]
-                y_high = [a_i - b_i for a_i, b_i in zip(y_high, ctrl)]
-            ax.fill_between(times, y_high, y_low, color=palette(k), alpha=0.2)
+            ax.fill_between(times, y_high[k], y_low[k], color=palette(k), alpha=0.2)
 
         # add legends
         if quant == "confl":
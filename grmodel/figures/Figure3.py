@@ -9,6 +9,8 @@ from matplotlib.ticker import FormatStrFormatter
 from seaborn import lineplot
 from .FigureCommon import getSetup, subplotLabel
 from ..utils import violinplot
+from ..results import fitGrowth
+from ..summaries import groupSummary
 
 
 def makeFigure():
@@ -49,13 +51,13 @@ def ratePlots(axes):
     violRes = dict()
     executor = ProcessPoolExecutor(max_workers=5)
     for _, ff in enumerate(files):
-        # Load model and dataset
-        violRes[ff] = executor.submit(violinplot, ff)
+        # Fit in worker processes, which only send back the posterior arrays
+        violRes[ff] = executor.submit(fitGrowth, ff)
 
     df = None
     for i, ff in enumerate(files):
         # Load model and dataset
-        dfdict, drugs, _ = violRes[ff].result()
+        dfdict, drugs, _ = violinplot(ff, result=violRes[ff].result())
 
         # Plot params vs. drug dose
         for _, drug in enumerate(drugs):
@@ -107,7 +109,9 @@ def ratePlots(axes):
     # Death rate
     lineplot(x="dose", y="deathRate", hue="drugName", marker="o", data=df, ax=axes[1], palette="muted")
     # Division vs. death
-    df2 = df.groupby(["drugName", "dose"], sort=False).median().reset_index()
+    keys = [df["drugName"].values, df["dose"].values]
+    divMed, deathMed = (groupSummary(keys, df[name].values) for name in ["div", "deathRate"])
+    df2 = pd.DataFrame({"drugName": divMed["keys"][0], "dose": divMed["keys"][1], "div": divMed["quantiles"][0], "deathRate": deathMed["quantiles"][0]})
     lineplot(x="div", y="deathRate", hue="drugName", marker="o", data=df2, ax=axes[2], palette="muted")
 
     # Set legend
@@ -5,6 +5,8 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 from ..pymcInteraction import drugInteractionModel
+from ..experiments import comboData
+from ..summaries import drawSummary
 from .FigureCommon import getSetup, subplotLabel
 
 
@@ -30,7 +32,7 @@ def makeFigure():
 def simPlots_comb(loadFile, axes, drug1, drug2):
     """ Output raw data plotting for Bliss additivity. """
     # Read model
-    M = drugInteractionModel(loadFile, drug1=drug1, drug2=drug2, fit=False)
+    M = comboData(loadFile, drug1, drug2)
 
     drug1 = drug1 + r" ($\mu$M)"
     drug2 = drug2 + r" ($\mu$M)"
@@ -75,7 +77,7 @@ def fittingPlots(ax, loadFile, drug1, drug2, df):
     # Read model from saved pickle file
     M = drugInteractionModel(loadFile, drug1=drug1, drug2=drug2, fit=True)
 
-    df.iloc[:, :] = np.median(M.samples["conflResid"], axis=0).reshape(5, 7)
+    df.iloc[:, :] = drawSummary(M.samples["conflResid"], ())[0].reshape(5, 7)
 
     sns.heatmap(df, ax=ax[0], cmap="PiYG", vmin=-0.5, vmax=0.5, cbar=False, square=True)
     ax[0].set_title("Full Model")
@@ -1,10 +1,11 @@
 """ This creates Figure S1. """
 
 from collections import OrderedDict
+from copy import copy
 import seaborn as sns
 import pandas as pd
 from .FigureCommon import getSetup, subplotLabel
-from ..pymcGrowth import GrowthModel
+from ..experiments import growthData
 from ..utils import reformatData
 
 
@@ -29,20 +30,12 @@ def violinplot_split(filename, axis):
     Make split violin plots for comparison of sampling distributions from
     analyses of kinetic data and endpoint data.
     """
-    # Read in model and kinetic dataframe
-    classM = GrowthModel(filename)
-    classM.performFit()
-    df = classM.df
-    df["Data Type"] = "Kinetic"
-
-    # Read in dataframe for endpoint data
-    classM2 = GrowthModel(filename, interval=False)
-    classM2.performFit()
-    df2 = classM2.df
-    df2["Data Type"] = "Endpoints"
+    # Fit the kinetic and endpoint data with one model, masking all but the endpoints in the second fit
+    classM = copy(growthData(filename))
+    dfs = classM.fitMasks({"Kinetic": None, "Endpoints": classM.endpointMask()})
 
     # Concatinate the two data frames
-    df = pd.concat([df, df2], axis=0)
+    df = pd.concat([dfs[key].assign(**{"Data Type": key}) for key in dfs], axis=0)
 
     # Get a list of drugs
     drugs = list(OrderedDict.fromkeys(classM.drugs))
@@ -5,7 +5,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from .Figure2 import simulationPlots
 from .FigureCommon import getSetup, subplotLabel
-from ..pymcInteraction import drugInteractionModel
+from ..experiments import comboData
 
 
 def makeFigure():
@@ -43,7 +43,7 @@ def simulationPlots_comb(loadFile, axes):
         raise ValueError("Unrecognized file.")
 
     # Read model
-    M = drugInteractionModel(loadFile, drug1=drug1, drug2=drug2, fit=False)
+    M = comboData(loadFile, drug1, drug2)
 
     X1 = np.unique(M.X1)
     X2 = np.unique(M.X2)
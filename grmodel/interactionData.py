@@ -30,61 +30,82 @@ def readCombo(name="072718_PC9_BYL_PIM"):
     return data
 
 
-def filterDrugC(df, drugAname, drugBname):
-    df["drugA"] = 0
+def filterDrugs(df, drugNames):
+    """
+    Add a column with the concentration of each of drugNames in every condition, 0 where the drug is absent and NaN
+    for blanks, so each row holds one entry of the sparse condition x drug concentration matrix.
+    """
+    df = df.copy()
 
-    for index, row in df.iterrows():
-        m = re.search(drugAname + r" (\d*\.?\d*)", row["Condition"])
+    for name in drugNames:
+        conc = df["Condition"].str.extract(re.escape(name) + r" (\d*\.?\d*)", expand=False)
+        df[name] = pd.to_numeric(conc, errors="coerce").fillna(0.0)
+        df.loc[df["Condition"] == "blank", name] = np.nan
 
-        if m is not None:
-            df.loc[index, "drugA"] = float(m.group(1))
+    return df.drop("Condition", axis=1)
 
-    df["drugB"] = 0
 
-    for index, row in df.iterrows():
-        m = re.search(drugBname + r" (\d*\.?\d*)", row["Condition"])
+def filterDrugC(df, drugAname, drugBname):
+    """ filterDrugs for two drugs, with the concentrations in the drugA and drugB columns. """
+    return filterDrugs(df, [drugAname, drugBname]).rename(columns={drugAname: "drugA", drugBname: "drugB"})
 
-        if m is not None:
-            df.loc[index, "drugB"] = float(m.group(1))
 
-    df.loc[df["Condition"] == "blank", "drugA"] = np.nan
-    df.loc[df["Condition"] == "blank", "drugB"] = np.nan
+def dataSplitDrugs(df, drugCols, wells=False):
+    """
+    Pull out the data of every measured condition, for any number of drugs in drugCols.
+    Conditions are only those present in df, sorted by the drug concentrations, so sparse designs stay sparse.
+    Returns the (condition, drug) concentrations, times and the measurements, which are (condition, time) averages
+    or, with wells, (condition, well, time) arrays with NaN for missing wells.
+    """
+    drugCols = list(drugCols)
+    df = df.dropna()
 
-    df.drop("Condition", axis=1, inplace=True)
+    timeV = np.sort(np.array(df.Elapsed.unique(), dtype=np.float64))
+    wellV = np.unique(df["Well"])
 
-    return df
+    # Average over the wells of each condition unless they are kept
+    index = drugCols + ["Well"] if wells else drugCols
+    tables = []
+    for mType in ["phase", "red", "green"]:
+        dfType = df.loc[df["Type"] == mType, :]
+        tables.append(dfType.pivot_table(index=index, columns="Elapsed", values="Measure", aggfunc="mean"))
 
+    if wells:
+        conditions = tables[0].index.droplevel("Well").unique()
+        index = pd.MultiIndex.from_tuples([cond + (well,) for cond in conditions for well in wellV], names=drugCols + ["Well"])
+        phase, red, green = [table.reindex(index=index, columns=timeV).values.reshape(len(conditions), len(wellV), len(timeV)) for table in tables]
 
-def dataSplit(df):
-    """ This will pull out the data """
-    keepCols = ["drugA", "drugB", "Elapsed", "Measure"]
-    grpCols = ["Elapsed", "drugA", "drugB"]
-    df.dropna(inplace=True)
+        # substract by control
+        red = red - np.nanmean(red[0], axis=0)
+        green = green - np.nanmean(green[0], axis=0)
+    else:
+        conditions = tables[0].index
+        phase, red, green = [table.reindex(index=conditions, columns=timeV).values for table in tables]
 
-    timeV = np.sort(np.array(df.Elapsed.unique(), dtype=np.float64))
+        # substract by control
+        red = red - red[0]
+        green = green - green[0]
 
-    dfPhase = df.loc[df["Type"] == "phase", :]
-    dfRed = df.loc[df["Type"] == "red", :]
-    dfGreen = df.loc[df["Type"] == "green", :]
+    if len(drugCols) == 1:
+        conditions = pd.MultiIndex.from_arrays([conditions], names=drugCols)
 
-    dfMAT = dfPhase[keepCols].groupby(grpCols).agg({"Measure": "mean"}).unstack(0)
-    phase = dfMAT.values
+    X = np.stack([conditions.get_level_values(col).values for col in drugCols], axis=1) + 0.01
 
-    dfRED = dfRed[keepCols].groupby(grpCols).agg({"Measure": "mean"}).unstack(0)
+    assert phase.shape == red.shape
+    assert phase.shape == green.shape
+
+    return (X, timeV, phase, red, green)
 
-    dfRED.Measure = dfRED.Measure - dfRED.Measure.iloc[0]  # substract by control
-    red = dfRED.values
 
-    dfGREEN = dfGreen[keepCols].groupby(grpCols).agg({"Measure": "mean"}).unstack(0)
-    dfGREEN.Measure = dfGREEN.Measure - dfGREEN.Measure.iloc[0]  # substract by control
-    green = dfGREEN.values
+def dataSplit(df):
+    """ This will pull out the data """
+    X, timeV, phase, red, green = dataSplitDrugs(df, ["drugA", "drugB"])
 
-    dfMAT.reset_index(inplace=True)
+    return (X[:, 0], X[:, 1], timeV, phase, red, green)
 
-    X1 = dfMAT["drugA"].values + 0.01
-    X2 = dfMAT["drugB"].values + 0.01
 
-    assert phase.shape == red.shape
-    assert phase.shape == green.shape
+def dataSplitWells(df):
+    """ Like dataSplit, but keeps every well. Measurements are (condition, well, time) arrays, with NaN for missing wells. """
+    X, timeV, phase, red, green = dataSplitDrugs(df, ["drugA", "drugB"], wells=True)
 
-    return (X1, X2, timeV, phase, red, green)
+    return (X[:, 0], X[:, 1], timeV, phase, red, green)
@@ -0,0 +1,173 @@
+"""
+Fast approximate inference for low-dimensional models: multi-start L-BFGS on a vectorized NumPy log-posterior,
+a Laplace approximation around the optima, and Pareto-smoothed importance sampling (PSIS) to correct it.
+"""
+import numpy as np
+from scipy.optimize import minimize
+from scipy.linalg import solve_triangular
+from scipy.special import logsumexp, gammaln
+
+
+def hessian(logp, x, step=1e-4):
+    """ Central finite-difference Hessian of logp at x, with every evaluation in one vectorized call. """
+    d = x.size
+    eye = np.eye(d) * step
+
+    # Points x + s_i e_i + s_j e_j for all i, j and sign pairs
+    signs = np.array([[1, 1], [1, -1], [-1, 1], [-1, -1]])
+    points = x + signs[:, 0, None, None, None] * eye[None, :, None, :] + signs[:, 1, None, None, None] * eye[None, None, :, :]
+    values = np.reshape(logp(np.reshape(points, (-1, d))), (4, d, d))
+
+    H = (values[0] - values[1] - values[2] + values[3]) / (4.0 * step ** 2)
+    return (H + H.T) / 2.0
+
+
+def clipCov(cov, rtol=1e-8):
+    """ Symmetric covariance with eigenvalues clipped to rtol of the largest, so it stays positive definite. """
+    evals, evecs = np.linalg.eigh((cov + cov.T) / 2.0)
+    evals = np.maximum(evals, rtol * np.max(np.abs(evals)) + 1e-12)
+    return (evecs * evals) @ evecs.T
+
+
+def laplaceCov(logp, mode):
+    """ Covariance of the Laplace approximation at mode, with eigenvalues clipped so it stays positive definite. """
+    return clipCov(np.linalg.inv(clipCov(-hessian(logp, mode))))
+
+
+def negLogpGrad(logp, x, step=1e-6):
+    """ Negative logp and its central finite-difference gradient at x, from one vectorized call. """
+    eye = np.eye(x.size) * step
+    values = logp(np.concatenate([x[None, :], x + eye, x - eye]))
+
+    with np.errstate(invalid="ignore"):
+        return -values[0], -(values[1: x.size + 1] - values[x.size + 1:]) / (2.0 * step)
+
+
+def findModes(logp, starts, tol=1e-2):
+    """ Run L-BFGS from every start, returning the distinct optima, best first, and their log-posterior. """
+    # Screen the starts in one vectorized call, and only optimize from the most promising ones
+    lp0 = logp(starts)
+    starts = starts[np.argsort(-np.nan_to_num(lp0, nan=-np.inf))][: max(4, len(starts) // 10)]
+
+    modes, values = [], []
+    for start in starts:
+        res = minimize(lambda x: negLogpGrad(logp, x), start, jac=True, method="L-BFGS-B")
+        if np.isfinite(res.fun) and all(np.max(np.abs(res.x - m)) > tol for m in modes):
+            modes.append(res.x)
+            values.append(-res.fun)
+
+    order = np.argsort(values)[::-1]
+    return np.array(modes)[order], np.array(values)[order]
+
+
+def tSample(mode, cov, df, size, random):
+    """ Draws from the multivariate Student-t with location mode, scale matrix cov and df degrees of freedom. """
+    z = random.multivariate_normal(np.zeros_like(mode), cov, size=size)
+    return mode + z / np.sqrt(random.chisquare(df, size=size) / df)[:, None]
+
+
+def tLogpdf(x, mode, cov, df):
+    """ Log density of the multivariate Student-t at the rows of x. """
+    d = mode.size
+    L = np.linalg.cholesky(cov)
+    maha = np.sum(np.square(solve_triangular(L, (x - mode).T, lower=True)), axis=0)
+
+    norm = gammaln((df + d) / 2.0) - gammaln(df / 2.0) - 0.5 * d * np.log(df * np.pi) - np.sum(np.log(np.diag(L)))
+    return norm - 0.5 * (df + d) * np.log1p(maha / df)
+
+
+def gpdFit(x):
+    """ Generalized Pareto fit to sorted exceedances x, as in Zhang and Stephens (2009) with a weak prior on the shape. """
+    n = x.size
+    nGrid = 30 + int(np.sqrt(n))
+
+    b = 1.0 - np.sqrt(nGrid / (np.arange(1, nGrid + 1) - 0.5))
+    b /= 3.0 * x[int(n / 4 + 0.5) - 1]
+    b += 1.0 / x[-1]
+
+    k = np.mean(np.log1p(-b[:, None] * x), axis=1)
+    profile = n * (np.log(-(b / k)) - k - 1.0)
+    weights = 1.0 / np.sum(np.exp(profile - profile[:, None]), axis=1)
+
+    bPost = np.sum(b * weights) / np.sum(weights)
+    kPost = np.mean(np.log1p(-bPost * x))
+    sigma = -kPost / bPost
+
+    return (n * kPost + 5.0) / (n + 10.0), sigma
+
+
+def psis(logw):
+    """ Pareto-smoothed, normalized log importance weights, and the Pareto shape k-hat of the weight tail. """
+    logw = logw - np.max(logw)
+    n = logw.size
+    nTail = int(np.ceil(min(0.2 * n, 3.0 * np.sqrt(n))))
+
+    order = np.argsort(logw)
+    tail = order[-nTail:]
+    cutoff = logw[order[-nTail - 1]]
+
+    # Replace the tail weights by the expected order statistics of the fitted generalized Pareto
+    k, sigma = gpdFit(np.exp(logw[tail]) - np.exp(cutoff))
+    if np.isfinite(k):
+        p = (np.arange(nTail) + 0.5) / nTail
+        smoothed = sigma * (np.expm1(-k * np.log1p(-p)) / k if abs(k) > 1e-12 else -np.log1p(-p))
+        logw[tail] = np.minimum(np.log(smoothed + np.exp(cutoff)), 0.0)
+
+    return logw - logsumexp(logw), k
+
+
+def laplaceSample(logp, starts, draws=4000, proposals=None, df=2.0, adapt=6, seed=None):
+    """
+    Approximate posterior draws for the vectorized log density logp((n, d) -> (n,)).
+    L-BFGS runs from the best of starts, and a mixture of Laplace approximations at the distinct optima, with
+    Student-t tails of df degrees of freedom, is the first proposal. Each of adapt further rounds moves the
+    components to the weighted moments of their draws. PSIS weights of the last round resample the proposals
+    into draws. The heavy default tails and several rounds are needed for the curved posteriors of Hill curves.
+    Returns the (draws, d) draws and k-hat; k-hat above 0.7 means the proposal is too far from the posterior
+    for the draws to be trusted.
+    """
+    random = np.random.RandomState(seed)
+    proposals = 4 * draws if proposals is None else proposals
+
+    modes, values = findModes(logp, starts)
+    covs = [laplaceCov(logp, mode) for mode in modes]
+
+    # Optima along a flat ridge are the same mode, unless they are over a standard deviation apart
+    keep = []
+    for ii in range(len(modes)):
+        if all(np.sum((modes[ii] - modes[jj]) * np.linalg.solve(covs[jj], modes[ii] - modes[jj])) > 1.0 for jj in keep):
+            keep.append(ii)
+    modes, values, covs = modes[keep], values[keep], [covs[ii] for ii in keep]
+
+    # Weight each optimum by the mass of its Laplace approximation
+    logmass = values + 0.5 * np.array([np.linalg.slogdet(cov)[1] for cov in covs])
+    logmix = logmass - logsumexp(logmass)
+
+    for rnd in range(adapt + 1):
+        # Proposals from each component, and their mixture density
+        comp = random.choice(len(modes), size=proposals, p=np.exp(logmix))
+        x = np.empty((proposals, modes.shape[1]))
+        for ii, (mode, cov) in enumerate(zip(modes, covs)):
+            x[comp == ii] = tSample(mode, cov, df, np.sum(comp == ii), random)
+
+        logq = logsumexp([lm + tLogpdf(x, mode, cov, df) for lm, mode, cov in zip(logmix, modes, covs)], axis=0)
+        logw, khat = psis(np.nan_to_num(logp(x) - logq, nan=-np.inf))
+
+        if rnd == adapt:
+            break
+
+        # Moment-match each component that kept enough effective draws to its weighted draws
+        w = np.exp(logw)
+        for ii in range(len(modes)):
+            wc = w[comp == ii]
+            if np.sum(wc) <= 0.0 or np.square(np.sum(wc)) / np.sum(np.square(wc)) < 10 * modes.shape[1]:
+                continue
+            modes[ii] = np.average(x[comp == ii], axis=0, weights=wc)
+            covs[ii] = clipCov(np.atleast_2d(np.cov(x[comp == ii], rowvar=False, aweights=wc)))
+
+        logmix = np.log(np.maximum(np.bincount(comp, weights=w, minlength=len(modes)), 1e-12))
+        logmix -= logsumexp(logmix)
+
+    idx = random.choice(proposals, size=draws, p=np.exp(logw))
+
+    return x[idx], khat
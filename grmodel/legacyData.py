@@ -0,0 +1,224 @@
+"""
+This module reads the whole archive of Incucyte exports, including the early experiments outside
+data/singles, into one long table with a common schema.
+
+Each row of the table is one measurement, with the columns
+    experiment, cellLine, channel, quantity, column, condition, drug, dose, unit, replicate, elapsed, value
+where channel uses the GrowthModel names (confl, apop, dna, ovlp) and quantity is either
+"confluence" (percent image area) or "count" (object counts of the initial kinetic data).
+growthModel arranges one confluence experiment for fitting, and legacyJobs all of them for executors.fitAll.
+"""
+import re
+import logging
+from glob import glob
+from os.path import join, dirname, abspath, basename, getmtime
+import numpy as np
+import pandas as pd
+from .cache import LRUCache
+from .pymcGrowth import GrowthModel
+
+dataDir = join(dirname(abspath(__file__)), "data")
+channels = {"phase": "confl", "green": "apop", "red": "dna", "overlap": "ovlp"}
+conditionRe = [
+    re.compile(r"^(?P<drug>.*?\S)[\s-]+(?P<dose>\d*\.?\d+)\s*(?P<unit>[nuµ�]M)?$"),
+    re.compile(r"^(?P<drug>[A-Za-z]+)(?P<dose>\d*\.?\d+)(?P<unit>)$"),
+]
+
+_archiveCache = LRUCache(4)
+
+
+def readExport(filename):
+    """ Read one export as a raw table, handling the byte order marks, Latin-1 encodings and old Mac line endings in the archive. """
+    try:
+        table = pd.read_csv(filename, header=None, encoding="utf-8-sig", dtype=str)
+    except UnicodeDecodeError:
+        table = pd.read_csv(filename, header=None, encoding="latin-1", dtype=str)
+
+    # Keep the header as is, since pandas would rename duplicated conditions
+    header = table.iloc[0].values
+    table = table.iloc[1:, :]
+    table.columns = range(table.shape[1])
+
+    # Drop unnamed trailing columns and rows without a time
+    keep = [ii for ii, name in enumerate(header) if isinstance(name, str) and name.strip()]
+    table = table[keep]
+    header = [header[ii].strip() for ii in keep]
+
+    return header, table
+
+
+def parseCondition(name):
+    """ Split a column name into (drug, dose, unit). Controls have dose 0, and blanks, combinations or unparseable names a dose of NaN. """
+    lname = name.lower()
+
+    if "blank" in lname:
+        return ("Blank", np.nan, None)
+    if "control" in lname or lname.startswith("ctl"):
+        return ("Control", 0.0, None)
+
+    # Combinations are kept whole, as a single drug cannot describe them
+    match = None if "," in name else next(filter(None, (regex.match(name) for regex in conditionRe)), None)
+    if match is None:
+        return (name, np.nan, None)
+
+    unit = match.group("unit") or None
+    if unit is not None:
+        # Normalize the micro sign, including exports where its encoding was lost
+        unit = "uM" if unit[0] != "n" else "nM"
+
+    return (match.group("drug"), float(match.group("dose")), unit)
+
+
+def meltExport(header, table, timeCol, firstCol):
+    """ Turn the condition columns of one export into long format. """
+    elapsed = pd.to_numeric(table[timeCol], errors="coerce")
+    rows = elapsed.notna().values
+
+    parts = []
+    seen = dict()
+    for col in range(firstCol, len(header)):
+        condition = header[col]
+        drug, dose, unit = parseCondition(condition)
+
+        # Repeated names are replicate columns of the same condition
+        seen[condition] = seen.get(condition, 0) + 1
+
+        parts.append(
+            pd.DataFrame(
+                {
+                    "column": col,
+                    "condition": condition,
+                    "drug": drug,
+                    "dose": dose,
+                    "unit": unit,
+                    "replicate": seen[condition],
+                    "elapsed": elapsed.values[rows],
+                    "value": pd.to_numeric(table.iloc[:, col], errors="coerce").values[rows],
+                }
+            )
+        )
+
+    return pd.concat(parts, ignore_index=True)
+
+
+def readConfluence(filename):
+    """ Read one <experiment>_confluence_<channel>.csv export. """
+    header, table = readExport(filename)
+    experiment, channel = re.match(r"(.*)_confluence_(\w+)\.csv", basename(filename)).groups()
+
+    data = meltExport(header, table, header.index("Elapsed"), header.index("Elapsed") + 1)
+    data["experiment"] = experiment
+    data["cellLine"] = experiment.split("_")[-1]
+    data["channel"] = channels[channel]
+    data["quantity"] = "confluence"
+
+    return data
+
+
+def readKinetic(filename):
+    """ Read the initial kinetic data, with Drug-dose triplicate columns of red object counts. """
+    header, table = readExport(filename)
+
+    data = meltExport(header, table, header.index("Elapsed"), header.index("Elapsed") + 1)
+    data.loc[data["dose"] == 0.0, "drug"] = "Control"
+    data["experiment"] = basename(filename).split("-red")[0]
+    data["cellLine"] = data["experiment"].str.split("-").str[-1]
+    data["channel"] = "dna"
+    data["quantity"] = "count"
+
+    return data
+
+
+def archiveFiles():
+    """ All the exports with a known layout, as (reader, filename) pairs. """
+    files = [(readConfluence, ff) for ff in sorted(glob(join(dataDir, "*_confluence_*.csv")))]
+    files += [(readConfluence, ff) for ff in sorted(glob(join(dataDir, "singles", "*_confluence_*.csv")))]
+    files += [(readKinetic, ff) for ff in sorted(glob(join(dataDir, "initial-data", "*-red.csv")))]
+    return files
+
+
+def loadArchive(cacheFile=None):
+    """
+    Read every export into one table with the common schema. The table is kept in memory until any file changes,
+    and also pickled to cacheFile if given, so later processes skip parsing as well.
+    """
+    files = archiveFiles()
+    key = tuple((ff, getmtime(ff)) for _, ff in files)
+
+    def parse():
+        if cacheFile is not None:
+            try:
+                cached = pd.read_pickle(cacheFile)
+                if cached.attrs.get("key") == key:
+                    return cached
+            except (OSError, ValueError, AttributeError):
+                pass
+
+        data = pd.concat([reader(ff) for reader, ff in files], ignore_index=True, sort=False)
+        data = data[["experiment", "cellLine", "channel", "quantity", "column", "condition", "drug", "dose", "unit", "replicate", "elapsed", "value"]]
+        data.attrs["key"] = key
+
+        if cacheFile is not None:
+            data.to_pickle(cacheFile)
+
+        return data
+
+    return _archiveCache.get((key, cacheFile), parse)
+
+
+def experimentTable(data, experiment):
+    """
+    Arrange one confluence experiment of the archive like GrowthModel, returning (doses, drugs, timeV, expTable, conv0).
+    Every column other than blanks is its own condition, so replicates stay separate. Conditions with missing phase
+    values are dropped, as is any other channel that is not complete for the remaining conditions.
+    """
+    data = data.loc[(data["experiment"] == experiment) & (data["quantity"] == "confluence") & (data["drug"] != "Blank")]
+
+    # Only keep times measured in every channel
+    timeV = np.array(sorted(set.intersection(*[set(dfc["elapsed"]) for _, dfc in data.groupby("channel")])))
+    data = data.loc[data["elapsed"].isin(timeV)]
+
+    # Conditions are the phase columns, since some plates only exported the overlap for part of the wells
+    conds = data.loc[data["channel"] == "confl"].drop_duplicates("column").sort_values("column")
+
+    tables = dict()
+    for channel, dfc in data.groupby("channel"):
+        table = dfc.pivot_table(index="column", columns="elapsed", values="value", aggfunc="mean")
+        tables[channel] = table.reindex(index=conds["column"], columns=timeV).values
+
+    complete = np.all(np.isfinite(tables["confl"]), axis=1)
+    if not np.all(complete):
+        logging.warning("%s: dropping %d conditions with missing phase values", experiment, np.sum(~complete))
+        conds = conds.loc[complete]
+
+    expTable = dict()
+    for channel, table in tables.items():
+        if np.all(np.isfinite(table[complete])):
+            expTable[channel] = table[complete].reshape((-1,))
+        else:
+            logging.warning("%s: dropping the %s channel, which is missing values", experiment, channel)
+
+    conv0 = np.mean(data.loc[(data["channel"] == "confl") & (data["elapsed"] == timeV[0]), "value"])
+
+    return list(conds["dose"]), list(conds["drug"]), timeV, expTable, conv0
+
+
+def growthModel(experiment, data=None, overlap=False):
+    """ Unfitted GrowthModel of an archive experiment, as experimentTable arranges it. The overlap channel is only kept with overlap. """
+    M = GrowthModel.__new__(GrowthModel)
+    M.loadFile = experiment
+    M.doses, M.drugs, M.timeV, M.expTable, M.conv0 = experimentTable(loadArchive() if data is None else data, experiment)
+
+    M.overlap = overlap and "ovlp" in M.expTable
+    if not M.overlap:
+        M.expTable.pop("ovlp", None)
+
+    return M
+
+
+def legacyJobs(data=None, **kwargs):
+    """ A fit job for every confluence experiment of the archive, for executors.fitAll. kwargs go to fitLegacy. """
+    data = loadArchive() if data is None else data
+    experiments = sorted(data.loc[data["quantity"] == "confluence", "experiment"].unique())
+
+    return [("legacy", experiment, dict(kwargs)) for experiment in experiments]
@@ -0,0 +1,372 @@
+"""
+Numba log density and gradient of the growth model, as an alternative to Theano for NUTS.
+
+The density is that of numpyGrowth.GrowthPosterior, written as one compiled loop over the conditions and times.
+The likelihood only depends on the residuals through their per-channel sum and sum of squares, so the gradient
+takes a second pass that weights the analytic derivatives of every expected signal by its residual.
+"""
+import numpy as np
+import pymc3 as pm
+import theano
+import theano.tensor as T
+from numba import njit
+from .numpyGrowth import GrowthPosterior
+
+
+channelNames = ("confl", "apop", "dna", "ovlp")
+
+# Lognormal observed conversion ratios as (numerator, denominator, mu, sd), by position in index
+ratioPriors = np.array([(1, 0, -2.06, 0.0647), (2, 0, -1.85, 0.125), (2, 1, 0.222, 0.141)])
+
+
+@njit(cache=True)
+def logitJacobian(z):
+    """ log(sigmoid(z)) + log(1 - sigmoid(z)), evaluated on the side that cannot overflow. """
+    if z > 0.0:
+        return -z - 2.0 * np.log(1.0 + np.exp(-z))
+    return z - 2.0 * np.log(1.0 + np.exp(z))
+
+
+@njit(cache=True)
+def conditionPrior(zApop, zDiv, zDeath):
+    """ Log prior of the unconstrained apopfrac, div and deathRate of one condition. """
+    return logitJacobian(zApop) + logitJacobian(zDiv) - 0.5 * ((zDeath - np.log(0.001)) / 0.5) ** 2
+
+
+@njit(cache=True)
+def scalarPrior(z, priors, index, grad):
+    """ Log prior of the lognormal scalars, including the observed conversion ratios, with its gradient added to grad. """
+    lp = 0.0
+    for ii in range(priors.shape[0]):
+        lp -= 0.5 * ((z[ii] - priors[ii, 0]) / priors[ii, 1]) ** 2
+        grad[ii] -= (z[ii] - priors[ii, 0]) / priors[ii, 1] ** 2
+
+    for jj in range(ratioPriors.shape[0]):
+        num, den = index[int(ratioPriors[jj, 0])], index[int(ratioPriors[jj, 1])]
+        ratio = z[num] - z[den]
+        lp += -0.5 * ((ratio - ratioPriors[jj, 2]) / ratioPriors[jj, 3]) ** 2 - ratio
+
+        slope = -(ratio - ratioPriors[jj, 2]) / ratioPriors[jj, 3] ** 2 - 1.0
+        grad[num] += slope
+        grad[den] -= slope
+
+    return lp
+
+
+@njit(cache=True)
+def scales(z, index):
+    """ Conversions, then offsets, with the overlap ones zero if absent, and d. """
+    scale = np.zeros(7)
+    for ii in range(7):
+        if index[ii] >= 0:
+            scale[ii] = np.exp(z[index[ii]])
+
+    return scale, np.exp(z[index[7]])
+
+
+@njit(cache=True)
+def rates(zApop, zDiv, zDeath):
+    """ apopfrac, div and deathRate of one condition from the unconstrained scale. """
+    return 1.0 / (1.0 + np.exp(-zApop)), 0.035 / (1.0 + np.exp(-zDiv)), np.exp(zDeath)
+
+
+@njit(cache=True)
+def conditionSums(zApop, zDiv, zDeath, scale, d, timeV, obs, present, cc, sums, sumsq):
+    """ Add the residuals of condition cc, and their squares, to the per-channel sums. """
+    apopfrac, div, deathRate = rates(zApop, zDiv, zDeath)
+
+    GR = div - deathRate
+    cGRd = deathRate * apopfrac / (GR + d)
+    b = deathRate * (1.0 - apopfrac)
+
+    for tt in range(timeV.size):
+        lnum = np.exp(GR * timeV[tt])
+        expd = np.exp(-d * timeV[tt])
+
+        eap = cGRd * (lnum - expd)
+        deadnec = b * (lnum - 1.0) / GR
+        deadapop = d * cGRd * (lnum - 1.0) / GR + cGRd * (expd - 1.0)
+
+        for ch in range(4):
+            if not present[ch]:
+                continue
+
+            if ch == 0:
+                signal = (lnum + eap + deadapop + deadnec) * scale[0]
+            elif ch == 1:
+                signal = (eap + deadapop) * scale[1] + scale[4]
+            elif ch == 2:
+                signal = (deadapop + deadnec) * scale[2] + scale[5]
+            else:
+                signal = deadapop * scale[3] + scale[6]
+
+            resid = signal - obs[ch, cc, tt]
+            sums[ch] += resid
+            sumsq[ch] += resid * resid
+
+
+@njit(cache=True)
+def likelihood(sums, sumsq, n, present, profile):
+    """ Normal log likelihood of each channel, with mean zero and the sd set to the residual standard deviation, or profiled out. """
+    lp = 0.0
+    for ch in range(4):
+        if present[ch]:
+            if profile:
+                lp -= 0.5 * n * np.log(sumsq[ch] / n)
+            else:
+                mean = sums[ch] / n
+                var = sumsq[ch] / n - mean ** 2
+                lp -= 0.5 * n * (np.log(var) + mean ** 2 / var)
+
+    return lp
+
+
+@njit(cache=True)
+def residualWeights(sums, sumsq, n, present, profile):
+    """ Derivatives of likelihood with respect to the sum and the sum of squares of each channel's residuals. """
+    dSum, dSumsq = np.zeros(4), np.zeros(4)
+    for ch in range(4):
+        if present[ch]:
+            if profile:
+                dSumsq[ch] = -0.5 * n / sumsq[ch]
+            else:
+                mean = sums[ch] / n
+                var = sumsq[ch] / n - mean ** 2
+                dSum[ch] = -mean ** 3 / var ** 2
+                dSumsq[ch] = -0.5 * (1.0 / var - mean ** 2 / var ** 2)
+
+    return dSum, dSumsq
+
+
+@njit(cache=True)
+def conditionGrad(zApop, zDiv, zDeath, scale, d, timeV, obs, present, cc, dSum, dSumsq, grad):
+    """
+    Add the likelihood gradient of condition cc to grad, which holds zApop, zDiv, zDeath, log d, then the log
+    conversions and log offsets as in scale. Populations are differentiated with respect to GR, deathRate where it
+    appears outside GR, apopfrac and d, then chained to the unconstrained parameters.
+    """
+    apopfrac, div, deathRate = rates(zApop, zDiv, zDeath)
+
+    GR = div - deathRate
+    g = GR + d
+    cGRd = deathRate * apopfrac / g
+    b = deathRate * (1.0 - apopfrac)
+
+    # Partials of cGRd; those by GR and d are equal
+    cG = -cGRd / g
+    cDeath = apopfrac / g
+    cApop = deathRate / g
+
+    # Population values, then their partials by GR, deathRate, apopfrac and d, for lnum, eap, deadapop and deadnec
+    pop = np.zeros(4)
+    dPop = np.zeros((4, 4))
+    part = np.zeros(4)
+    dPart = np.zeros((4, 4))
+
+    # Partials of the unconstrained parameters, then of log d
+    chain = np.array([apopfrac * (1.0 - apopfrac), div * (1.0 - div / 0.035), deathRate, d])
+
+    for tt in range(timeV.size):
+        t = timeV[tt]
+        lnum = np.exp(GR * t)
+        expd = np.exp(-d * t)
+        u = (lnum - 1.0) / GR
+        uG = (t * lnum - u) / GR
+
+        pop[0] = lnum
+        dPop[0, 0] = t * lnum
+        dPop[0, 1] = dPop[0, 2] = dPop[0, 3] = 0.0
+
+        pop[1] = cGRd * (lnum - expd)
+        dPop[1, 0] = cG * (lnum - expd) + cGRd * t * lnum
+        dPop[1, 1] = cDeath * (lnum - expd)
+        dPop[1, 2] = cApop * (lnum - expd)
+        dPop[1, 3] = cG * (lnum - expd) + cGRd * t * expd
+
+        pop[2] = d * cGRd * u + cGRd * (expd - 1.0)
+        dPop[2, 0] = d * (cG * u + cGRd * uG) + cG * (expd - 1.0)
+        dPop[2, 1] = cDeath * (d * u + expd - 1.0)
+        dPop[2, 2] = cApop * (d * u + expd - 1.0)
+        dPop[2, 3] = cGRd * u + d * cG * u + cG * (expd - 1.0) - cGRd * t * expd
+
+        pop[3] = b * u
+        dPop[3, 0] = b * uG
+        dPop[3, 1] = (1.0 - apopfrac) * u
+        dPop[3, 2] = -deathRate * u
+        dPop[3, 3] = 0.0
+
+        # Unscaled signal of each channel, as in conditionSums
+        part[0] = pop[0] + pop[1] + pop[2] + pop[3]
+        part[1] = pop[1] + pop[2]
+        part[2] = pop[2] + pop[3]
+        part[3] = pop[2]
+        for jj in range(4):
+            dPart[0, jj] = dPop[0, jj] + dPop[1, jj] + dPop[2, jj] + dPop[3, jj]
+            dPart[1, jj] = dPop[1, jj] + dPop[2, jj]
+            dPart[2, jj] = dPop[2, jj] + dPop[3, jj]
+            dPart[3, jj] = dPop[2, jj]
+
+        for ch in range(4):
+            if not present[ch]:
+                continue
+
+            offset = scale[ch + 3] if ch > 0 else 0.0
+            resid = part[ch] * scale[ch] + offset - obs[ch, cc, tt]
+            weight = (dSum[ch] + 2.0 * resid * dSumsq[ch]) * scale[ch]
+
+            # div and deathRate both enter through GR
+            grad[0] += weight * dPart[ch, 2] * chain[0]
+            grad[1] += weight * dPart[ch, 0] * chain[1]
+            grad[2] += weight * (dPart[ch, 1] - dPart[ch, 0]) * chain[2]
+            grad[3] += weight * dPart[ch, 3] * chain[3]
+            grad[4 + ch] += weight * part[ch]
+            if ch > 0:
+                grad[7 + ch] += (dSum[ch] + 2.0 * resid * dSumsq[ch]) * offset
+
+
+@njit(cache=True)
+def logpKernel(z, timeV, obs, present, priors, index, nCond, profile):
+    """
+    Log posterior of one unconstrained vector z, laid out as in GrowthPosterior.
+    obs is (channel, condition, time) for the channels flagged in present (confl, apop, dna, ovlp).
+    priors holds the lognormal location and scale of every scalar. index gives the positions of confl_conv,
+    apop_conv, dna_conv, ovlp_conv, apop_offset, dna_offset, ovlp_offset and d among them, -1 if absent.
+    """
+    k = priors.shape[0]
+    lp = scalarPrior(z, priors, index, np.zeros(z.size))
+    scale, d = scales(z, index)
+
+    sums = np.zeros(4)
+    sumsq = np.zeros(4)
+
+    for cc in range(nCond):
+        lp += conditionPrior(z[k + cc], z[k + nCond + cc], z[k + 2 * nCond + cc])
+        conditionSums(z[k + cc], z[k + nCond + cc], z[k + 2 * nCond + cc], scale, d, timeV, obs, present, cc, sums, sumsq)
+
+    return lp + likelihood(sums, sumsq, nCond * timeV.size, present, profile)
+
+
+@njit(cache=True)
+def logpGrad(z, timeV, obs, present, priors, index, nCond, profile):
+    """ Log posterior of z and its gradient, from the residual sums of every channel and a second pass over the data. """
+    k = priors.shape[0]
+    n = nCond * timeV.size
+    grad = np.zeros(z.size)
+
+    lp = scalarPrior(z, priors, index, grad)
+    scale, d = scales(z, index)
+
+    sums = np.zeros(4)
+    sumsq = np.zeros(4)
+    for cc in range(nCond):
+        zApop, zDiv, zDeath = z[k + cc], z[k + nCond + cc], z[k + 2 * nCond + cc]
+        lp += conditionPrior(zApop, zDiv, zDeath)
+        conditionSums(zApop, zDiv, zDeath, scale, d, timeV, obs, present, cc, sums, sumsq)
+
+        # The logit Jacobian log(p (1 - p)) has slope 1 - 2p
+        grad[k + cc] += 1.0 - 2.0 / (1.0 + np.exp(-zApop))
+        grad[k + nCond + cc] += 1.0 - 2.0 / (1.0 + np.exp(-zDiv))
+        grad[k + 2 * nCond + cc] -= (zDeath - np.log(0.001)) / 0.25
+
+    lp += likelihood(sums, sumsq, n, present, profile)
+    dSum, dSumsq = residualWeights(sums, sumsq, n, present, profile)
+
+    # Condition rates, log d, log conversions and log offsets
+    shared = np.zeros(11)
+    for cc in range(nCond):
+        local = np.zeros(11)
+        conditionGrad(z[k + cc], z[k + nCond + cc], z[k + 2 * nCond + cc], scale, d, timeV, obs, present, cc, dSum, dSumsq, local)
+
+        for jj in range(3):
+            grad[k + jj * nCond + cc] += local[jj]
+        shared[3:] += local[3:]
+
+    grad[index[7]] += shared[3]
+    for ii in range(7):
+        if index[ii] >= 0:
+            grad[index[ii]] += shared[4 + ii]
+
+    return lp, grad
+
+
+class NumbaGrowthPosterior(GrowthPosterior):
+    """ GrowthPosterior with a compiled value and gradient for single vectors. """
+
+    def __init__(self, conv0, timeV, expTable, noise="std", overlap=False):
+        super().__init__(conv0, timeV, expTable, noise, overlap)
+
+        nCond = self.nCond
+        self.present = np.array([key in self.obs for key in channelNames])
+        self.obsArray = np.stack([self.obs.get(key, np.zeros((nCond, self.timeV.size))) for key in channelNames])
+
+        names = ["confl_conv", "apop_conv", "dna_conv", "ovlp_conv", "apop_offset", "dna_offset", "ovlp_offset", "d"]
+        self.index = np.array([self.scalarNames.index(name) if name in self.scalarNames else -1 for name in names])
+
+    def args(self):
+        """ Data arguments of the kernels. """
+        return (self.timeV, self.obsArray, self.present, self.scalarPriors, self.index, self.nCond, self.noise == "profile")
+
+    def value(self, z):
+        """ Log posterior of a single vector. """
+        return logpKernel(np.asarray(z, dtype=np.float64), *self.args())
+
+    def valueAndGrad(self, z):
+        """ Log posterior of a single vector and its gradient. """
+        return logpGrad(np.asarray(z, dtype=np.float64), *self.args())
+
+    def start(self):
+        """ Vector at the center of the priors. """
+        return np.concatenate([self.scalarPriors[:, 0], np.zeros(2 * self.nCond), np.full(self.nCond, np.log(0.001))])
+
+
+class LogpGradOp(theano.Op):
+    """ Gradient of the compiled log posterior, as a Theano Op. """
+
+    itypes = [T.dvector]
+    otypes = [T.dvector]
+
+    def __init__(self, posterior):
+        self.posterior = posterior
+
+    def perform(self, node, inputs, outputs):  # pylint: disable=arguments-differ
+        outputs[0][0] = self.posterior.valueAndGrad(inputs[0])[1]
+
+
+class LogpOp(theano.Op):
+    """ Compiled log posterior as a black-box Theano Op, with its gradient from LogpGradOp. """
+
+    itypes = [T.dvector]
+    otypes = [T.dscalar]
+
+    def __init__(self, posterior):
+        self.posterior = posterior
+        self.gradOp = LogpGradOp(posterior)
+
+    def perform(self, node, inputs, outputs):  # pylint: disable=arguments-differ
+        outputs[0][0] = np.array(self.posterior.value(inputs[0]))
+
+    def grad(self, inputs, output_grads):  # pylint: disable=arguments-differ
+        return [output_grads[0] * self.gradOp(inputs[0])]
+
+
+def build_model(conv0, timeV, expTable, noise="std", overlap=False):
+    """
+    pymc3 model of the growth model with the log density from the Numba kernel, as a Potential on one flat vector.
+    The same priors and likelihood as pymcGrowth.build_model, with the parameters reported under the same names.
+    """
+    posterior = NumbaGrowthPosterior(conv0, timeV, expTable, noise, overlap)
+    n, k = posterior.nCond, posterior.nScalar
+
+    model = pm.Model()
+    with model:
+        z = pm.Flat("growth_z", shape=posterior.size, testval=posterior.start())
+        pm.Potential("growth_logp", LogpOp(posterior)(z))
+
+        for ii, name in enumerate(posterior.scalarNames):
+            pm.Deterministic(name, T.exp(z[ii]))
+
+        pm.Deterministic("apopfrac", T.nnet.sigmoid(z[k: k + n]))
+        pm.Deterministic("div", 0.035 * T.nnet.sigmoid(z[k + n: k + 2 * n]))
+        pm.Deterministic("deathRate", T.exp(z[k + 2 * n: k + 3 * n]))
+
+    return model
@@ -0,0 +1,125 @@
+"""
+Vectorized NumPy log posterior of the growth model in pymcGrowth.build_model, with the same priors and the
+std or profile noise models, for fast approximate fits and for checking other backends against.
+"""
+import numpy as np
+from .pymcGrowth import numpyCore, convSignal, overlapSignal
+
+
+def logistic(z):
+    """ Log of the sigmoid and of one minus it, which sum to the log Jacobian of a logit transform. """
+    return -np.logaddexp(0.0, -z), -np.logaddexp(0.0, z)
+
+
+class GrowthPosterior:
+    """
+    Log posterior, up to a constant, of the growth model on the unconstrained scale, for any number of parameter vectors at once.
+    The vector holds the log conversions and offsets, log d, then logit apopfrac, logit div / 0.035 and log deathRate of every condition.
+    expTable holds the (condition, time) or flattened measurements by channel, as in GrowthModel. Its "ovlp" channel is only fit with overlap.
+    """
+
+    def __init__(self, conv0, timeV, expTable, noise="std", overlap=False):
+        if noise not in ("std", "profile"):
+            raise ValueError("The NumPy growth posterior only supports the std and profile noise models.")
+
+        self.conv0 = conv0
+        self.timeV = np.asarray(timeV, dtype=np.float64)
+        self.noise = noise
+        self.overlap = overlap
+        self.obs = {key: np.reshape(value, (-1, self.timeV.size)) for key, value in expTable.items() if overlap or key != "ovlp"}
+        self.nCond = self.obs["confl"].shape[0]
+
+        # Location and scale of every lognormal scalar, in the order of the parameter vector
+        lconv = np.log(conv0)
+        self.scalarNames = ["confl_conv", "apop_conv", "dna_conv", "apop_offset", "dna_offset", "d"]
+        self.scalarPriors = np.array([(lconv, 0.1), (lconv - 2.06, 0.2), (lconv - 1.85, 0.2), (np.log(0.1), 0.1), (np.log(0.1), 0.1), (np.log(0.001), 0.5)])
+
+        if self.overlap:
+            self.scalarNames[3:3] = ["ovlp_conv"]
+            self.scalarNames[-1:-1] = ["ovlp_offset"]
+            self.scalarPriors = np.insert(self.scalarPriors, [3, 5], [(lconv - 1.85, 0.5), (np.log(0.01), 0.5)], axis=0)
+
+        self.nScalar = len(self.scalarNames)
+        self.size = self.nScalar + 3 * self.nCond
+
+    def split(self, z):
+        """ The scalar block and the per-condition blocks of the (m, size) vectors z. """
+        n, k = self.nCond, self.nScalar
+        return z[:, :k], z[:, k: k + n], z[:, k + n: k + 2 * n], z[:, k + 2 * n: k + 3 * n]
+
+    def unpack(self, z):
+        """ Parameters by name, each with the m vectors on the first axis. """
+        scalars, zApop, zDiv, zDeath = self.split(z)
+
+        out = dict(zip(self.scalarNames, np.exp(scalars).T))
+        out.update({"apopfrac": 1.0 / (1.0 + np.exp(-zApop)), "div": 0.035 / (1.0 + np.exp(-zDiv)), "deathRate": np.exp(zDeath)})
+        return out
+
+    def pack(self, params):
+        """ Inverse of unpack. """
+        logit = lambda p: np.log(p) - np.log1p(-p)
+        scalars = [np.log(params[name]) for name in self.scalarNames]
+
+        return np.concatenate([np.stack(scalars, axis=-1), logit(params["apopfrac"]), logit(params["div"] / 0.035), np.log(params["deathRate"])], axis=-1)
+
+    def priorDraws(self, m, random):
+        """ m vectors from the priors, leaving out the conversion ratio terms, e.g. as optimizer starts. """
+        scalars = random.normal(self.scalarPriors[:, 0], self.scalarPriors[:, 1], size=(m, self.nScalar))
+        perCond = np.concatenate([random.logistic(size=(m, 2 * self.nCond)), random.normal(np.log(0.001), 0.5, size=(m, self.nCond))], axis=1)
+        return np.concatenate([scalars, perCond], axis=1)
+
+    def expected(self, params):
+        """ Expected (m, condition, time) signal of every channel from unpacked parameters. """
+        lnum, eap, deadapop, deadnec = numpyCore(self.timeV, params["div"], params["deathRate"], params["apopfrac"], params["d"][:, None])
+
+        conv = tuple(params[name][:, None, None] for name in ("confl_conv", "apop_conv", "dna_conv", "ovlp_conv") if name in params)
+        offset = tuple(params[name][:, None, None] for name in ("apop_offset", "dna_offset", "ovlp_offset") if name in params)
+
+        out = dict(zip(("confl", "apop", "dna"), convSignal(lnum, eap, deadapop, deadnec, (conv, offset))))
+        if self.overlap:
+            out["ovlp"] = overlapSignal(deadapop, (conv, offset))
+
+        return out
+
+    def priorLogp(self, z):
+        """ Log prior density of the unconstrained vectors, including the transform Jacobians. """
+        scalars, zApop, zDiv, zDeath = self.split(z)
+
+        # Lognormal scalars are normal on the log scale
+        lp = -0.5 * np.sum(np.square((scalars - self.scalarPriors[:, 0]) / self.scalarPriors[:, 1]), axis=1)
+
+        # Conversion ratios are observed as lognormal
+        for num, den, mu, sd in ((1, 0, -2.06, 0.0647), (2, 0, -1.85, 0.125), (2, 1, 0.222, 0.141)):
+            ratio = scalars[:, num] - scalars[:, den]
+            lp += -0.5 * np.square((ratio - mu) / sd) - ratio
+
+        # Uniform apopfrac and div on the logit scale
+        lp += np.sum(sum(logistic(zApop)) + sum(logistic(zDiv)), axis=1)
+        lp -= 0.5 * np.sum(np.square((zDeath - np.log(0.001)) / 0.5), axis=1)
+
+        return lp
+
+    def residualLogp(self, resid):
+        """ Log likelihood of every row of flattened residuals, matching residualFit. """
+        n = resid.shape[1]
+
+        if self.noise == "profile":
+            return -0.5 * n * np.log(np.sum(np.square(resid), axis=1) / n)
+
+        # The sd is the residual standard deviation but the mean is zero, so sum(resid^2) / sd^2 = n (1 + mean^2 / var)
+        var = np.var(resid, axis=1)
+        return -0.5 * n * (np.log(var) + np.square(np.mean(resid, axis=1)) / var)
+
+    def logp(self, z):
+        """ Log posterior of the (m, size) unconstrained vectors z, -inf where it is not finite. """
+        z = np.atleast_2d(z)
+        lp = self.priorLogp(z)
+
+        with np.errstate(all="ignore"):
+            expected = self.expected(self.unpack(z))
+            for key, obs in self.obs.items():
+                lp += self.residualLogp(np.reshape(expected[key] - obs, (z.shape[0], -1)))
+
+        return np.where(np.isfinite(lp), lp, -np.inf)
+
+    __call__ = logp
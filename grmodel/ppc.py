@@ -0,0 +1,180 @@
+"""
+Posterior predictive checks for fitted growth and interaction models.
+
+The expected signal of every draw is rebuilt in NumPy from the trace, observation noise is added
+with the same noise model as the likelihood, and coverage, CRPS and split R-hat are computed
+per condition so that whole screening batches can be checked at once.
+"""
+import numpy as np
+import pandas as pd
+import pymc3 as pm
+from .pymcGrowth import numpyCore, convSignal, overlapSignal
+from .pymcInteraction import blissRates
+
+# Likelihood name of each channel, which also names any fitted noise sd
+growthFits = {"confl": "dataFit", "apop": "dataFita", "dna": "dataFitd", "ovlp": "dataFito"}
+interactionFits = {"confl": "confl_fit", "apop": "apop_fit", "dna": "dna_fit"}
+
+
+def traceDict(samples):
+    """ Combined draws of every variable in a trace. """
+    return {name: np.asarray(samples[name]) for name in samples.varnames}
+
+
+def expectedSignals(post, timeV, div, deathRate, apopfrac, overlap=False):
+    """ Expected (draws, condition, time) signal of every channel from the posterior rates and conversions. """
+    lnum, eap, deadapop, deadnec = numpyCore(timeV, div, deathRate, apopfrac, np.reshape(post["d"], (-1, 1)))
+
+    names = (("confl_conv", "apop_conv", "dna_conv", "ovlp_conv"), ("apop_offset", "dna_offset", "ovlp_offset"))
+    if not overlap:
+        names = (names[0][:3], names[1][:2])
+    conversions = tuple(tuple(np.reshape(post[name], (-1, 1, 1)) for name in group) for group in names)
+
+    signals = dict(zip(["confl", "apop", "dna"], convSignal(lnum, eap, deadapop, deadnec, conversions)))
+    if overlap:
+        signals["ovlp"] = overlapSignal(deadapop, conversions)
+
+    return signals
+
+
+def noiseSD(post, name, expected, obs):
+    """
+    Observation sd for each draw, broadcastable against expected. Fitted sds (the channel and time noise models)
+    are taken from the trace, otherwise the plug-in sd of the residuals is used as in the std and profile models.
+    """
+    if name + "_sd" in post:
+        sd = np.reshape(post[name + "_sd"], (expected.shape[0], -1))
+        return np.reshape(sd, (expected.shape[0],) + (1,) * (obs.ndim - 1) + (sd.shape[1],))
+
+    resid = np.reshape(obs - expected, (expected.shape[0], -1))
+    return np.reshape(np.sqrt(np.nanmean(np.square(resid), axis=1)), (-1,) + (1,) * obs.ndim)
+
+
+def predictiveDraws(expected, sd, seed=None):
+    """ Draws of new observations around the expected values. """
+    random = np.random.RandomState(seed)
+    return expected + sd * random.standard_normal(np.broadcast(expected, sd).shape)
+
+
+def coverage(draws, obs, prob=0.9):
+    """ Fraction of observations inside the central prob interval of the predictive draws, per condition (first axis of obs). """
+    lower, upper = np.quantile(draws, [(1.0 - prob) / 2.0, (1.0 + prob) / 2.0], axis=0)
+    inside = ((obs >= lower) & (obs <= upper)).astype(np.float64)
+    inside[~np.isfinite(obs)] = np.nan
+
+    return np.nanmean(np.reshape(inside, (obs.shape[0], -1)), axis=1)
+
+
+def crps(draws, obs):
+    """
+    Continuous ranked probability score of each observation under the predictive draws, E|X - y| - E|X - X'| / 2.
+    The second term uses the sorted draws, so the cost is n log n rather than n^2.
+    """
+    draws = np.broadcast_to(draws, (draws.shape[0],) + np.broadcast(draws[0], obs).shape)
+    n = draws.shape[0]
+
+    spread = np.sort(draws, axis=0)
+    weights = np.reshape(2.0 * np.arange(1, n + 1) - n - 1, (-1,) + (1,) * obs.ndim)
+    pairwise = 2.0 * np.sum(weights * spread, axis=0) / n ** 2
+
+    return np.mean(np.abs(draws - obs), axis=0) - 0.5 * pairwise
+
+
+def splitRhat(chains):
+    """ Split R-hat over the first two axes (chain, draw), vectorized over the rest. """
+    chains = np.asarray(chains)
+    half = chains.shape[1] // 2
+    split = np.concatenate([chains[:, :half], chains[:, half: 2 * half]], axis=0)
+
+    n = split.shape[1]
+    within = np.mean(np.var(split, axis=1, ddof=1), axis=0)
+    between = n * np.var(np.mean(split, axis=1), axis=0, ddof=1)
+    varPlus = (n - 1) / n * within + between / n
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.sqrt(varPlus / within)
+
+
+def conditionRhat(samples, nCond):
+    """ Largest split R-hat for each condition, counting the shared variables against every condition. """
+    worst = np.ones(nCond)
+
+    for name in pm.util.get_default_varnames(samples.varnames, False):
+        chains = np.stack(samples.get_values(name, combine=False))
+        rhat = np.reshape(splitRhat(chains), (-1,))
+
+        if rhat.size == nCond:
+            worst = np.fmax(worst, rhat)
+        else:
+            worst = np.fmax(worst, np.nanmax(rhat))
+
+    return worst
+
+
+def checkSignals(post, signals, observed, fits, prob=0.9, seed=None):
+    """ Coverage and CRPS of every channel, per condition. observed holds (condition, time) or (condition, well, time) arrays. """
+    out = dict()
+
+    for key, obs in observed.items():
+        expected = signals[key]
+        if obs.ndim == 3:
+            # Every well of a condition shares the expected time course
+            expected = expected[:, :, np.newaxis, :]
+
+        sd = noiseSD(post, fits[key], expected, obs)
+        draws = predictiveDraws(expected, sd, seed)
+
+        # Relative to the CRPS of a calibrated normal forecast, sd / sqrt(pi), so channels and experiments can be compared
+        score = np.reshape(crps(draws, obs), (obs.shape[0], -1))
+        out[key + "_coverage"] = coverage(draws, obs, prob)
+        out[key + "_crps"] = np.nanmean(score, axis=1) * np.sqrt(np.pi) / np.mean(sd)
+
+    return out
+
+
+def flagFits(df, prob=0.9, tol=0.2, maxRhat=1.05, maxCRPS=2.0):
+    """ Mark conditions with too low coverage, a high relative CRPS or unconverged chains. """
+    cover = df.filter(like="_coverage").min(axis=1)
+    score = df.filter(like="_crps").max(axis=1)
+
+    df["flag"] = (cover < prob - tol) | (score > maxCRPS) | (df["rhat"] > maxRhat)
+    return df
+
+
+def checkGrowth(M, prob=0.9, seed=None):
+    """ Per-condition predictive checks of a fitted GrowthModel. """
+    post = traceDict(M.samples)
+    observed = {key: M.expTable[key].reshape((-1, len(M.timeV))) for key in growthFits if key in M.expTable}
+
+    signals = expectedSignals(post, M.timeV, post["div"], post["deathRate"], post["apopfrac"], overlap="ovlp" in observed)
+
+    out = checkSignals(post, signals, observed, growthFits, prob, seed)
+    out.update({"drug": M.drugs, "dose": M.doses, "rhat": conditionRhat(M.samples, len(M.doses))})
+
+    return flagFits(pd.DataFrame(out), prob)
+
+
+def checkInteraction(M, prob=0.9, seed=None):
+    """ Per-condition predictive checks of a fitted drugInteractionModel. """
+    post = traceDict(M.samples)
+    observed = {"confl": M.phase, "apop": M.green, "dna": M.red}
+
+    div, deathRate, apopfrac = blissRates(post, M.X)
+    signals = expectedSignals(post, M.timeV, div, deathRate, apopfrac)
+
+    out = checkSignals(post, signals, observed, interactionFits, prob, seed)
+    out.update(zip(M.drugs, M.X.T))
+    out["rhat"] = conditionRhat(M.samples, M.X.shape[0])
+
+    return flagFits(pd.DataFrame(out), prob)
+
+
+def checkBatch(models, prob=0.9, seed=None):
+    """ Run the checks on a list of fitted models, returning one table with the loadFile of each fit. """
+    tables = []
+
+    for M in models:
+        check = checkInteraction if hasattr(M, "X") else checkGrowth
+        tables.append(check(M, prob, seed).assign(loadFile=M.loadFile))
+
+    return pd.concat(tables, ignore_index=True, sort=False)
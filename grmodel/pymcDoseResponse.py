@@ -1,21 +1,32 @@
 """
 Dose response analysis to assess the uncertainty that exists when one only uses the live cell number.
 """
+import logging
 from os.path import join, dirname, abspath
 import numpy as np
 import pymc3 as pm
 import theano.tensor as T
 import pandas as pd
+from .pymcGrowth import theanoCore, residualFit
+from .legacyData import readKinetic
+from .adaptive import adaptiveSample
+from .laplace import laplaceSample
 
 
 def loadCellTiter(drug=None):
-    """ Load Dox and NVB cellTiter Glo data. """
+    """ Load Dox and NVB cellTiter Glo data. drug can be one name or a list of them. """
     filename = join(dirname(abspath(__file__)), "data/initial-data/2017.07.10-H1299-celltiter.csv")
 
     data = pd.read_csv(filename)
+    isControl = data["Conc (nM)"] == 0.0
 
-    # Response should be normalized to the control
-    data["response"] = data["CellTiter"] / np.mean(data.loc[data["Conc (nM)"] == 0.0, "CellTiter"])
+    if isinstance(drug, str):
+        # A single drug keeps the normalization to the controls of every drug, which Figure 1 uses
+        data["response"] = data["CellTiter"] / np.mean(data.loc[isControl, "CellTiter"])
+    else:
+        # Several drugs are each normalized to their own control
+        control = data["CellTiter"].where(isControl)
+        data["response"] = data["CellTiter"] / control.groupby(data["Drug"]).transform("mean")
 
     # Put the dose on a log scale as well
     data["logDose"] = np.log10(data["Conc (nM)"] + 0.1)
@@ -23,15 +34,151 @@ def loadCellTiter(drug=None):
     if drug is None:
         return data
 
-    return data[data["Drug"] == drug]
+    if isinstance(drug, str):
+        return data[data["Drug"] == drug]
 
+    return data[data["Drug"].isin(drug)]
 
-class doseResponseModel:
-    """ pymc3 model of just using the live cell number. """
 
-    def sample(self):
-        """ Run sampling. """
-        self.trace = pm.sample(progressbar=False, chains=2, target_accept=0.9, model=self.model)
+def loadKinetic(drug=None):
+    """
+    Load the Dox and NVB live cell counts over time, normalized to the first timepoint of each well.
+    Returns a table of the drug and dose of each well, the times, and the (well, time) responses.
+    """
+    filename = join(dirname(abspath(__file__)), "data/initial-data/2017.07.10-H1299-red.csv")
+
+    data = readKinetic(filename)
+    data["Drug"] = data["condition"].str.split("-").str[0].str.upper()
+
+    if drug is not None:
+        data = data[data["Drug"].isin([drug] if isinstance(drug, str) else drug)]
+
+    counts = data.pivot_table(index=["Drug", "column"], columns="elapsed", values="value", aggfunc="mean")
+    wells = data.drop_duplicates("column").set_index(["Drug", "column"]).loc[counts.index].reset_index()
+    wells["logDose"] = np.log10(wells["dose"] + 0.1)
+
+    return wells[["Drug", "dose", "logDose"]], counts.columns.values.astype(np.float64), counts.values / counts.values[:, :1]
+
+
+class doseResponseModel:
+    """
+    pymc3 model of just using the live cell number.
+    Every drug of the file (or of a list of drugs) is fit in one model, with one Hill curve each.
+    For a single drug name the curve parameters are scalars, as before.
+
+    With kinetic, the live cell counts over time of the same doses are fit jointly with the CellTiter endpoint,
+    and the untreated growth rate is estimated rather than fixed.
+    """
+
+    def sample(self, adaptive=False):
+        """ Run sampling, in blocks until the curve parameters have converged with adaptive. """
+        if adaptive:
+            self.trace = adaptiveSample(self.model, ["IC50s", "Emin_growth", "Emax_death"], progressbar=False, chains=2, init="jitter+adapt_diag", target_accept=0.9)
+        else:
+            self.trace = pm.sample(progressbar=False, chains=2, target_accept=0.9, model=self.model)
+
+    def fitLaplace(self, draws=4000, starts=200, seed=None, fallback=True):
+        """
+        Alternative to sample for this small model: multi-start L-BFGS, a Laplace proposal and PSIS, in NumPy.
+        trace is set to a dict of draws with the same names and shapes as from sample, and khat to the PSIS diagnostic.
+        If khat is above 0.7 the draws cannot be trusted, so sample is run instead, or with fallback=False an error raised.
+        Fits of several drugs usually end up there, as do some kinetic fits of one drug (NVB), so they mostly run NUTS.
+        """
+        if self.noise not in ("std", "profile"):
+            raise ValueError("The Laplace fit only supports the std and profile noise models.")
+
+        random = np.random.RandomState(seed)
+        k = self.shape if self.shape else 1
+
+        # Prior draws on the unconstrained scale as starting points
+        init = [random.normal(2.0, 1.0, (starts, k)), random.logistic(size=(starts, k)), random.normal(-2.0, 2.0, (starts, k)), random.normal(1.0, 1.0, (starts, k))]
+        if self.kinetic:
+            init.append(random.normal(np.log(self.Emax_growth), 0.2, (starts, 1)))
+
+        z, self.khat = laplaceSample(self.numpyLogp, np.concatenate(init, axis=1), draws=draws, seed=seed)
+
+        if self.khat > 0.7:
+            if not fallback:
+                raise RuntimeError("The Laplace proposal does not cover the posterior (k-hat {:.2f}).".format(self.khat))
+
+            logging.warning("Laplace fit has k-hat %.2f, so sampling with NUTS instead", self.khat)
+            self.sample()
+            return
+
+        # The untreated growth rate is a scalar in the model, whatever the number of drugs
+        self.trace = {name: value[:, 0] if name == "Emax_growth" or not self.shape else value for name, value in self.unpack(z).items()}
+
+    def unpack(self, z):
+        """ Constrained parameters, each (n, drugs), from the unconstrained (n, d) vectors used by numpyLogp. """
+        k = self.shape if self.shape else 1
+        Emax_growth = np.exp(z[:, 4 * k: 4 * k + 1]) if self.kinetic else np.full((z.shape[0], 1), self.Emax_growth)
+
+        out = {
+            "IC50s": z[:, :k],
+            "Emin_growth": Emax_growth / (1.0 + np.exp(-z[:, k: 2 * k])),
+            "Emax_death": np.exp(z[:, 2 * k: 3 * k]),
+            "hill": np.exp(z[:, 3 * k: 4 * k]),
+        }
+        if self.kinetic:
+            out["Emax_growth"] = Emax_growth
+
+        return out
+
+    def numpyLogp(self, z):
+        """ Log posterior of the model for the (n, d) unconstrained parameter vectors z, including the transform Jacobians. """
+        k = self.shape if self.shape else 1
+        lIC50, zEmin, zDeath, zHill = (z[:, ii * k: (ii + 1) * k] for ii in range(4))
+        par = self.unpack(z)
+
+        # Priors, on the log scale for the lognormals and the logit scale for the uniform
+        lp = -0.5 * np.sum(np.square(lIC50 - 2.0), axis=1)
+        lp -= np.sum(zEmin + 2.0 * np.log1p(np.exp(-zEmin)), axis=1)
+        lp -= 0.5 * np.sum(np.square((zDeath + 2.0) / 2.0), axis=1)
+        lp -= 0.5 * np.sum(np.square(zHill - 1.0), axis=1)
+        if self.kinetic:
+            lp -= 0.5 * np.square((z[:, 4 * k] - np.log(self.Emax_growth)) / 0.2)
+
+        def growthRate(drugIdx, drugCs):
+            drugIdx = drugIdx if self.shape else np.zeros_like(drugIdx)
+            drugTerm = 1.0 / (1.0 + np.power(10.0, (par["IC50s"][:, drugIdx] - drugCs) * par["hill"][:, drugIdx]))
+            Emax_growth = par.get("Emax_growth", self.Emax_growth)
+            return Emax_growth + (par["Emin_growth"][:, drugIdx] - Emax_growth - par["Emax_death"][:, drugIdx]) * drugTerm
+
+        with np.errstate(all="ignore"):
+            lnum = np.exp(growthRate(self.drugIdx, self.drugCs) * self.time)
+            lp += self.numpyResidual(lnum / lnum[:, self.controlIdx] - self.lObs)
+
+            if self.kinetic:
+                lnumK = np.exp(growthRate(self.kDrugIdx, self.kDrugCs)[:, :, None] * self.timeV)
+                lp += self.numpyResidual(np.reshape(lnumK - self.kObs, (z.shape[0], -1)))
+
+        return np.where(np.isfinite(lp), lp, -np.inf)
+
+    def numpyResidual(self, resid):
+        """ Log likelihood of each row of residuals, matching residualFit. """
+        n = resid.shape[1]
+
+        if self.noise == "profile":
+            return -0.5 * n * (np.log(2.0 * np.pi * np.sum(np.square(resid), axis=1) / n) + 1.0)
+
+        sd = np.std(resid, axis=1)
+        return -0.5 * np.sum(np.square(resid), axis=1) / np.square(sd) - n * np.log(sd) - 0.5 * n * np.log(2.0 * np.pi)
+
+    def rates(self, params, Emax_growth, drugIdx, drugCs):
+        """ Growth and death rate at each concentration drugCs of the drugs drugIdx. """
+        lIC50, Emin_growth, Emax_death, hill = params
+
+        # Parameters of the drug used in each measurement
+        if self.shape:
+            lIC50, Emin_growth, Emax_death, hill = (x[drugIdx] for x in params)
+
+        # Drug term since we're using constant IC50 and hill slope
+        drugTerm = 1.0 / (1.0 + T.pow(10.0, (lIC50 - T._shared(drugCs)) * hill))
+
+        # Do actual conversion to parameters for each drug condition
+        growthV = Emax_growth + (Emin_growth - Emax_growth) * drugTerm
+
+        return growthV, Emax_death * drugTerm
 
     def build_model(self):
         """ Builds then returns the pyMC model. """
@@ -39,38 +186,54 @@ class doseResponseModel:
 
         with M:
             # The three values here are div and deathrate
-            # Assume just one IC50 for simplicity
-            lIC50 = pm.Normal("IC50s", 2.0)
-
-            Emin_growth = pm.Uniform("Emin_growth", lower=0.0, upper=self.Emax_growth)
-            Emax_death = pm.Lognormal("Emax_death", -2.0, 2.0)
+            # Assume just one IC50 and hill slope per drug
+            lIC50 = pm.Normal("IC50s", 2.0, shape=self.shape)
 
-            # Import drug concentrations into theano vector
-            drugCs = T._shared(self.drugCs)
+            if self.kinetic:
+                # The control wells over time constrain the untreated growth rate
+                Emax_growth = pm.Lognormal("Emax_growth", np.log(self.Emax_growth), 0.2)
+            else:
+                Emax_growth = self.Emax_growth
 
-            # Drug term since we're using constant IC50 and hill slope
-            drugTerm = 1.0 / (1.0 + T.pow(10.0, (lIC50 - drugCs) * pm.Lognormal("hill", 1.0)))
+            Emin_growth = pm.Uniform("Emin_growth", lower=0.0, upper=Emax_growth, shape=self.shape)
+            Emax_death = pm.Lognormal("Emax_death", -2.0, 2.0, shape=self.shape)
+            hill = pm.Lognormal("hill", 1.0, shape=self.shape)
+            params = (lIC50, Emin_growth, Emax_death, hill)
 
-            # Do actual conversion to parameters for each drug condition
-            growthV = self.Emax_growth + (Emin_growth - self.Emax_growth) * drugTerm
+            growthV, deathV = self.rates(params, Emax_growth, self.drugIdx, self.drugCs)
 
             # Calculate the growth rate
             # _Assuming deathrate in the absence of drug is zero
-            GR = growthV - Emax_death * drugTerm
+            GR = growthV - deathV
 
             # Calculate the number of live cells
             lnum = T.exp(GR * self.time)
 
-            # Normalize live cell data to control, as is similar to measurements
-            # Residual between model prediction and measurement
-            residual = self.lObs - (lnum / lnum[0])
+            # Normalize live cell data to the control of each drug, as is similar to measurements
+            # and compare model prediction to the measurement
+            residualFit("dataFitlnum", lnum / lnum[self.controlIdx], self.lObs, self.noise)
 
-            pm.Normal("dataFitlnum", sd=T.std(residual), observed=residual)
+            if self.kinetic:
+                # Live cells of every well over time, relative to its start
+                growthK, deathK = self.rates(params, Emax_growth, self.kDrugIdx, self.kDrugCs)
+                lnumK = theanoCore(self.timeV, growthK, deathK, 0.0, 1.0)[0]
+
+                residualFit("dataFitKinetic", lnumK, self.kObs, self.noise)
 
         return M
 
-    def __init__(self, Drug):
+    def __init__(self, Drug=None, noise="std", kinetic=False):
         dataLoad = loadCellTiter(Drug)
+        self.noise = noise
+        self.kinetic = kinetic
+
+        # Index of each measurement's drug, and of the first lowest dose (control) measurement of that drug
+        self.drugs = list(dataLoad["Drug"].unique())
+        self.drugIdx = np.array([self.drugs.index(drug) for drug in dataLoad["Drug"]])
+        logDose = dataLoad["logDose"].values
+        controls = np.array([np.flatnonzero(self.drugIdx == ii)[np.argmin(logDose[self.drugIdx == ii])] for ii in range(len(self.drugs))])
+        self.controlIdx = controls[self.drugIdx]
+        self.shape = () if isinstance(Drug, str) else len(self.drugs)
 
         # Handle data import here
         self.drugCs = dataLoad["logDose"].values
@@ -81,5 +244,10 @@ class doseResponseModel:
 
         self.lObs = dataLoad["response"].values
 
+        if kinetic:
+            wells, self.timeV, self.kObs = loadKinetic(self.drugs)
+            self.kDrugIdx = np.array([self.drugs.index(drug) for drug in wells["Drug"]])
+            self.kDrugCs = wells["logDose"].values
+
         # Build the model
         self.model = self.build_model()
@@ -2,11 +2,14 @@
 This module handles experimental data, by fitting a growth and death rate for each condition separately.
 """
 import logging
-from os.path import join, dirname, abspath
+from collections import OrderedDict
+from os.path import join, dirname, abspath, isfile
 import pandas
 import numpy as np
 import pymc3 as pm
 import theano.tensor as T
+from .streaming import streamSample, streamSummary
+from .adaptive import adaptiveSample
 
 
 def theanoCore(timeV, div, deathRate, apopfrac, d):
@@ -35,6 +38,25 @@ def theanoCore(timeV, div, deathRate, apopfrac, d):
     return (lnum, eap, deadapop, deadnec)
 
 
+def numpyCore(timeV, div, deathRate, apopfrac, d):
+    """ NumPy version of theanoCore. Rates broadcast over any leading dimensions, with time added as the last axis. """
+    div, deathRate, apopfrac, d = (np.asarray(x, dtype=np.float64)[..., np.newaxis] for x in (div, deathRate, apopfrac, d))
+    timeV = np.asarray(timeV, dtype=np.float64)
+
+    GR = div - deathRate
+    cGRd = deathRate * apopfrac / (GR + d)
+    b = deathRate * (1 - apopfrac)
+
+    lnum = np.exp(GR * timeV)
+    expd = np.exp(-d * timeV)
+
+    eap = cGRd * (lnum - expd)
+    deadnec = b * (lnum - 1) / GR
+    deadapop = d * cGRd * (lnum - 1) / GR + cGRd * (expd - 1)
+
+    return (lnum, eap, deadapop, deadnec)
+
+
 def convSignal(lnum, eap, deadapop, deadnec, conversions):
     """ Sums up the cell populations to link number of cells to image area. """
     conv, offset = conversions
@@ -45,12 +67,33 @@ def convSignal(lnum, eap, deadapop, deadnec, conversions):
     return (confl_exp, apop_exp, dna_exp)
 
 
-def conversionPriors(conv0):
-    """ Sets the various fluorescence conversion priors. """
+def overlapSignal(deadapop, conversions):
+    """ Area positive for both the apoptosis and DNA stains, which comes from cells that died through apoptosis. """
+    conv, offset = conversions
+    return deadapop * conv[3] + offset[2]
+
+
+def rescaledLognormal(name, mu, sd, shape=()):
+    """ Lognormal prior sampled through a unit normal, and reported under the original name. """
+    z = pm.Normal(name + "_z", 0.0, 1.0, shape=shape)
+    return pm.Deterministic(name, T.exp(mu + sd * z))
+
+
+def rescaledUniform(name, upper, shape=()):
+    """ Uniform(0, upper) prior sampled on the logit scale, and reported under the original name. """
+    # A standard logistic variable passed through a sigmoid is exactly uniform on (0, 1)
+    z = pm.Logistic(name + "_z", 0.0, 1.0, shape=shape)
+    return pm.Deterministic(name, upper * T.nnet.sigmoid(z))
+
+
+def conversionPriors(conv0, rescaled=False, overlap=False):
+    """ Sets the various fluorescence conversion priors. With overlap, priors for the overlap channel are appended. """
+    lognormal = rescaledLognormal if rescaled else pm.Lognormal
+
     # Set up conversion rates
-    confl_conv = pm.Lognormal("confl_conv", np.log(conv0), 0.1)
-    apop_conv = pm.Lognormal("apop_conv", np.log(conv0) - 2.06, 0.2)
-    dna_conv = pm.Lognormal("dna_conv", np.log(conv0) - 1.85, 0.2)
+    confl_conv = lognormal("confl_conv", np.log(conv0), 0.1)
+    apop_conv = lognormal("apop_conv", np.log(conv0) - 2.06, 0.2)
+    dna_conv = lognormal("dna_conv", np.log(conv0) - 1.85, 0.2)
 
     # Priors on conv factors
     pm.Lognormal("confl_apop", -2.06, 0.0647, observed=apop_conv / confl_conv)
@@ -58,13 +101,25 @@ def conversionPriors(conv0):
     pm.Lognormal("apop_dna", 0.222, 0.141, observed=dna_conv / apop_conv)
 
     # Offset values for apop and dna
-    apop_offset = pm.Lognormal("apop_offset", np.log(0.1), 0.1)
-    dna_offset = pm.Lognormal("dna_offset", np.log(0.1), 0.1)
+    apop_offset = lognormal("apop_offset", np.log(0.1), 0.1)
+    dna_offset = lognormal("dna_offset", np.log(0.1), 0.1)
+
+    if overlap:
+        # Overlap is bounded by the dna signal, so center on its conversion with a wider spread
+        ovlp_conv = lognormal("ovlp_conv", np.log(conv0) - 1.85, 0.5)
+        ovlp_offset = lognormal("ovlp_offset", np.log(0.01), 0.5)
+        return ((confl_conv, apop_conv, dna_conv, ovlp_conv), (apop_offset, dna_offset, ovlp_offset))
+
     return ((confl_conv, apop_conv, dna_conv), (apop_offset, dna_offset))
 
 
-def deathPriors(numApop):
+def deathPriors(numApop, rescaled=False):
     """ Setup priors for cell death parameters. """
+    if rescaled:
+        d = rescaledLognormal("d", np.log(0.001), 0.5)
+        apopfrac = rescaledUniform("apopfrac", 1.0, shape=numApop)
+        return d, apopfrac
+
     # Rate of moving from apoptosis to death, assumed invariant wrt. treatment
     d = pm.Lognormal("d", np.log(0.001), 0.5)
 
@@ -74,42 +129,170 @@ def deathPriors(numApop):
     return d, apopfrac
 
 
-def build_model(conv0, doses, timeV, expTable):
-    """ Builds then returns the pyMC model. """
+def noiseScale(name, data, noise):
+    """ Prior on the observation noise sd of a channel, with one per timepoint (the last axis) for noise="time". """
+    if noise == "time" and data.ndim < 2:
+        raise ValueError("Per-timepoint noise needs data with a time axis.")
+
+    shape = data.shape[-1] if noise == "time" else ()
+    return pm.HalfNormal(name + "_sd", sd=np.nanstd(data), shape=shape)
+
+
+def residualFit(name, expected, data, noise="std", mask=None):
+    """
+    Normal likelihood of one channel of data around the expected values.
+    data is shaped like expected, or (condition, well, time) for individual wells.
+    noise selects how the noise sd is handled:
+        "std": standard deviation of the residuals, recomputed at every evaluation
+        "profile": profiled out in closed form
+        "channel": one sd parameter for the channel
+        "time": one sd parameter per timepoint
+    mask is an optional 0/1 weight per timepoint, e.g. from pm.Data, so timepoints can be left out without rebuilding the model.
+    """
+    if noise not in ("std", "profile", "channel", "time"):
+        raise ValueError("Unknown noise model " + str(noise))
+
+    if data.ndim == 3:
+        return replicateFit(name, expected, data, noise, mask)
+
+    if mask is not None:
+        return maskedFit(name, expected, data, noise, mask)
+
+    if noise == "std":
+        residual = T.flatten(expected - data)
+        pm.Normal(name, sd=T.std(residual), observed=residual)
+    elif noise == "profile":
+        sse = T.sum(T.sqr(expected - data))
+        pm.Potential(name, -0.5 * data.size * (T.log(2.0 * np.pi * sse / data.size) + 1.0))
+    else:
+        pm.Normal(name, sd=noiseScale(name, data, noise), observed=expected - data)
+
+    return None
+
+
+def maskedFit(name, expected, data, noise, mask):
+    """ residualFit of (condition, time) data with only the timepoints where mask is 1 included. """
+    residual = expected - data
+    weight = T.ones_like(residual) * mask
+    nObs = T.sum(weight)
+
+    if noise == "profile":
+        pm.Potential(name, -0.5 * nObs * (T.log(2.0 * np.pi * T.sum(weight * T.sqr(residual)) / nObs) + 1.0))
+        return None
+
+    if noise == "std":
+        # Standard deviation of only the included residuals
+        center = T.sum(weight * residual) / nObs
+        sd = T.sqrt(T.sum(weight * T.sqr(residual - center)) / nObs)
+    else:
+        sd = noiseScale(name, data, noise)
+
+    pm.Potential(name, T.sum(weight * pm.Normal.dist(sd=sd).logp(residual)))
+    return None
+
+
+def replicateFit(name, expected, data, noise="std", mask=None):
+    """
+    Normal likelihood of well-level data (condition, well, time) around the expected (condition, time) values.
+    Wells only enter through their per-cell count, mean and sum of squares, so the cost is that of the averaged data.
+    """
+    count = np.sum(np.isfinite(data), axis=1)
+    mean = np.nan_to_num(np.nanmean(data, axis=1))
+    ssq = np.nansum(np.square(data - mean[:, None, :]), axis=1)
+
+    # Summed over n wells, (y - mu)^2 = (y - mean)^2 + n (mean - mu)^2, kept per timepoint
+    sse = np.sum(ssq, axis=0) + T.sum(count * T.sqr(expected - mean), axis=0)
+    nObs = np.sum(count, axis=0)
+
+    if mask is not None:
+        sse, nObs = sse * mask, nObs * mask
+
+    if noise in ("std", "profile"):
+        # The variance is set to its maximum likelihood value, as T.std does for averaged data
+        pm.Potential(name, -0.5 * T.sum(nObs) * (T.log(2.0 * np.pi * T.sum(sse) / T.sum(nObs)) + 1.0))
+    else:
+        sd = noiseScale(name, data, noise)
+        pm.Potential(name, T.sum(-nObs * T.log(sd) - sse / (2.0 * T.sqr(sd))) - 0.5 * T.sum(nObs) * np.log(2.0 * np.pi))
+
+
+def doseResponsePriors(drugs, doses):
+    """ Link the div and deathRate of every condition to its dose through one Hill curve per drug. """
+    assert all(not isinstance(dose, tuple) for dose in doses), "Dose-response pooling needs single drug conditions."
+
+    drugNames = list(OrderedDict.fromkeys(drug for drug in drugs if drug != "Control"))
+    drugIdx = np.array([drugNames.index(drug) if drug != "Control" else 0 for drug in drugs])
+    dose = np.array(doses, dtype=np.float64)
+    treated = np.array([drug != "Control" for drug in drugs]) & (dose > 0.0)
+    logDose = np.log(np.where(treated, dose, 1.0))
+
+    # Center each IC50 prior on the middle of the doses used for that drug
+    lIC50center = np.array([np.median(logDose[treated & (drugIdx == ii)]) for ii in range(len(drugNames))])
+
+    # Untreated rates, shared by all conditions
+    divCon = pm.Uniform("divCon", lower=0.0, upper=0.035)
+    deathCon = pm.Lognormal("deathCon", np.log(0.001), 0.5)
+
+    # Hill curve parameters of each drug
+    lIC50 = pm.Normal("lIC50", lIC50center, 2.0, shape=len(drugNames))
+    hill = pm.Lognormal("hill", 0.0, 0.5, shape=len(drugNames))
+    EmaxGrowth = pm.Beta("EmaxGrowth", 1.0, 1.0, shape=len(drugNames))
+    EmaxDeath = pm.Lognormal("EmaxDeath", np.log(0.01), 1.0, shape=len(drugNames))
+
+    # Fractional drug effect of each condition, zero for the controls
+    occupancy = treated.astype(np.float64) * T.nnet.sigmoid(hill[drugIdx] * (logDose - lIC50[drugIdx]))
+
+    div = pm.Deterministic("div", divCon * (1.0 - EmaxGrowth[drugIdx] * occupancy))
+    deathRate = pm.Deterministic("deathRate", deathCon + EmaxDeath[drugIdx] * occupancy)
+
+    return div, deathRate
+
+
+def build_model(conv0, doses, timeV, expTable, rescaled=False, drugs=None, noise="std", masked=False, overlap=False):
+    """
+    Builds then returns the pyMC model.
+    With rescaled, every parameter is sampled on a unit scale (unit normal or standard logistic) and
+    transformed back internally, so the priors and reported quantities are unchanged.
+    If drugs is given, div and deathRate are pooled across doses through a Hill curve per drug.
+    noise selects the observation noise model, see residualFit.
+    With masked, the likelihood only includes the timepoints set in the "timeMask" data, all of them initially.
+    With overlap, the "ovlp" channel of expTable is fit as well, with its own conversion priors.
+    """
     growth_model = pm.Model()
 
     with growth_model:
-        conversions = conversionPriors(conv0)
-        d, apopfrac = deathPriors(len(doses))
+        conversions = conversionPriors(conv0, rescaled, overlap)
+        d, apopfrac = deathPriors(len(doses), rescaled)
 
         # Specify vectors of prior distributions
-        # Growth rate
-        div = pm.Uniform("div", lower=0.0, upper=0.035, shape=len(doses))
-
-        # Rate of entering apoptosis or skipping straight to death
-        deathRate = pm.Lognormal("deathRate", np.log(0.001), 0.5, shape=len(doses))
+        if drugs is not None:
+            div, deathRate = doseResponsePriors(drugs, doses)
+        elif rescaled:
+            div = rescaledUniform("div", 0.035, shape=len(doses))
+            deathRate = rescaledLognormal("deathRate", np.log(0.001), 0.5, shape=len(doses))
+        else:
+            # Growth rate
+            div = pm.Uniform("div", lower=0.0, upper=0.035, shape=len(doses))
+
+            # Rate of entering apoptosis or skipping straight to death
+            deathRate = pm.Lognormal("deathRate", np.log(0.001), 0.5, shape=len(doses))
 
         lnum, eap, deadapop, deadnec = theanoCore(timeV, div, deathRate, apopfrac, d)
 
         # Convert model calculations to experimental measurement units
         confl_exp, apop_exp, dna_exp = convSignal(lnum, eap, deadapop, deadnec, conversions)
 
+        mask = pm.Data("timeMask", np.ones(len(timeV))) if masked else None
+
         # Fit model to confl, apop, dna, and overlap measurements
         if "confl" in expTable.keys():
-            # Observed error values for confl
-            confl_obs = T.reshape(confl_exp, (-1,)) - expTable["confl"]
-
-            pm.Normal("dataFit", sd=T.std(confl_obs), observed=confl_obs)
+            residualFit("dataFit", confl_exp, expTable["confl"].reshape((-1, len(timeV))), noise, mask)
         if "apop" in expTable.keys():
-            # Observed error values for apop
-            apop_obs = T.reshape(apop_exp, (-1,)) - expTable["apop"]
-
-            pm.Normal("dataFita", sd=T.std(apop_obs), observed=apop_obs)
+            residualFit("dataFita", apop_exp, expTable["apop"].reshape((-1, len(timeV))), noise, mask)
         if "dna" in expTable.keys():
-            # Observed error values for dna
-            dna_obs = T.reshape(dna_exp, (-1,)) - expTable["dna"]
-
-            pm.Normal("dataFitd", sd=T.std(dna_obs), observed=dna_obs)
+            residualFit("dataFitd", dna_exp, expTable["dna"].reshape((-1, len(timeV))), noise, mask)
+        if overlap:
+            ovlp_exp = overlapSignal(deadapop, conversions)
+            residualFit("dataFito", ovlp_exp, expTable["ovlp"].reshape((-1, len(timeV))), noise, mask)
 
     return growth_model
 
@@ -117,24 +300,91 @@ def build_model(conv0, doses, timeV, expTable):
 class GrowthModel:
     """ Model for fitting data incorporating cell death response. """
 
-    def performFit(self):
-        """ Run NUTS sampling"""
+    def performFit(self, rescaled=False, doseResponse=False, noise="std", init="advi+adapt_diag", tune=1000, directory=None, adaptive=False, backend="theano"):
+        """
+        Run NUTS sampling.
+        If directory is given, draws are streamed to chunked files there instead of kept in memory,
+        and only the running summary is set in place of df.
+        With adaptive, draws are taken in blocks until the rates have converged, see adaptiveSample.
+        backend="numba" evaluates the log density and gradient with the compiled kernel of numbaGrowth,
+        which supports the per-condition model with the std and profile noise models.
+        """
         logging.info("Building the model")
-        model = build_model(self.conv0, self.doses, self.timeV, self.expTable)
+        if backend == "numba":
+            if rescaled or doseResponse:
+                raise ValueError("The numba backend does not support rescaled or doseResponse.")
 
-        logging.info("GrowthModel sampling")
-        samples = pm.sample(model=model, progressbar=False, chains=2, init="advi+adapt_diag", tune=1000, target_accept=0.9)
-        self.df = pm.backends.tracetab.trace_to_dataframe(samples)
+            from .numbaGrowth import build_model as numbaModel  # pylint: disable=import-outside-toplevel
 
-    def __init__(self, loadFile, firstCols=2, comb=None, interval=True):
-        """Import experimental data"""
+            model = numbaModel(self.conv0, self.timeV, self.expTable, noise=noise, overlap=self.overlap)
+        else:
+            drugs = self.drugs if doseResponse else None
+            model = build_model(self.conv0, self.doses, self.timeV, self.expTable, rescaled=rescaled, drugs=drugs, noise=noise, overlap=self.overlap)
+
+        logging.info("GrowthModel sampling")
+        if directory is not None:
+            self.samples = streamSample(model, directory, progressbar=False, chains=2, init=init, tune=tune, target_accept=0.9)
+            self.summary = streamSummary(self.samples)
+            self.df = None
+            return
+
+        if adaptive:
+            self.samples = adaptiveSample(model, progressbar=False, chains=2, init=init, tune=tune, target_accept=0.9)
+        else:
+            self.samples = pm.sample(model=model, progressbar=False, chains=2, init=init, tune=tune, target_accept=0.9)
+
+        # Leave out the unit-scale variables of the rescaled model so the columns match
+        varnames = [name for name in pm.util.get_default_varnames(self.samples.varnames, False) if not name.endswith("_z")]
+        self.df = pm.backends.tracetab.trace_to_dataframe(self.samples, varnames=varnames)
+
+    def endpointMask(self):
+        """ Timepoints within an hour of the beginning or end, which interval=False keeps. """
+        return (self.timeV < 1.0) | (np.max(self.timeV) - self.timeV < 1.0)
+
+    def fitMasks(self, masks, noise="std", init="advi+adapt_diag", tune=1000, chains=2):
+        """
+        Fit the same model to several subsets of the timepoints, given as a dict of boolean masks over timeV (None for all).
+        The model is built and compiled once, and only its timeMask data changes between fits.
+        Returns a dict of the trace dataframe of each mask, like df from performFit.
+        """
+        model = build_model(self.conv0, self.doses, self.timeV, self.expTable, noise=noise, masked=True, overlap=self.overlap)
+        step = None
+        self.maskSamples, dfs = dict(), dict()
+
+        for name, mask in masks.items():
+            pm.set_data({"timeMask": np.ones(len(self.timeV)) if mask is None else np.asarray(mask, dtype=np.float64)}, model=model)
+
+            if step is None:
+                start, step = pm.init_nuts(init=init, chains=chains, model=model, progressbar=False, target_accept=0.9)
+
+            logging.info("GrowthModel sampling with mask %s", name)
+            self.maskSamples[name] = pm.sample(step=step, start=start, chains=chains, tune=tune, model=model, progressbar=False)
+
+            varnames = pm.util.get_default_varnames(self.maskSamples[name].varnames, False)
+            dfs[name] = pm.backends.tracetab.trace_to_dataframe(self.maskSamples[name], varnames=varnames)
+
+        return dfs
+
+    def __init__(self, loadFile, firstCols=2, comb=None, interval=True, overlap=False):
+        """Import experimental data. With overlap, the overlap channel is read and fit too, where it was measured."""
         # Property list
         properties = {"confl": "_confluence_phase.csv", "apop": "_confluence_green.csv", "dna": "_confluence_red.csv"}
 
         # Find path for csv files in the repository.
         pathcsv = join(dirname(abspath(__file__)), "data/singles/" + loadFile)
+        properties = {key: pathcsv + value for key, value in properties.items()}
+
+        # Overlap of the apop and dna stains is only measured in some experiments, whose files are in the top-level data folder
+        self.overlap = False
+        for folder in ("data/singles/", "data/") if overlap else ():
+            pathovlp = join(dirname(abspath(__file__)), folder + loadFile + "_confluence_overlap.csv")
+            if isfile(pathovlp):
+                properties["ovlp"] = pathovlp
+                self.overlap = True
+                break
 
         # Pull out selected column data
+        self.loadFile = loadFile
         self.doses = []
         self.drugs = []
         selconv0 = []
@@ -146,7 +396,7 @@ class GrowthModel:
         # Data tables to be kept within class.
         for key, value in properties.items():
             # Read input file
-            dataset = pandas.read_csv(pathcsv + value)
+            dataset = pandas.read_csv(value)
             # Subtract control
             dataset1 = dataset.iloc[:, 2: len(dataset.columns)]
             dataset1.sub(dataset1["Control"], axis=0)
@@ -4,14 +4,56 @@ This module handles experimental data for drug interaction.
 import numpy as np
 import pymc3 as pm
 import theano.tensor as T
-from .pymcGrowth import theanoCore, convSignal, conversionPriors, deathPriors
-from .interactionData import readCombo, filterDrugC, dataSplit
+from scipy.special import expit
+from .pymcGrowth import theanoCore, convSignal, conversionPriors, deathPriors, residualFit
+from .interactionData import readCombo, filterDrugs, dataSplitDrugs
+from .streaming import streamSample
+from .adaptive import adaptiveSample
+
+
+def hillOccupancy(X, hill, IC50):
+    """
+    Normalized Hill term, X^hill / (IC50^hill + X^hill), of every drug in every condition, for (condition, drug)
+    concentrations X. Computed in log space as a sigmoid, which avoids the large powers and is cheaper to differentiate.
+    """
+    return T.nnet.sigmoid(hill * (np.log(X) - T.log(IC50)))
+
+
+def blissCombine(occupancy, Emax, justAdd=False):
+    """ Bliss additive interaction, 1 - prod(1 - E_i), of the drug effects Emax * occupancy in each condition. """
+    effect = Emax * occupancy
+
+    if justAdd:
+        return T.sum(effect, axis=1)
+
+    return 1.0 - T.prod(1.0 - effect, axis=1)
+
+
+def blissMulti(X, hill, IC50, Emax, justAdd=False):
+    """
+    Bliss additive interaction of the Hill curves of any number of drugs.
+    X is the (condition, drug) concentration matrix of the measured conditions only, so sparse designs stay cheap.
+    """
+    return blissCombine(hillOccupancy(X, hill, IC50), Emax, justAdd)
 
 
 def blissInteract(X1, X2, hill, IC50, Emax, justAdd=False):
     """ Calculate Bliss additive interaction of two Hill curves. """
-    drug_one = Emax[0] * T.pow(X1, hill[0]) / (T.pow(IC50[0], hill[0]) + T.pow(X1, hill[0]))
-    drug_two = Emax[1] * T.pow(X2, hill[1]) / (T.pow(IC50[1], hill[1]) + T.pow(X2, hill[1]))
+    return blissMulti(np.stack([X1, X2], axis=1), hill, IC50, Emax, justAdd)
+
+
+def gridOccupancy(X1, X2, hill, IC50):
+    """ Hill terms of the two drugs over the grid X1 x X2, for parameters shaped (draws, 2); returns (draws, X1, 1) and (draws, 1, X2). """
+    occ_one = expit(hill[:, 0, None, None] * (np.log(X1[None, :, None]) - np.log(IC50[:, 0, None, None])))
+    occ_two = expit(hill[:, 1, None, None] * (np.log(X2[None, None, :]) - np.log(IC50[:, 1, None, None])))
+
+    return occ_one, occ_two
+
+
+def blissGridCombine(occupancy, Emax, justAdd=False):
+    """ Bliss additive interaction of the effects Emax * occupancy, for occupancy from gridOccupancy; returns (draws, X1, X2). """
+    drug_one = Emax[:, 0, None, None] * occupancy[0]
+    drug_two = Emax[:, 1, None, None] * occupancy[1]
 
     if justAdd:
         return drug_one + drug_two
@@ -19,66 +61,169 @@ def blissInteract(X1, X2, hill, IC50, Emax, justAdd=False):
     return drug_one + drug_two - drug_one * drug_two
 
 
-def build_model(X1, X2, timeV, conv0=0.1, confl=None, apop=None, dna=None):
-    """ Builds then returns the PyMC model. """
+def blissGrid(X1, X2, hill, IC50, Emax, justAdd=False):
+    """ NumPy version of blissInteract over the grid X1 x X2. Parameters have shape (draws, 2); returns (draws, X1, X2). """
+    return blissGridCombine(gridOccupancy(X1, X2, hill, IC50), Emax, justAdd)
+
+
+def conditionOccupancy(X, hill, IC50):
+    """ NumPy version of hillOccupancy for parameters shaped (draws, drug); returns (draws, condition, drug). """
+    return expit(hill[:, None, :] * (np.log(X)[None, :, :] - np.log(IC50)[:, None, :]))
+
+
+def blissConditions(occupancy, Emax, justAdd=False):
+    """ NumPy version of blissCombine for occupancy from conditionOccupancy and Emax shaped (draws, drug); returns (draws, condition). """
+    effect = Emax[:, None, :] * occupancy
+
+    if justAdd:
+        return np.sum(effect, axis=2)
+
+    return 1.0 - np.prod(1.0 - effect, axis=2)
+
+
+def blissRates(samples, X, X2=None):
+    """
+    Growth rate, death rate and apopfrac of every measured condition for every draw, each shaped (draws, conditions).
+    X is the (condition, drug) concentration matrix, or the first drug's concentrations with X2 those of the second.
+    """
+    if X2 is not None:
+        X = np.stack([X, X2], axis=1)
+
+    occupancy = conditionOccupancy(X, np.asarray(samples["hill"]), np.asarray(samples["IC50"]))
 
+    bliss = blissConditions(occupancy, np.asarray(samples["EmaxGrowth"]))
+    death = blissConditions(occupancy, np.asarray(samples["EmaxDeath"]), justAdd=True)
+
+    growth = np.reshape(samples["GrowthCon"], (-1, 1)) * (1 - bliss)
+    apopfrac = np.broadcast_to(np.reshape(samples["apopfrac"], (-1, 1)), death.shape)
+
+    return growth, death, apopfrac
+
+
+def drawMean(x):
+    """ Posterior mean over the draws on the first axis. """
+    return np.mean(x, axis=0)
+
+
+def blissSurface(samples, X1, X2, time=72.0, chunk=10, func=drawMean):
+    """
+    Evaluate the fitted growth rate, death rate and confluence surfaces over the dense dose grid X1 x X2 for every posterior draw.
+
+    samples can be the trace from drugInteractionModel or any mapping of the same names to arrays. Rows of the grid are
+    evaluated chunk at a time, and func is applied to each chunk with the draws on the first axis, so only its output
+    is kept and memory is bounded by draws * chunk * X2.size. By default that is the posterior mean; e.g.
+    lambda x: np.quantile(x, [0.05, 0.5, 0.95], axis=0) gives intervals, and func=np.asarray keeps every draw,
+    which for thousands of draws over a fine grid takes gigabytes.
+    Returns the growth, death and confluence arrays, with the grid as the last two axes.
+    """
+    X1 = np.asarray(X1, dtype=np.float64)
+    X2 = np.asarray(X2, dtype=np.float64)
+
+    hill, IC50 = np.asarray(samples["hill"]), np.asarray(samples["IC50"])
+    EmaxGrowth, EmaxDeath = np.asarray(samples["EmaxGrowth"]), np.asarray(samples["EmaxDeath"])
+    GrowthCon = np.reshape(samples["GrowthCon"], (-1, 1, 1))
+    confl_conv = np.reshape(samples["confl_conv"], (-1, 1, 1))
+
+    growth, death, confl = [], [], []
+    for start in range(0, X1.size, chunk):
+        # Hill terms are shared by the growth and death effects
+        occupancy = gridOccupancy(X1[start: start + chunk], X2, hill, IC50)
+
+        growth_rates = GrowthCon * (1 - blissGridCombine(occupancy, EmaxGrowth))
+        death_rates = blissGridCombine(occupancy, EmaxDeath, justAdd=True)
+
+        # Summing the theanoCore populations, apoptotic and dead cells are all still imaged,
+        # so d and apopfrac cancel and confluence only depends on the two rates
+        GR = growth_rates - death_rates
+        lnum = np.exp(GR * time)
+        confl_exp = confl_conv * (lnum + death_rates * (lnum - 1) / GR)
+
+        growth.append(func(growth_rates))
+        death.append(func(death_rates))
+        confl.append(func(confl_exp))
+
+    return tuple(np.concatenate(x, axis=-2) for x in (growth, death, confl))
+
+
+def build_model(X1, X2, timeV, conv0=0.1, confl=None, apop=None, dna=None, noise="std"):
+    """ Builds then returns the PyMC model of two drugs, with the concentrations X1 and X2 of each condition. """
     assert X1.shape == X2.shape
 
+    return build_multi_model(np.stack([X1, X2], axis=1), timeV, conv0, confl, apop, dna, noise)
+
+
+def build_multi_model(X, timeV, conv0=0.1, confl=None, apop=None, dna=None, noise="std"):
+    """
+    Builds then returns the PyMC model, for the (condition, drug) concentration matrix X of the measured conditions.
+    Observations are either (condition, time) averages or (condition, well, time) arrays of the individual wells.
+    noise selects the observation noise model, see residualFit.
+    """
+
+    assert X.ndim == 2
+
     M = pm.Model()
 
     with M:
         conversions = conversionPriors(conv0)
         d, apopfrac = deathPriors(1)
 
-        # parameters for drug 1, 2; assumed to be the same for both phenotypes
-        hill = pm.Lognormal("hill", shape=2)
-        IC50 = pm.Lognormal("IC50", shape=2)
-        EmaxGrowth = pm.Beta("EmaxGrowth", 1.0, 1.0, shape=2)
-        EmaxDeath = pm.Lognormal("EmaxDeath", -2.0, 0.5, shape=2)
+        # parameters for each drug; assumed to be the same for both phenotypes
+        hill = pm.Lognormal("hill", shape=X.shape[1])
+        IC50 = pm.Lognormal("IC50", shape=X.shape[1])
+        EmaxGrowth = pm.Beta("EmaxGrowth", 1.0, 1.0, shape=X.shape[1])
+        EmaxDeath = pm.Lognormal("EmaxDeath", -2.0, 0.5, shape=X.shape[1])
 
         # E_con values; first death then growth
         GrowthCon = pm.Lognormal("GrowthCon", np.log10(0.03), 0.1)
 
+        # Hill terms are shared by the growth and death effects, so only compute them once
+        occupancy = hillOccupancy(X, hill, IC50)
+
         # Calculate the death rate
-        death_rates = blissInteract(X1, X2, hill, IC50, EmaxDeath, justAdd=True)  # pylint: disable=unsubscriptable-object
+        death_rates = blissCombine(occupancy, EmaxDeath, justAdd=True)
 
         # Calculate the growth rate
-        growth_rates = GrowthCon * (1 - blissInteract(X1, X2, hill, IC50, EmaxGrowth))  # pylint: disable=unsubscriptable-object
+        growth_rates = GrowthCon * (1 - blissCombine(occupancy, EmaxGrowth))
         pm.Deterministic("EmaxGrowthEffect", GrowthCon * EmaxGrowth)
 
         # Test the dimension of growth_rates
-        growth_rates = T.opt.Assert("growth_rates did not match X1 size")(growth_rates, T.eq(growth_rates.size, X1.size))
+        growth_rates = T.opt.Assert("growth_rates did not match X size")(growth_rates, T.eq(growth_rates.size, X.shape[0]))
 
         lnum, eap, deadapop, deadnec = theanoCore(timeV, growth_rates, death_rates, apopfrac, d)
 
         # Test the size of lnum
-        lnum = T.opt.Assert("lnum did not match X1*timeV size")(lnum, T.eq(lnum.size, X1.size * timeV.size))
+        lnum = T.opt.Assert("lnum did not match X*timeV size")(lnum, T.eq(lnum.size, X.shape[0] * timeV.size))
 
         confl_exp, apop_exp, dna_exp = convSignal(lnum, eap, deadapop, deadnec, conversions)
 
         # Compare to experimental observation
         if confl is not None:
-            confl_obs = T.flatten(confl_exp - confl)
-            pm.Normal("confl_fit", sd=T.std(confl_obs), observed=confl_obs)
+            residualFit("confl_fit", confl_exp, confl, noise)
+
+            if confl.ndim == 3:
+                confl = np.nanmean(confl, axis=1)
+
             conflmean = T.mean(confl, axis=1)
             confl_exp_mean = T.mean(confl_exp, axis=1)
             pm.Deterministic("conflResid", (confl_exp_mean - conflmean) / conflmean[0])
 
         if apop is not None:
-            apop_obs = T.flatten(apop_exp - apop)
-            pm.Normal("apop_fit", sd=T.std(apop_obs), observed=apop_obs)
+            residualFit("apop_fit", apop_exp, apop, noise)
 
         if dna is not None:
-            dna_obs = T.flatten(dna_exp - dna)
-            pm.Normal("dna_fit", sd=T.std(dna_obs), observed=dna_obs)
+            residualFit("dna_fit", dna_exp, dna, noise)
 
     return M
 
 
 class drugInteractionModel:
-    """ An interaction model for two drug response. """
+    """
+    An interaction model for two drug response.
+    A list of drugs instead fits any number of drugs, over whichever combinations of them were measured.
+    X holds the (condition, drug) concentrations, and X1 and X2 its columns when there are two drugs.
+    """
 
-    def __init__(self, loadFile="072718_PC9_BYL_PIM", drug1="PIM447", drug2="BYL719", fit=True):
+    def __init__(self, loadFile="072718_PC9_BYL_PIM", drug1="PIM447", drug2="BYL719", fit=True, directory=None, wells=False, noise="std", adaptive=False, drugs=None):
 
         # Save input data
         self.loadFile = loadFile
@@ -86,15 +231,25 @@ class drugInteractionModel:
         # Load experimental data
         self.df = readCombo(self.loadFile)
 
-        self.df = filterDrugC(self.df, drug1, drug2)
+        self.drugs = [drug1, drug2] if drugs is None else list(drugs)
+
+        self.df = filterDrugs(self.df, self.drugs)
 
-        self.drugs = [drug1, drug2]
+        # With wells, phase, red and green keep every well as (condition, well, time)
+        self.X, self.timeV, self.phase, self.red, self.green = dataSplitDrugs(self.df, self.drugs, wells=wells)
 
-        self.X1, self.X2, self.timeV, self.phase, self.red, self.green = dataSplit(self.df)
+        if len(self.drugs) == 2:
+            self.X1, self.X2 = self.X[:, 0], self.X[:, 1]
 
         if fit:
             # Build pymc model
-            self.model = build_model(self.X1, self.X2, self.timeV, 1.0, confl=self.phase, apop=self.green, dna=self.red)
+            self.model = build_multi_model(self.X, self.timeV, 1.0, confl=self.phase, apop=self.green, dna=self.red, noise=noise)
 
             # Perform pymc fitting given actual data
-            self.samples = pm.sampling.sample(init="advi+adapt_diag", tune=1000, chains=2, model=self.model, progressbar=False)
+            if adaptive:
+                self.samples = adaptiveSample(self.model, init="advi+adapt_diag", tune=1000, chains=2, progressbar=False)
+            elif directory is None:
+                self.samples = pm.sampling.sample(init="advi+adapt_diag", tune=1000, chains=2, model=self.model, progressbar=False)
+            else:
+                # Stream draws to disk, as conflResid alone stores conditions x draws
+                self.samples = streamSample(self.model, directory, init="advi+adapt_diag", tune=1000, chains=2, progressbar=False)
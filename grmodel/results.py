@@ -0,0 +1,93 @@
+"""
+Lightweight, picklable fit results, and worker functions that return them, so fits can be spread
+over processes or machines without pickling the pymc3 models or Theano graphs.
+"""
+from copy import copy
+import numpy as np
+import pandas as pd
+import pymc3 as pm
+from pymc3.backends.tracetab import create_flat_names
+from .experiments import growthData
+from .legacyData import growthModel
+from .pymcInteraction import drugInteractionModel
+
+
+class FitResult:
+    """
+    The experiment layout and posterior draws of one fit, held as NumPy arrays.
+    For interaction fits, drugs holds the drug names and doses the (condition, drug) concentrations.
+    """
+
+    __slots__ = ("loadFile", "drugs", "doses", "timeV", "posterior")
+
+    def __init__(self, loadFile, drugs, doses, timeV, posterior):
+        self.loadFile = loadFile
+        self.drugs = list(drugs)
+        self.doses = np.asarray(doses)
+        self.timeV = np.asarray(timeV)
+        self.posterior = posterior
+
+    @classmethod
+    def fromModel(cls, M):
+        """ Reduce a fitted GrowthModel or drugInteractionModel. """
+        # Leave out the transformed and unit-scale variables, as performFit does for df
+        varnames = [name for name in pm.util.get_default_varnames(M.samples.varnames, False) if not name.endswith("_z")]
+        posterior = {name: np.asarray(M.samples[name]) for name in varnames}
+
+        if hasattr(M, "X"):
+            return cls(M.loadFile, M.drugs, M.X, M.timeV, posterior)
+
+        return cls(M.loadFile, M.drugs, M.doses, M.timeV, posterior)
+
+    def __getitem__(self, name):
+        return self.posterior[name]
+
+    @property
+    def varnames(self):
+        """ Names of the posterior variables. """
+        return list(self.posterior.keys())
+
+    def dataframe(self):
+        """ Draws with one column per element, named like pymc3's trace_to_dataframe. """
+        columns = dict()
+        for name, values in self.posterior.items():
+            flat = np.reshape(values, (values.shape[0], -1))
+            columns.update(zip(create_flat_names(name, values.shape[1:]), flat.T))
+
+        return pd.DataFrame(columns)
+
+    def save(self, filename):
+        """ Write to a compressed .npz file. """
+        posterior = {"posterior/" + name: values for name, values in self.posterior.items()}
+        np.savez_compressed(filename, loadFile=self.loadFile, drugs=np.asarray(self.drugs), doses=self.doses, timeV=self.timeV, **posterior)
+
+    @classmethod
+    def load(cls, filename):
+        """ Read a result written by save. """
+        with np.load(filename) as data:
+            posterior = {key.split("/", 1)[1]: data[key] for key in data.files if key.startswith("posterior/")}
+            return cls(str(data["loadFile"]), data["drugs"].tolist(), data["doses"], data["timeV"], posterior)
+
+
+def fitGrowth(loadFile, **kwargs):
+    """ Fit a GrowthModel, passing kwargs to performFit, and return only the FitResult. """
+    # A shallow copy of the shared parsed data, which the fit only adds attributes to
+    M = copy(growthData(loadFile))
+    M.performFit(**kwargs)
+    return FitResult.fromModel(M)
+
+
+def fitLegacy(experiment, overlap=False, **kwargs):
+    """ Fit a GrowthModel of an experiment of the legacy archive, passing kwargs to performFit, and return only the FitResult. """
+    M = growthModel(experiment, overlap=overlap)
+    M.performFit(**kwargs)
+    return FitResult.fromModel(M)
+
+
+def fitInteraction(loadFile, drug1=None, drug2=None, **kwargs):
+    """ Fit a drugInteractionModel of drug1 and drug2, or of a list of drugs, passing kwargs to it, and return only the FitResult. """
+    if drug1 is not None:
+        kwargs.update(drug1=drug1, drug2=drug2)
+
+    M = drugInteractionModel(loadFile, **kwargs)
+    return FitResult.fromModel(M)
@@ -0,0 +1,206 @@
+"""
+Simulation-based calibration (SBC) of the growth, interaction and dose-response models.
+
+Parameters are drawn from the priors of each pymc3 model, data are simulated with the NumPy forward model on the
+layout of a real experiment, and the model is refit to every simulated data set. If the fit is correct, the rank
+of each true value among its posterior draws is uniform. Each replicate is saved as it finishes, so an
+interrupted run picks up where it stopped. Simulated data get Gaussian noise of a fixed relative sd, which the
+models estimate from the residuals.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pymc3 as pm
+from scipy.stats import chisquare
+from pymc3.backends.tracetab import create_flat_names
+from .pymcGrowth import numpyCore, convSignal, build_model as growthModel
+from .pymcInteraction import blissRates, build_multi_model as interactionModel
+from .pymcDoseResponse import doseResponseModel
+from .experiments import growthData, comboData
+
+
+def addNoise(value, noise, random):
+    """ Gaussian noise with sd noise times the mean magnitude of value. """
+    return value + random.normal(scale=noise * np.mean(np.abs(value)), size=value.shape)
+
+
+def priorSample(model, varnames, n, seed, thin=10):
+    """ n independent prior draws of varnames, by NUTS on a model without data, as the priors include potentials. """
+    trace = pm.sample(draws=n * thin, tune=1000, chains=1, model=model, random_seed=seed, progressbar=False, compute_convergence_checks=False)
+    return {name: np.asarray(trace[name])[::thin] for name in varnames}
+
+
+class GrowthSBC:
+    """ SBC of pymcGrowth.build_model on the doses and times of loadFile. kwargs of fit go to build_model. """
+
+    name = "growth"
+    varnames = ["div", "deathRate", "apopfrac", "d", "confl_conv", "apop_conv", "dna_conv", "apop_offset", "dna_offset"]
+
+    def __init__(self, loadFile="101117_H1299", noise=0.05):
+        M = growthData(loadFile)
+        self.doses, self.timeV, self.conv0, self.noise = M.doses, M.timeV, M.conv0, noise
+
+    def prior(self, n, seed):
+        """ n draws from the priors. """
+        return priorSample(growthModel(self.conv0, self.doses, self.timeV, dict()), self.varnames, n, seed)
+
+    def simulate(self, truth, random):
+        """ Confluence, apoptosis and DNA signals of the true parameters. """
+        lnum, eap, deadapop, deadnec = numpyCore(self.timeV, truth["div"], truth["deathRate"], truth["apopfrac"], truth["d"])
+        conversions = ((truth["confl_conv"], truth["apop_conv"], truth["dna_conv"]), (truth["apop_offset"], truth["dna_offset"]))
+        signals = convSignal(lnum, eap, deadapop, deadnec, conversions)
+
+        return {key: np.ravel(addNoise(value, self.noise, random)) for key, value in zip(("confl", "apop", "dna"), signals)}
+
+    def fit(self, data, draws, seed, **kwargs):
+        """ Posterior of the simulated data. """
+        model = growthModel(self.conv0, self.doses, self.timeV, data, **kwargs)
+        return pm.sample(draws=draws, model=model, chains=2, init="advi+adapt_diag", target_accept=0.9, random_seed=seed, progressbar=False)
+
+
+class InteractionSBC:
+    """ SBC of pymcInteraction.build_multi_model on the conditions and times of a combination experiment. kwargs of fit go to it. """
+
+    name = "interaction"
+    varnames = ["hill", "IC50", "EmaxGrowth", "EmaxDeath", "GrowthCon", "apopfrac", "d", "confl_conv", "apop_conv", "dna_conv", "apop_offset", "dna_offset"]
+
+    def __init__(self, loadFile="072718_PC9_BYL_PIM", drug1="PIM447", drug2="BYL719", noise=0.05):
+        M = comboData(loadFile, drug1, drug2)
+        self.X, self.timeV, self.noise = M.X, M.timeV, noise
+
+    def prior(self, n, seed):
+        """ n draws from the priors. """
+        return priorSample(interactionModel(self.X, self.timeV, 1.0), self.varnames, n, seed)
+
+    def simulate(self, truth, random):
+        """ Confluence, apoptosis and DNA signals of the true parameters. """
+        growth, death, apopfrac = (x[0] for x in blissRates({key: np.asarray(value)[None] for key, value in truth.items()}, self.X))
+        conversions = ((truth["confl_conv"], truth["apop_conv"], truth["dna_conv"]), (truth["apop_offset"], truth["dna_offset"]))
+        signals = convSignal(*numpyCore(self.timeV, growth, death, apopfrac, truth["d"]), conversions)
+
+        return {key: addNoise(value, self.noise, random) for key, value in zip(("confl", "apop", "dna"), signals)}
+
+    def fit(self, data, draws, seed, **kwargs):
+        """ Posterior of the simulated data. """
+        model = interactionModel(self.X, self.timeV, 1.0, **data, **kwargs)
+        return pm.sample(draws=draws, model=model, chains=2, init="advi+adapt_diag", random_seed=seed, progressbar=False)
+
+
+class DoseResponseSBC:
+    """ SBC of doseResponseModel on the CellTiter doses of Drug. With laplace, fits use fitLaplace instead of NUTS. """
+
+    name = "doseResponse"
+    varnames = ["IC50s", "Emin_growth", "Emax_death", "hill"]
+
+    def __init__(self, Drug=None, noise=0.05):
+        self.Drug, self.noise = Drug, noise
+
+    def prior(self, n, seed):
+        """ n draws from the priors, which have no potentials here so are sampled directly. """
+        prior = pm.sample_prior_predictive(n, model=doseResponseModel(self.Drug).model, var_names=self.varnames, random_seed=seed)
+        return {name: prior[name] for name in self.varnames}
+
+    def simulate(self, truth, random):
+        """ CellTiter response relative to the control of each drug. """
+        M = doseResponseModel(self.Drug)
+        drugIdx = M.drugIdx if M.shape else np.zeros_like(M.drugIdx)
+        IC50s, Emin_growth, Emax_death, hill = (np.reshape(truth[name], (-1,))[drugIdx] for name in self.varnames)
+
+        drugTerm = 1.0 / (1.0 + np.power(10.0, (IC50s - M.drugCs) * hill))
+        lnum = np.exp((M.Emax_growth + (Emin_growth - M.Emax_growth - Emax_death) * drugTerm) * M.time)
+
+        return {"lObs": addNoise(lnum / lnum[M.controlIdx], self.noise, random)}
+
+    def fit(self, data, draws, seed, laplace=False, **kwargs):
+        """ Posterior of the simulated data. """
+        M = doseResponseModel(self.Drug, **kwargs)
+        M.lObs = data["lObs"]
+        M.model = M.build_model()
+
+        if laplace:
+            M.fitLaplace(draws=2 * draws, seed=seed)
+        else:
+            M.trace = pm.sample(draws=draws, model=M.model, chains=2, target_accept=0.9, random_seed=seed, progressbar=False)
+
+        return M.trace
+
+
+def ranks(trace, truth, varnames, thin):
+    """ Rank of each true value among the thinned posterior draws, by flattened parameter name. """
+    out = dict()
+    for name in varnames:
+        post = np.asarray(trace[name])[::thin]
+        true = np.asarray(truth[name])
+        out.update(zip(create_flat_names(name, true.shape), np.ravel(np.sum(post < true, axis=0))))
+
+    return out, len(np.asarray(trace[varnames[0]])[::thin])
+
+
+def sbcJob(job):
+    """ Simulate and refit one replicate, saving its ranks under directory. Returns the file. """
+    case, index, truth, directory, draws, thin, fitKwargs = job
+    random = np.random.RandomState(index)
+
+    trace = case.fit(case.simulate(truth, random), draws, index, **fitKwargs)
+    rank, L = ranks(trace, truth, case.varnames, thin)
+
+    filename = os.path.join(directory, case.name + "-" + str(index) + ".npz")
+    np.savez(filename + ".tmp.npz", L=L, names=list(rank.keys()), ranks=list(rank.values()))
+    os.replace(filename + ".tmp.npz", filename)
+
+    return filename
+
+
+def runSBC(case, directory, n=100, draws=1000, thin=20, max_workers=None, seed=0, **fitKwargs):
+    """
+    Run n SBC replicates of case (GrowthSBC, InteractionSBC or DoseResponseSBC) in a process pool, with fitKwargs passed
+    to case.fit so variants of a model can be checked. The prior draws and every finished replicate are kept in
+    directory, so calling this again only runs the missing replicates, against the same true values; n cannot grow
+    past the first run's. Returns the table from rankTable.
+    """
+    os.makedirs(directory, exist_ok=True)
+    priorFile = os.path.join(directory, case.name + "-prior.npz")
+
+    if os.path.exists(priorFile):
+        with np.load(priorFile) as data:
+            prior = {name: data[name] for name in data.files}
+    else:
+        prior = case.prior(n, seed)
+        np.savez(priorFile, **prior)
+
+    jobs = []
+    for index in range(min(n, len(prior[case.varnames[0]]))):
+        if not os.path.exists(os.path.join(directory, case.name + "-" + str(index) + ".npz")):
+            truth = {name: value[index] for name, value in prior.items()}
+            jobs.append((case, index, truth, directory, draws, thin, fitKwargs))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(sbcJob, jobs))
+
+    return rankTable(case, directory)
+
+
+def rankTable(case, directory):
+    """ Ranks of every finished replicate of case, one row per replicate and parameter, with L the number of posterior draws ranked against. """
+    tables = []
+    for filename in sorted(os.listdir(directory)):
+        stem = filename[: -len(".npz")]
+        if not filename.endswith(".npz") or not stem.startswith(case.name + "-") or not stem.split("-")[-1].isdigit():
+            continue
+
+        with np.load(os.path.join(directory, filename)) as data:
+            tables.append(pd.DataFrame({"replicate": int(stem.split("-")[-1]), "parameter": data["names"], "rank": data["ranks"], "L": int(data["L"])}))
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def rankUniformity(df, bins=10):
+    """ Chi-square test that the ranks of each parameter are uniform, from a rankTable. Small p-values flag miscalibration. """
+    rows = []
+    for param, group in df.groupby("parameter"):
+        counts = np.bincount(np.minimum(group["rank"].values * bins // (group["L"].values + 1), bins - 1), minlength=bins)
+        stat, pvalue = chisquare(counts)
+        rows.append({"parameter": param, "replicates": len(group), "chi2": stat, "p": pvalue})
+
+    return pd.DataFrame(rows)
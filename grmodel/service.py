@@ -0,0 +1,177 @@
+"""
+A small local HTTP service that keeps parsed experiments and their posteriors in memory, so that
+interactive dashboards and notebooks can query summaries without refitting.
+
+Queries are GET requests with the experiment as parameters, e.g.
+    /summary?file=101117_H1299
+    /curves?file=050719_PC9_LCL_OSI&drug1=LCL161&drug2=OSI-906&prob=0.9
+With a posterior store directory, fits already written there by executors.fitAll are read instead of refit.
+"""
+import json
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from . import executors
+from .cache import LRUCache
+from .pymcGrowth import numpyCore, convSignal
+from .pymcInteraction import blissRates
+from .utils import hdi
+
+rateNames = ["div", "deathRate", "apopfrac"]
+convNames = (("confl_conv", "apop_conv", "dna_conv"), ("apop_offset", "dna_offset"))
+queryPaths = ("/summary", "/curves")
+
+
+class QueryError(ValueError):
+    """ A query with a missing, unknown or malformed parameter. """
+
+
+def loadExperiment(loadFile, drug1=None, drug2=None, store=None):
+    """
+    Fit an experiment, or read its fit from store if there, and reduce it to the NumPy arrays needed for queries.
+    A growth model is used unless drugs are given. New fits are written to store.
+    """
+    job = ("growth", loadFile, dict()) if drug1 is None else ("interaction", loadFile, {"drug1": drug1, "drug2": drug2})
+    key = executors.jobKey(job)
+
+    if store is not None and key in store:
+        result = store.load(key)
+    else:
+        result = executors.runJob(job)
+        if store is not None:
+            store.save(key, result)
+
+    post = result.posterior
+    if drug1 is None:
+        rates = {name: post[name] for name in rateNames}
+        doses = result.doses.tolist()
+        drugs = list(result.drugs)
+    else:
+        rates = dict(zip(rateNames, blissRates(post, result.doses)))
+        doses = [tuple(float(x) for x in row) for row in result.doses]
+        drugs = ["+".join(result.drugs)] * len(doses)
+
+    conversions = tuple(tuple(np.reshape(post[name], (-1, 1, 1)) for name in names) for names in convNames)
+
+    return {"drugs": drugs, "doses": doses, "timeV": np.asarray(result.timeV), "rates": rates, "d": post["d"], "conversions": conversions}
+
+
+def summarize(draws, prob):
+    """ Median and HDI over the first axis, as nested lists. """
+    lower, upper = hdi(draws, prob)
+    return {"median": np.median(draws, axis=0).tolist(), "lower": lower.tolist(), "upper": upper.tolist()}
+
+
+class PosteriorService:
+    """
+    Answers summary and curve queries, fitting each experiment on first use and keeping it in an LRU cache.
+    With store, a directory of fit results, experiments found there are not refit.
+    """
+
+    def __init__(self, maxsize=8, maxresults=256, store=None):
+        self.experiments = LRUCache(maxsize)
+        self.results = LRUCache(maxresults)
+        self.store = None if store is None else executors.PosteriorStore(store)
+
+    def experiment(self, loadFile, drug1=None, drug2=None):
+        """ Return the cached experiment, fitting it on a miss. """
+        return self.experiments.get((loadFile, drug1, drug2), lambda: loadExperiment(loadFile, drug1, drug2, self.store))
+
+    def summary(self, loadFile, drug1=None, drug2=None, prob=0.95):
+        """ Median and HDI of div, deathRate and apopfrac for every condition. """
+        exp = self.experiment(loadFile, drug1, drug2)
+        out = {"drugs": exp["drugs"], "doses": exp["doses"]}
+
+        for name in rateNames:
+            out[name] = summarize(exp["rates"][name], prob)
+
+        return out
+
+    def curves(self, loadFile, drug1=None, drug2=None, prob=0.95):
+        """ Median and HDI of the predicted confl, apop and dna time courses for every condition. """
+        exp = self.experiment(loadFile, drug1, drug2)
+        rates = exp["rates"]
+
+        lnum, eap, deadapop, deadnec = numpyCore(exp["timeV"], rates["div"], rates["deathRate"], rates["apopfrac"], exp["d"][:, None])
+        signals = convSignal(lnum, eap, deadapop, deadnec, exp["conversions"])
+
+        out = {"drugs": exp["drugs"], "doses": exp["doses"], "time": exp["timeV"].tolist()}
+        for name, signal in zip(["confl", "apop", "dna"], signals):
+            out[name] = summarize(signal, prob)
+
+        return out
+
+    def query(self, path, params):
+        """ Dispatch a query by path, caching its result so repeated requests are not recomputed. """
+        if path not in queryPaths:
+            raise QueryError("unknown path " + path)
+
+        if "file" not in params:
+            raise QueryError("missing file")
+
+        if ("drug1" in params) != ("drug2" in params):
+            raise QueryError("drug1 and drug2 must be given together")
+
+        try:
+            prob = float(params.get("prob", 0.95))
+        except ValueError:
+            raise QueryError("prob must be a number")
+
+        if not 0.0 < prob < 1.0:
+            raise QueryError("prob must be between 0 and 1")
+
+        args = (params["file"], params.get("drug1"), params.get("drug2"), prob)
+        method = self.summary if path == "/summary" else self.curves
+
+        return self.results.get((path,) + args, lambda: json.dumps(method(*args)).encode())
+
+
+def errorResponse(path, err):
+    """ Status and JSON body for an error of a query: 4xx for a bad query or experiment, 500 for a failed fit. """
+    if isinstance(err, QueryError):
+        return (404 if path not in queryPaths else 400), {"error": str(err)}
+
+    if isinstance(err, FileNotFoundError):
+        return 404, {"error": "unknown experiment: " + str(err)}
+
+    return 500, {"error": "fit failed: " + repr(err)}
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """ HTTP server handling each request in its own thread. """
+
+    daemon_threads = True
+
+
+def serve(host="127.0.0.1", port=8050, maxsize=8, store=None):
+    """ Run the posterior service until interrupted, reading fits from the store directory if given. """
+    service = PosteriorService(maxsize, store=store)
+
+    class Handler(BaseHTTPRequestHandler):
+        """ Turns GET requests into service queries. """
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """ Answer one query with JSON. """
+            url = urlparse(self.path)
+            params = {key: value[0] for key, value in parse_qs(url.query).items()}
+
+            try:
+                body, status = service.query(url.path, params), 200
+            except Exception as err:  # pylint: disable=broad-except
+                # A failed fit should still answer, rather than drop the connection
+                status, error = errorResponse(url.path, err)
+                body = json.dumps(error).encode()
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
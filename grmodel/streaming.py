@@ -0,0 +1,209 @@
+"""
+Trace backend that streams draws to chunked files on disk as they are sampled, so that peak
+memory does not grow with the number of draws. Running statistics are updated online.
+"""
+import os
+from glob import glob
+import numpy as np
+import pandas as pd
+import pymc3 as pm
+from pymc3.backends.base import BaseTrace, MultiTrace
+from pymc3.backends.ndarray import NDArray
+from pymc3.backends.tracetab import create_flat_names
+
+
+class RunningStats:
+    """ Online mean and variance of a variable, plus a reservoir sample of draws for approximate quantiles. """
+
+    def __init__(self, shape, reservoir=1000, seed=None):
+        self.n = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.reservoir = np.empty((reservoir,) + tuple(shape))
+        self.random = np.random.RandomState(seed)
+
+    def update(self, value):
+        """ Add one draw. """
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+        # Keep a uniform sample of all the draws seen so far
+        if self.n <= self.reservoir.shape[0]:
+            self.reservoir[self.n - 1] = value
+        else:
+            idx = self.random.randint(self.n)
+            if idx < self.reservoir.shape[0]:
+                self.reservoir[idx] = value
+
+    @property
+    def variance(self):
+        """ Sample variance of the draws. """
+        return self.m2 / max(self.n - 1, 1)
+
+    def sample(self):
+        """ The reservoir draws collected so far. """
+        return self.reservoir[: min(self.n, self.reservoir.shape[0])]
+
+    def quantile(self, q):
+        """ Approximate quantiles from the reservoir. """
+        return np.quantile(self.sample(), q, axis=0)
+
+    def merge(self, other):
+        """ Combine with the statistics of another chain, returning a new object. """
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            return other
+
+        out = RunningStats(self.mean.shape, self.reservoir.shape[0])
+        out.n = self.n + other.n
+        delta = other.mean - self.mean
+        out.mean = self.mean + delta * other.n / out.n
+        out.m2 = self.m2 + other.m2 + delta ** 2 * self.n * other.n / out.n
+
+        # Draw the merged reservoir from each side in proportion to the draws it represents
+        pooled = np.concatenate([self.sample(), other.sample()])
+        weights = np.concatenate([np.full(len(self.sample()), self.n / len(self.sample())), np.full(len(other.sample()), other.n / len(other.sample()))])
+        keep = min(out.reservoir.shape[0], len(pooled))
+        idx = out.random.choice(len(pooled), keep, replace=False, p=weights / np.sum(weights))
+        out.reservoir[:keep] = pooled[idx]
+
+        return out
+
+
+class ChunkedTrace(BaseTrace):
+    """
+    Append-only trace backend. Each chain writes its draws to numbered .npz chunks in its own
+    subdirectory of name, so only the current chunk and the running statistics stay in memory.
+
+    The first skip draws (the tuning draws) are counted but never stored, so the trace can be
+    used with the default discard_tuned_samples. Values are read back from disk only when asked for.
+    """
+
+    def __init__(self, name, chain=0, model=None, vars=None, skip=0, chunk=100, reservoir=1000):  # pylint: disable=redefined-builtin
+        super().__init__(name, model, vars)
+        self.chain = chain
+        self.skip = skip
+        self.chunk = chunk
+        self.reservoir = reservoir
+        self.directory = None
+        self.buffer = None
+        self.stats = None
+        self.nRecord = 0
+        self.nStored = 0
+
+    def setup(self, draws, chain, sampler_vars=None):
+        """ Prepare an empty chain directory and the chunk buffer. """
+        super().setup(draws, chain, sampler_vars)
+        self.chain = chain
+        self.directory = os.path.join(self.name, "chain-{}".format(chain))
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Chunks from an earlier run would otherwise be read back as part of this one
+        for filename in glob(os.path.join(self.directory, "chunk-*.npz")):
+            os.remove(filename)
+
+        self.buffer = {v: np.empty((self.chunk,) + self.var_shapes[v], dtype=self.var_dtypes[v]) for v in self.varnames}
+        self.stats = {v: RunningStats(self.var_shapes[v], self.reservoir, seed=chain) for v in self.varnames}
+        self.nRecord = 0
+        self.nStored = 0
+
+    def record(self, point, sampler_states=None):
+        """ Add a draw to the buffer and statistics, writing out the buffer when it is full. """
+        self.nRecord += 1
+        if self.nRecord <= self.skip:
+            return
+
+        pos = self.nStored % self.chunk
+        for varname, value in zip(self.varnames, self.fn(point)):
+            self.buffer[varname][pos] = value
+            self.stats[varname].update(value)
+
+        self.nStored += 1
+        if pos == self.chunk - 1:
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered draws of the current chunk to disk. """
+        nBuffer = self.nStored % self.chunk or self.chunk
+        if self.nStored == 0 or os.path.exists(self.chunkFile((self.nStored - 1) // self.chunk)):
+            return
+
+        np.savez(self.chunkFile((self.nStored - 1) // self.chunk), **{v: values[:nBuffer] for v, values in self.buffer.items()})
+
+    def chunkFile(self, idx):
+        """ Path of chunk idx. """
+        return os.path.join(self.directory, "chunk-{:06d}.npz".format(idx))
+
+    def close(self):
+        """ Write out the last, partial chunk. """
+        if self.directory is not None:
+            self.flush()
+
+    def __len__(self):
+        return self.nRecord
+
+    def get_values(self, varname, burn=0, thin=1):
+        """ Read the stored draws of varname back from disk. burn counts the unstored tuning draws. """
+        values = []
+        for idx in range(int(np.ceil(self.nStored / self.chunk))):
+            if os.path.exists(self.chunkFile(idx)):
+                with np.load(self.chunkFile(idx)) as chunk:
+                    values.append(chunk[varname])
+            else:
+                values.append(self.buffer[varname][: self.nStored - idx * self.chunk])
+
+        values = np.concatenate(values) if values else np.empty((0,) + self.var_shapes[varname])
+        return values[max(burn - self.skip, 0):: thin]
+
+    def _slice(self, idx):
+        start, stop, step = idx.indices(len(self))
+
+        # The tuning draws are never stored, so dropping them is free
+        if start <= self.skip and stop == len(self) and step == 1:
+            return self
+
+        sliced = NDArray(model=self.model, vars=self.vars)
+        sliced.chain = self.chain
+        start, stop = max(start - self.skip, 0), max(stop - self.skip, 0)
+        sliced.samples = {v: self.get_values(v)[start:stop:step] for v in self.varnames}
+        sliced.draw_idx = len(range(start, stop, step))
+        return sliced
+
+    def point(self, idx):
+        """ Values of all variables at draw idx. """
+        idx = int(idx)
+        if idx >= 0:
+            idx -= self.skip
+
+        return {v: self.get_values(v)[idx] for v in self.varnames}
+
+
+def streamSample(model, directory, draws=1000, tune=1000, chains=2, chunk=100, **kwargs):
+    """ Run pm.sample with one ChunkedTrace per chain under directory, skipping the tuning draws. """
+    traces = MultiTrace([ChunkedTrace(directory, chain, model=model, skip=tune, chunk=chunk) for chain in range(chains)])
+
+    # Convergence checks would read every draw back into memory
+    kwargs.setdefault("compute_convergence_checks", False)
+
+    return pm.sample(draws=draws, tune=tune, chains=chains, trace=traces, model=model, **kwargs)
+
+
+def streamSummary(trace, q=(0.05, 0.5, 0.95)):
+    """ Mean, standard deviation and quantiles of every element, merged across chains, from the running statistics alone. """
+    rows = []
+    for varname in trace.varnames:
+        stats = [strace.stats[varname] for strace in trace._straces.values()]  # pylint: disable=protected-access
+        merged = stats[0]
+        for other in stats[1:]:
+            merged = merged.merge(other)
+
+        quantiles = merged.quantile(q).reshape(len(q), -1)
+        for ii, flatname in enumerate(create_flat_names(varname, merged.mean.shape)):
+            row = {"name": flatname, "mean": merged.mean.flat[ii], "sd": np.sqrt(merged.variance.flat[ii])}
+            row.update({"q" + str(qi): quantiles[jj, ii] for jj, qi in enumerate(q)})
+            rows.append(row)
+
+    return pd.DataFrame(rows).set_index("name")
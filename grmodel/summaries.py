@@ -0,0 +1,78 @@
+"""
+Sort-based summaries of posterior draws and grouped data, shared by the figure code.
+Every quantile level, the median, mean and SEM come from a single sort of the values.
+"""
+import numpy as np
+
+
+def sortedQuantiles(values, starts, counts, q):
+    """ Linearly interpolated quantiles (as numpy.quantile) of sorted runs values[starts:starts + counts], for every level in q. """
+    pos = starts + np.multiply.outer(np.asarray(q, dtype=np.float64), counts - 1)
+    lower = np.floor(pos).astype(np.int64)
+    upper = np.minimum(lower + 1, starts + counts - 1)
+    frac = pos - lower
+
+    return values[lower] * (1.0 - frac) + values[upper] * frac
+
+
+def intervalLevels(levels):
+    """ Lower and upper quantile levels of central intervals, e.g. 0.9 -> (0.05, 0.95). """
+    levels = np.asarray(levels, dtype=np.float64)
+    return np.concatenate([(1.0 - levels) / 2.0, (1.0 + levels) / 2.0])
+
+
+def drawSummary(draws, levels=(0.9, 0.75, 0.5)):
+    """
+    Median and central intervals over the first axis of draws, for each level in levels.
+    Returns (median, lower, upper), with lower and upper shaped (len(levels),) + draws.shape[1:].
+    """
+    draws = np.sort(np.asarray(draws, dtype=np.float64), axis=0)
+    n = draws.shape[0]
+    flat = np.reshape(draws, (n, -1)).T.ravel()
+
+    # Each column is a sorted run of n values in the flattened array
+    starts = n * np.arange(flat.size // n)
+    counts = np.full(starts.shape, n)
+    quants = sortedQuantiles(flat, starts, counts, np.concatenate([[0.5], intervalLevels(levels)]))
+    quants = np.reshape(quants, (-1,) + draws.shape[1:])
+
+    return quants[0], quants[1: len(levels) + 1], quants[len(levels) + 1:]
+
+
+def groupCodes(keys):
+    """ Integer group of each row, and the key values of every group, for one key array or a list of them. """
+    if not isinstance(keys, (list, tuple)):
+        keys = [keys]
+    keys = [np.asarray(key) for key in keys]
+
+    uniques, codes = zip(*[np.unique(key, return_inverse=True) for key in keys])
+    code = np.ravel_multi_index([np.ravel(c) for c in codes], [len(u) for u in uniques])
+    groupCode, first, group = np.unique(code, return_index=True, return_inverse=True)
+
+    return np.ravel(group), [key[first] for key in keys], len(groupCode)
+
+
+def groupSummary(keys, values, q=(0.5,), ddof=1):
+    """
+    Count, mean, SEM and quantiles q of values for every group of keys, which is one array or a list of arrays
+    whose unique combinations form the groups. Groups are in sorted key order.
+    Returns a dict with "keys" (the key values of each group), "count", "mean", "sem" and "quantiles" (len(q), groups).
+    """
+    group, groupKeys, nGroup = groupCodes(keys)
+    values = np.asarray(values, dtype=np.float64)
+
+    count = np.bincount(group, minlength=nGroup)
+    mean = np.bincount(group, weights=values, minlength=nGroup) / count
+    var = np.bincount(group, weights=np.square(values - mean[group]), minlength=nGroup) / np.maximum(count - ddof, 1)
+
+    # Sorting by group, then value, leaves each group as a sorted run
+    order = np.lexsort((values, group))
+    starts = np.cumsum(count) - count
+
+    return {
+        "keys": groupKeys,
+        "count": count,
+        "mean": mean,
+        "sem": np.sqrt(var / count),
+        "quantiles": sortedQuantiles(values[order], starts, count, q),
+    }
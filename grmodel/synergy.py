@@ -0,0 +1,157 @@
+"""
+Synergy scores of drug combinations from the posterior of drugInteractionModel.
+
+Effects are on the net growth rate scale, E = 1 - GR / GrowthCon, with the untreated growth rate of the same draw as
+the baseline on both sides. Dead cells stay in the phase image, so the observed effect of every condition comes from
+its growth and death rates, fit to the confluence, apoptosis and DNA channels with the conversions, d and apopfrac of
+each posterior draw. Under the model each drug alone has the Hill curve
+E_i(x) = (EmaxGrowth_i + EmaxDeath_i / GrowthCon) * occupancy_i(x). The Bliss, Loewe and HSA references are
+computed from these single-agent curves for the same draws, so each excess comes with its uncertainty.
+"""
+import numpy as np
+import pandas as pd
+from scipy.optimize import least_squares
+from .pymcGrowth import numpyCore, convSignal
+from .pymcInteraction import conditionOccupancy, blissRates, drugInteractionModel
+from .experiments import comboData
+from .summaries import drawSummary
+
+sharedNames = ("confl_conv", "apop_conv", "dna_conv", "apop_offset", "dna_offset", "apopfrac", "d")
+
+
+def conditionRates(timeV, phase, red, green, shared, x0=None):
+    """
+    Growth and death rate of every condition, each (condition,), by least squares on the three channels with the
+    shared parameters fixed. Channels are weighted by the inverse of their standard deviation.
+    x0 holds the (condition, 2) starting rates, by default 0.01 and 0.001 for all.
+    """
+    data = [np.nanmean(x, axis=1) if x.ndim == 3 else x for x in (phase, green, red)]
+    weights = [1.0 / np.std(x) for x in data]
+    conversions = ((shared["confl_conv"], shared["apop_conv"], shared["dna_conv"]), (shared["apop_offset"], shared["dna_offset"]))
+
+    def residuals(rates, cc):
+        signals = convSignal(*numpyCore(timeV, rates[0], rates[1], shared["apopfrac"], shared["d"]), conversions)
+        return np.concatenate([w * (signal - x[cc]) for w, signal, x in zip(weights, signals, data)])
+
+    x0 = np.tile((0.01, 0.001), (data[0].shape[0], 1)) if x0 is None else np.maximum(x0, 1e-8)
+    fits = [least_squares(residuals, x0[cc], bounds=(0.0, np.inf), x_scale="jac", args=(cc,)).x for cc in range(data[0].shape[0])]
+    return tuple(np.array(fits).T)
+
+
+def observedEffect(X, timeV, phase, red, green, samples):
+    """
+    Effect of every condition for every draw, (draws, condition), from its net growth rate fit with the shared
+    parameters of the draw, relative to the GrowthCon of the draw. The fits start from the model's rates of the draw.
+    """
+    start = np.stack(blissRates(samples, X)[:2], axis=2)
+    GrowthCon = np.ravel(samples["GrowthCon"])
+    effect = np.empty(start.shape[:2])
+
+    for ii in range(effect.shape[0]):
+        shared = {name: float(np.ravel(samples[name][ii])[0]) for name in sharedNames}
+        growth, death = conditionRates(timeV, phase, red, green, shared, start[ii])
+        effect[ii] = 1.0 - (growth - death) / GrowthCon[ii]
+
+    return effect
+
+
+def singleEffects(samples, X):
+    """ Effect of each drug alone at its concentration in every condition, (draws, condition, drug), and the maximal effects (draws, drug). """
+    Emax = np.asarray(samples["EmaxGrowth"]) + np.asarray(samples["EmaxDeath"]) / np.reshape(samples["GrowthCon"], (-1, 1))
+    occupancy = conditionOccupancy(X, np.asarray(samples["hill"]), np.asarray(samples["IC50"]))
+
+    return Emax[:, None, :] * occupancy, Emax
+
+
+def loeweReference(samples, X, iterations=50):
+    """
+    Loewe additive effect of every condition for every draw, (draws, condition). Solves sum_i x_i / X_i(E) = 1, with X_i
+    the inverse of drug i's Hill curve, by bisection over all draws and conditions at once. A drug that cannot reach E
+    contributes nothing to the sum.
+    """
+    hill, IC50 = np.asarray(samples["hill"])[:, None, :], np.asarray(samples["IC50"])[:, None, :]
+    Emax = singleEffects(samples, X)[1][:, None, :]
+    logX = np.log(X)[None, :, :]
+
+    lower = np.zeros((Emax.shape[0], X.shape[0]))
+    upper = np.broadcast_to(np.max(Emax, axis=2), lower.shape).copy()
+
+    for _ in range(iterations):
+        E = (lower + upper) / 2.0
+        En = E[:, :, None]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.exp(logX - np.log(IC50) - (np.log(En) - np.log(Emax - En)) / hill)
+
+        # The dose sum falls as E rises, so a sum above 1 means the additive effect is larger
+        total = np.sum(np.where(En < Emax, ratio, 0.0), axis=2)
+        lower = np.where(total > 1.0, E, lower)
+        upper = np.where(total > 1.0, upper, E)
+
+    return (lower + upper) / 2.0
+
+
+def references(samples, X):
+    """ Bliss, Loewe and HSA additive effects of every condition for every draw, as a dict of (draws, condition) arrays. """
+    single = singleEffects(samples, X)[0]
+
+    return {
+        "bliss": 1.0 - np.prod(1.0 - single, axis=2),
+        "loewe": loeweReference(samples, X),
+        "hsa": np.max(single, axis=2),
+    }
+
+
+def synergyScores(samples, X, timeV, phase, red, green, drugs=None, level=0.9, draws=100):
+    """
+    Bliss, Loewe and HSA excess, observed minus additive effect, of every condition.
+    samples is the trace of drugInteractionModel or any mapping of the same names to arrays, X the (condition, drug)
+    concentrations and phase, red and green the observed channels. The observed effect needs a fit per draw and condition,
+    so at most draws evenly spaced draws are used. Returns a table with the concentrations, the median observed effect and,
+    for each score, the posterior median, the central level interval and the probability of synergy (excess > 0).
+    """
+    X = np.asarray(X, dtype=np.float64)
+    drugs = ["drug" + str(ii + 1) for ii in range(X.shape[1])] if drugs is None else drugs
+
+    nDraws = len(samples["GrowthCon"])
+    index = np.unique(np.linspace(0, nDraws - 1, min(draws, nDraws)).astype(int))
+    samples = {name: np.asarray(samples[name])[index] for name in ("hill", "IC50", "EmaxGrowth", "EmaxDeath", "GrowthCon") + sharedNames}
+
+    observed = observedEffect(X, timeV, phase, red, green, samples)
+    out = pd.DataFrame(X - 0.01, columns=drugs)
+    out["effect"] = np.median(observed, axis=0)
+
+    for name, reference in references(samples, X).items():
+        excess = observed - reference
+        median, lower, upper = drawSummary(excess, (level,))
+
+        out[name] = median
+        out[name + "_lower"] = lower[0]
+        out[name + "_upper"] = upper[0]
+        out[name + "_prob"] = np.mean(excess > 0.0, axis=0)
+
+    return out
+
+
+def scoreModel(M, level=0.9, draws=100):
+    """ synergyScores of a fitted drugInteractionModel. """
+    return synergyScores(M.samples, M.X, M.timeV, M.phase, M.red, M.green, M.drugs, level, draws)
+
+
+def scoreResult(result, level=0.9, draws=100):
+    """ synergyScores of an interaction FitResult, with the observations read through the shared experiment cache. """
+    if len(result.drugs) == 2:
+        M = comboData(result.loadFile, *result.drugs)
+    else:
+        M = drugInteractionModel(result.loadFile, drugs=result.drugs, fit=False)
+
+    return synergyScores(result.posterior, result.doses.astype(np.float64), M.timeV, M.phase, M.red, M.green, result.drugs, level, draws)
+
+
+def scoreAll(results, level=0.9, draws=100):
+    """ Scores of every interaction FitResult, e.g. from executors.fitAll, in one table with the file and drugs of each row. """
+    tables = []
+    for result in results:
+        tables.append(scoreResult(result, level, draws).assign(loadFile=result.loadFile, drugs="+".join(result.drugs)))
+
+    return pd.concat(tables, ignore_index=True, sort=False)
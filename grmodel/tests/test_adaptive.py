@@ -0,0 +1,21 @@
+"""
+Check that block sampling carries the tuned sampler forward and measures convergence outside a model context.
+"""
+import numpy as np
+import pymc3 as pm
+from ..adaptive import adaptiveSample
+
+
+def test_carriedAdaptation():
+    """ Later blocks keep the tuned step size and have no tuning draws, and the draws fit the target. """
+    with pm.Model() as model:
+        pm.Normal("div", 0.0, np.array([1.0, 10.0]), shape=2)
+
+    trace = adaptiveSample(model, essTarget=1e6, block=200, maxDraws=600, tune=300, init="jitter+adapt_diag", progressbar=False, cores=1, random_seed=1)
+
+    assert len(trace) == 600
+    for stepSize in trace.get_sampler_stats("step_size", combine=False):
+        # The draws of the first block use the step size it was tuned to, and the later blocks the same one
+        np.testing.assert_allclose(stepSize[200:], stepSize[199], rtol=0.3)
+
+    np.testing.assert_allclose(np.std(trace["div"], axis=0), [1.0, 10.0], rtol=0.2)
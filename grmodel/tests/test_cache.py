@@ -0,0 +1,50 @@
+"""
+Check that a slow miss in the LRU cache does not block other lookups.
+"""
+import time
+from threading import Thread, Event
+import pytest
+from ..cache import LRUCache
+
+
+def test_missDoesNotBlock():
+    """ Hits are answered while another key is computed, and a key computed by one thread is not computed again by another. """
+    cache = LRUCache()
+    cache.put("cached", 1)
+    started, release = Event(), Event()
+    calls, results = [], []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5.0)
+        return 2
+
+    threads = [Thread(target=lambda: results.append(cache.get("slow", slow))) for _ in range(2)]
+    threads[0].start()
+    started.wait(5.0)
+    threads[1].start()
+
+    start = time.time()
+    assert cache.get("cached") == 1
+    assert time.time() - start < 1.0
+
+    release.set()
+    for thread in threads:
+        thread.join(5.0)
+
+    assert results == [2, 2]
+    assert len(calls) == 1
+
+
+def test_failedCompute():
+    """ A failed compute raises, and the key can be computed again. """
+    cache = LRUCache()
+
+    def fail():
+        raise ValueError("no data")
+
+    with pytest.raises(ValueError):
+        cache.get("key", fail)
+
+    assert cache.get("key", lambda: 3) == 3
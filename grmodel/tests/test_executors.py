@@ -0,0 +1,82 @@
+"""
+Check that the SQLite job queue retries failed jobs, requeues jobs of dead workers and reports failures.
+"""
+import time
+from threading import Thread
+import pytest
+from .. import executors
+from ..executors import QueueExecutor, PosteriorStore, jobKey
+
+
+class Result:
+    """ Stand-in for a FitResult. """
+
+    def save(self, filename):
+        """ Write an empty file. """
+        with open(filename, "w"):
+            pass
+
+
+@pytest.fixture(name="queue")
+def fixtureQueue(tmp_path, monkeypatch):
+    """ A queue whose jobs fail as many times as their loadFile says, and a store. """
+    calls = dict()
+
+    def runJob(job):
+        calls[job[1]] = calls.get(job[1], 0) + 1
+        if calls[job[1]] <= int(job[1]):
+            raise ValueError("attempt " + str(calls[job[1]]))
+        return Result()
+
+    monkeypatch.setattr(executors, "runJob", runJob)
+    return QueueExecutor(str(tmp_path / "queue.db"), poll=0.01, timeout=0.2, retries=1), PosteriorStore(str(tmp_path / "store"))
+
+
+def test_retry(queue):
+    """ A job that fails once is retried, and one that fails on every attempt is marked failed with its error. """
+    Q, store = queue
+    jobs = [("growth", "1", dict()), ("growth", "9", dict())]
+    Q.submit(jobs)
+    Q.work(store.directory)
+
+    assert jobKey(jobs[0]) in store
+    assert Q.status() == {jobKey(jobs[0]): "done", jobKey(jobs[1]): "failed"}
+    assert Q.errors() == {jobKey(jobs[1]): repr(ValueError("attempt 2"))}
+
+
+def test_mapRaises(queue):
+    """ map resubmits a failed job and raises once it has failed on every attempt, rather than waiting. """
+    Q, store = queue
+    jobs = [("growth", "9", dict())]
+    raised = []
+
+    def run():
+        try:
+            Q.map(jobs, store)
+        except RuntimeError as err:
+            raised.append(str(err))
+
+    thread = Thread(target=run)
+    thread.start()
+    while jobKey(jobs[0]) not in Q.status():
+        time.sleep(0.01)
+
+    Q.work(store.directory)
+    thread.join(5.0)
+
+    assert raised and "attempt 2" in raised[0]
+
+
+def test_deadWorker(queue):
+    """ A job claimed by a worker that stopped is queued again and finished by another. """
+    Q, store = queue
+    jobs = [("growth", "0", dict())]
+    Q.submit(jobs)
+
+    assert Q.claim("dead") is not None
+    assert Q.claim("alive") is None
+
+    Q.timeout = 0.0
+    Q.work(store.directory)
+
+    assert Q.map(jobs, store) == [jobKey(jobs[0])]
@@ -0,0 +1,42 @@
+"""
+Check the Laplace and PSIS sampler on a known target and on the dose-response model.
+"""
+import numpy as np
+from ..laplace import laplaceSample
+from ..pymcDoseResponse import doseResponseModel
+
+
+def test_gaussianTarget():
+    """ On a correlated Gaussian, k-hat is small and the draws have the right moments. """
+    mean = np.array([1.0, -2.0, 0.5])
+    cov = np.array([[1.0, 0.8, 0.0], [0.8, 1.0, 0.3], [0.0, 0.3, 0.5]])
+    prec = np.linalg.inv(cov)
+
+    def logp(x):
+        return -0.5 * np.sum((x - mean) @ prec * (x - mean), axis=1)
+
+    draws, khat = laplaceSample(logp, np.random.RandomState(0).normal(size=(20, 3)), seed=0)
+
+    assert khat < 0.7
+    np.testing.assert_allclose(np.mean(draws, axis=0), mean, atol=0.1)
+    np.testing.assert_allclose(np.cov(draws, rowvar=False), cov, atol=0.1)
+
+
+def test_doseResponseKhat():
+    """ The DOX fit of Figure 1 is covered by the proposal, without falling back to NUTS. """
+    M = doseResponseModel("DOX")
+
+    for seed in range(3):
+        M.fitLaplace(seed=seed, fallback=False)
+        assert M.khat < 0.7
+
+
+def test_kineticSingleDrug():
+    """ The kinetic fit of one drug gives scalar draws of every parameter, including the untreated growth rate. """
+    M = doseResponseModel("DOX", kinetic=True)
+
+    for seed in range(3):
+        M.fitLaplace(draws=1000, seed=seed, fallback=False)
+        assert M.khat < 0.7
+        assert all(value.shape == (1000,) for value in M.trace.values())
+        assert set(M.trace) == {"IC50s", "Emin_growth", "Emax_death", "hill", "Emax_growth"}
@@ -0,0 +1,36 @@
+"""
+Check the arrangement of archive experiments for fitting.
+"""
+import numpy as np
+import pandas as pd
+from ..legacyData import experimentTable, growthModel
+
+
+def archive(missing):
+    """ Archive rows of one experiment with three conditions and four times, leaving out the (channel, column) pairs in missing. """
+    rows = []
+    for channel in ("confl", "apop", "dna", "ovlp"):
+        for column, (drug, dose) in enumerate([("Control", 0.0), ("DOX", 10.0), ("DOX", 100.0)], 2):
+            for elapsed in (0.0, 3.0, 6.0, 9.0):
+                value = np.nan if (channel, column) in missing else 10.0 + elapsed
+                rows.append(("exp", "H1299", channel, "confluence", column, drug, drug, dose, "nM", 1, elapsed, value))
+
+    columns = ["experiment", "cellLine", "channel", "quantity", "column", "condition", "drug", "dose", "unit", "replicate", "elapsed", "value"]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def test_incompleteChannels():
+    """ A partially exported overlap channel is dropped, and a condition with missing phase values with it. """
+    doses, _, timeV, expTable, _ = experimentTable(archive({("ovlp", 3), ("confl", 4)}), "exp")
+
+    assert doses == [0.0, 10.0]
+    assert set(expTable) == {"confl", "apop", "dna"}
+    assert all(value.shape == (2 * timeV.size,) and np.all(np.isfinite(value)) for value in expTable.values())
+
+
+def test_growthModel():
+    """ The model of an archive experiment only keeps the overlap channel with overlap. """
+    assert "ovlp" not in growthModel("exp", archive(set())).expTable
+
+    M = growthModel("exp", archive(set()), overlap=True)
+    assert M.overlap and M.expTable["ovlp"].shape == M.expTable["confl"].shape
@@ -0,0 +1,39 @@
+"""
+Check the compiled growth posterior against the pymc3 model, and its gradient against finite differences.
+"""
+import numpy as np
+from ..pymcGrowth import GrowthModel, build_model
+from ..numbaGrowth import NumbaGrowthPosterior
+from .test_numpyGrowth import pymcPoint
+
+
+def test_valueMatchesModel():
+    """ The compiled log posterior differs from that of pymcGrowth.build_model by a constant, with either noise model. """
+    M = GrowthModel("101117_H1299", overlap=True)
+
+    for noise in ("std", "profile"):
+        post = NumbaGrowthPosterior(M.conv0, M.timeV, M.expTable, noise, overlap=True)
+        model = build_model(M.conv0, M.doses, M.timeV, M.expTable, noise=noise, overlap=True)
+
+        z = post.priorDraws(5, np.random.RandomState(0))
+        ours = np.array([post.value(zz) for zz in z])
+        theirs = np.array([model.logp(pymcPoint(post, zz)) for zz in z])
+
+        np.testing.assert_allclose(ours - ours[0], theirs - theirs[0], rtol=1e-8, atol=1e-6)
+        np.testing.assert_allclose(ours, post.logp(z), rtol=1e-10)
+
+
+def test_gradientMatchesDifferences():
+    """ The analytic gradient matches central finite differences, with either noise model. """
+    M = GrowthModel("101117_H1299", overlap=True)
+
+    for noise in ("std", "profile"):
+        post = NumbaGrowthPosterior(M.conv0, M.timeV, M.expTable, noise, overlap=True)
+        z = post.priorDraws(1, np.random.RandomState(1))[0]
+
+        value, grad = post.valueAndGrad(z)
+        step = 1e-6 * np.eye(z.size)
+        differences = np.array([(post.value(z + h) - post.value(z - h)) / 2e-6 for h in step])
+
+        assert np.isclose(value, post.value(z))
+        np.testing.assert_allclose(grad, differences, rtol=1e-5, atol=1e-3)
@@ -0,0 +1,38 @@
+"""
+Check the NumPy growth posterior against the pymc3 model it mirrors.
+"""
+import numpy as np
+from ..pymcGrowth import GrowthModel, build_model
+from ..numpyGrowth import GrowthPosterior
+
+
+def pymcPoint(post, z):
+    """ The pymc3 free variables of the GrowthPosterior vector z. """
+    scalars, zApop, zDiv, zDeath = post.split(z[None, :])
+
+    point = {name + "_log__": value for name, value in zip(post.scalarNames, scalars[0])}
+    point.update({"apopfrac_logodds__": zApop[0], "div_interval__": zDiv[0], "deathRate_log__": zDeath[0]})
+    return point
+
+
+def modelDifferences(post, model, z):
+    """ Log posterior of each vector relative to the first, from GrowthPosterior and from the pymc3 model. """
+    ours = post.logp(z)
+    theirs = np.array([model.logp(pymcPoint(post, zz)) for zz in z])
+
+    return ours - ours[0], theirs - theirs[0]
+
+
+def test_logpMatchesModel():
+    """ The log posterior differs from that of pymcGrowth.build_model by a constant, with either noise model and with or without overlap. """
+    M = GrowthModel("101117_H1299", overlap=True)
+
+    for overlap in (False, True):
+        z = GrowthPosterior(M.conv0, M.timeV, M.expTable, overlap=overlap).priorDraws(5, np.random.RandomState(0))
+
+        for noise in ("std", "profile"):
+            post = GrowthPosterior(M.conv0, M.timeV, M.expTable, noise, overlap)
+            model = build_model(M.conv0, M.doses, M.timeV, M.expTable, noise=noise, overlap=overlap)
+
+            ours, theirs = modelDifferences(post, model, z)
+            np.testing.assert_allclose(ours, theirs, rtol=1e-8, atol=1e-6)
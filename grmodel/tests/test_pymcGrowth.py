@@ -0,0 +1,13 @@
+"""
+Check the loading of growth experiments.
+"""
+from ..pymcGrowth import GrowthModel
+
+
+def test_overlapLoaded():
+    """ The overlap channel of an experiment that measured it is read on request, with the layout of the other channels. """
+    assert "ovlp" not in GrowthModel("101117_H1299").expTable
+
+    M = GrowthModel("101117_H1299", overlap=True)
+    assert M.overlap and "ovlp" in M.expTable
+    assert M.expTable["ovlp"].shape == M.expTable["confl"].shape
@@ -0,0 +1,50 @@
+"""
+Check that the posterior service reads stored fits and tells bad queries from failed fits.
+"""
+import json
+import numpy as np
+import pytest
+from .. import executors
+from ..results import FitResult
+from ..service import PosteriorService, QueryError, errorResponse
+
+
+def growthResult(draws=50, conditions=3):
+    """ A growth FitResult with random draws of the parameters the service reads. """
+    random = np.random.RandomState(0)
+    posterior = {name: random.uniform(0.01, 0.1, (draws, conditions)) for name in ("div", "deathRate", "apopfrac")}
+    posterior.update({name: random.uniform(0.1, 1.0, draws) for name in ("confl_conv", "apop_conv", "dna_conv", "apop_offset", "dna_offset", "d")})
+
+    return FitResult("stored", ["drug"] * conditions, [0.0, 1.0, 10.0], np.linspace(0.0, 72.0, 10), posterior)
+
+
+def test_storedFit(tmp_path, monkeypatch):
+    """ A fit already in the store is answered without fitting. """
+    def runJob(job):
+        raise AssertionError("refit " + str(job))
+
+    monkeypatch.setattr(executors, "runJob", runJob)
+    store = executors.PosteriorStore(str(tmp_path))
+    store.save(executors.jobKey(("growth", "stored", dict())), growthResult())
+
+    out = json.loads(PosteriorService(store=str(tmp_path)).query("/summary", {"file": "stored"}))
+    assert out["doses"] == [0.0, 1.0, 10.0]
+    assert len(out["div"]["median"]) == 3
+
+
+def test_errorStatus(monkeypatch):
+    """ Bad parameters are 400, unknown paths 404 and errors raised by the fit itself 500, even if ValueError. """
+    def runJob(job):
+        raise ValueError("fit diverged")
+
+    monkeypatch.setattr(executors, "runJob", runJob)
+    service = PosteriorService()
+
+    for path, params, status in (("/summary", {}, 400), ("/summary", {"file": "x", "prob": "high"}, 400), ("/other", {"file": "x"}, 404)):
+        with pytest.raises(QueryError) as err:
+            service.query(path, params)
+        assert errorResponse(path, err.value)[0] == status
+
+    with pytest.raises(ValueError) as err:
+        service.query("/summary", {"file": "x"})
+    assert errorResponse("/summary", err.value)[0] == 500
@@ -0,0 +1,67 @@
+"""
+Check the synergy scores on data simulated from the interaction model.
+"""
+import numpy as np
+import pytest
+from ..pymcGrowth import numpyCore, convSignal
+from ..pymcInteraction import blissRates
+from ..synergy import observedEffect, references, synergyScores
+
+timeV = np.arange(0.0, 75.0, 3.0)
+doses = np.array([0.0, 0.3, 1.0, 3.0, 10.0])
+X = np.array([(x1, x2) for x1 in doses for x2 in doses]) + 0.01
+
+
+def modelSamples(EmaxDeath):
+    """ One posterior draw of two drugs, with the conversions at the prior centers of conv0 = 1. """
+    samples = {
+        "hill": [[2.0, 1.5]], "IC50": [[1.0, 2.0]], "EmaxGrowth": [[0.6, 0.8]], "EmaxDeath": [[EmaxDeath, EmaxDeath / 2.0]],
+        "GrowthCon": [0.03], "apopfrac": [[0.7]], "d": [0.01],
+        "confl_conv": [1.0], "apop_conv": [np.exp(-2.06)], "dna_conv": [np.exp(-1.85)], "apop_offset": [0.1], "dna_offset": [0.1],
+    }
+    return {key: np.array(value) for key, value in samples.items()}
+
+
+def simulate(samples, growth, death):
+    """ Noise-free phase, red and green of every condition with the given rates. """
+    conversions = ((samples["confl_conv"][0], samples["apop_conv"][0], samples["dna_conv"][0]), (samples["apop_offset"][0], samples["dna_offset"][0]))
+    phase, green, red = convSignal(*numpyCore(timeV, growth, death, samples["apopfrac"][0, 0], samples["d"][0]), conversions)
+
+    return phase, red, green
+
+
+@pytest.mark.parametrize("EmaxDeath", [0.01, 0.03])
+def test_observedEffectRecoversRates(EmaxDeath):
+    """ The observed effect is the net growth rate effect of the model, including where dead cells keep confluence up. """
+    samples = modelSamples(EmaxDeath)
+    growth, death, _ = (x[0] for x in blissRates(samples, X))
+
+    effect = observedEffect(X, timeV, *simulate(samples, growth, death), samples)
+    assert effect.shape == (1, X.shape[0])
+    np.testing.assert_allclose(effect[0], 1.0 - (growth - death) / samples["GrowthCon"][0], atol=1e-4)
+
+
+def test_blissExcessZero():
+    """ Conditions whose net growth rate follows the Bliss reference have no Bliss excess. """
+    samples = modelSamples(0.02)
+    death = blissRates(samples, X)[1][0]
+    growth = samples["GrowthCon"][0] * (1.0 - references(samples, X)["bliss"][0]) + death
+
+    scores = synergyScores(samples, X, timeV, *simulate(samples, growth, death))
+    np.testing.assert_allclose(scores["bliss"], 0.0, atol=1e-3)
+
+
+def test_excessPerDraw():
+    """ The observed effect is relative to the untreated growth rate of each draw, so the excess has a posterior interval. """
+    samples = modelSamples(0.02)
+    death = blissRates(samples, X)[1][0]
+    growth = samples["GrowthCon"][0] * (1.0 - references(samples, X)["bliss"][0]) + death
+
+    draws = {key: np.repeat(value, 3, axis=0) for key, value in samples.items()}
+    draws["GrowthCon"] = samples["GrowthCon"] * np.array([0.9, 1.0, 1.1])
+
+    effect = observedEffect(X, timeV, *simulate(samples, growth, death), draws)
+    assert np.all(np.diff(effect[:, -1]) > 0.0)
+
+    scores = synergyScores(draws, X, timeV, *simulate(samples, growth, death), level=0.5)
+    assert np.all(scores["bliss_lower"] < scores["bliss_upper"])
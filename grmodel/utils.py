@@ -2,8 +2,23 @@
 Various utility functions, probably mostly for plotting.
 """
 from collections import OrderedDict
+import numpy as np
 import pandas as pd
-from .pymcGrowth import GrowthModel
+from .results import fitGrowth
+
+
+def hdi(x, prob=0.95, axis=0):
+    """ Highest density interval of the draws along axis, vectorized over all other axes. """
+    x = np.sort(np.moveaxis(np.asarray(x), axis, 0), axis=0)
+    nIn = int(np.floor(prob * x.shape[0]))
+
+    # Narrowest window containing nIn + 1 sorted draws
+    widths = x[nIn:] - x[: x.shape[0] - nIn]
+    start = np.expand_dims(np.argmin(widths, axis=0), 0)
+
+    lower = np.take_along_axis(x, start, axis=0)[0]
+    upper = np.take_along_axis(x, start + nIn, axis=0)[0]
+    return lower, upper
 
 
 def reformatData(dfd, alldoses, alldrugs, drug, params):
@@ -46,19 +61,19 @@ def reformatData(dfd, alldoses, alldrugs, drug, params):
     return dfplot
 
 
-def violinplot(filename, swapDrugs=False):
+def violinplot(filename, swapDrugs=False, result=None):
     """
     Takes in a list of drugs
     Makes 1*len(parameters) violinplots for each drug
+    A FitResult of filename can be given as result, e.g. from a worker process, to skip fitting here.
     """
 
     # Load model and dataset
-    # Read in dataframe
-    classM = GrowthModel(filename)
-    classM.performFit()
+    if result is None:
+        result = fitGrowth(filename)
 
     # Get a list of drugs
-    drugs = list(OrderedDict.fromkeys(classM.drugs))
+    drugs = list(OrderedDict.fromkeys(result.drugs))
     drugs.remove("Control")
 
     if swapDrugs:
@@ -69,7 +84,8 @@ def violinplot(filename, swapDrugs=False):
     dfdict = {}
 
     # Interate over each drug
+    df = result.dataframe()
     for drug in drugs:
-        dfdict[drug] = reformatData(classM.df, classM.doses, classM.drugs, drug, params)
+        dfdict[drug] = reformatData(df, list(result.doses), result.drugs, drug, params)
 
     return (dfdict, drugs, params)